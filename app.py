@@ -1,13 +1,25 @@
 """Serves the the front page, discovery files, and OAuth flows.
 """
+import collections
+from concurrent import futures
 import datetime
 import functools
 import importlib
 import logging
+import threading
+import time
 import urllib.parse
 from xml.etree import ElementTree
 
-from flask import abort, Flask, redirect, render_template, request
+from flask import (
+  abort,
+  Flask,
+  redirect,
+  render_template,
+  request,
+  Response,
+  stream_with_context,
+)
 from flask_caching import Cache
 import flask_gae_static
 from google.cloud import ndb
@@ -127,6 +139,20 @@ XML_TEMPLATE = """\
 """
 
 RESPONSE_CACHE_TIME = datetime.timedelta(minutes=10)
+# streamed atom and html output is rendered up to this many characters before
+# sending the status line, so that conversion errors in small feeds or early
+# items can still return HTTP 400
+STREAM_FIRST_CHUNK_SIZE = 16 * 1024
+
+# /urls limits
+URLS_MAX = 50
+URLS_PER_HOST = 2
+URLS_DEADLINE = datetime.timedelta(seconds=20)
+URLS_THREADS = 20
+# shared across requests so that concurrent /urls requests can't pile up
+# unbounded fetch threads
+URLS_EXECUTOR = futures.ThreadPoolExecutor(max_workers=URLS_THREADS,
+                                           thread_name_prefix='urls')
 
 
 app = Flask(__name__, static_folder=None)
@@ -146,6 +172,75 @@ app.wsgi_app = flask_util.ndb_context_middleware(
 
 cache = Cache(app)
 
+
+def skip_response_cache():
+  """Returns True if the current response won't be stored in the response cache.
+
+  True for requests with ``cache=false`` or any cookies, like
+  :func:`oauth_dropins.webutil.flask_util.cached`, and for the ``NullCache``
+  that we use in dev and tests. :func:`cached_response` bypasses the cache
+  based on this, and :func:`make_response` streams based on it, so the two
+  can't disagree.
+  """
+  return (app.config.get('CACHE_TYPE') == 'NullCache'
+          or request.args.get('cache', '').lower() == 'false'
+          or bool(request.cookies))
+
+
+def stream_response(chunks, headers):
+  """Returns a streamed Flask response for a generator of rendered output.
+
+  Renders the first :const:`STREAM_FIRST_CHUNK_SIZE` characters eagerly, so
+  that errors there propagate to the caller as usual. Errors after that happen
+  after the status line has been sent, so they're logged and end the response
+  early instead.
+
+  Args:
+    chunks (generator of str)
+    headers (dict): HTTP response headers
+
+  Returns:
+    flask.Response:
+  """
+  first = []
+  size = 0
+  for chunk in chunks:
+    first.append(chunk)
+    size += len(chunk)
+    if size >= STREAM_FIRST_CHUNK_SIZE:
+      break
+
+  def generate():
+    yield ''.join(first)
+    try:
+      yield from chunks
+    except Exception:
+      logger.warning('rendering streamed response failed, truncating',
+                     exc_info=True)
+
+  return Response(stream_with_context(generate()), headers=headers)
+
+
+def cached_response(fn):
+  """Caches a view's responses with :func:`flask_util.cached`.
+
+  Skips the cache entirely when :func:`skip_response_cache` returns True.
+  """
+  cached = flask_util.cached(cache, RESPONSE_CACHE_TIME, http_5xx=True)(fn)
+
+  @functools.wraps(fn)
+  def wrapper(*args, **kwargs):
+    if skip_response_cache():
+      return cached.uncached(*args, **kwargs)
+    return cached(*args, **kwargs)
+
+  return wrapper
+
+if app.config.get('CONVERSION_CACHE_SIZE'):
+  source.enable_conversion_cache(max_size=app.config['CONVERSION_CACHE_SIZE'])
+if app.config.get('AUTHOR_PAGE_TTL'):
+  microformats2.configure_author_cache(ttl=app.config['AUTHOR_PAGE_TTL'])
+
 util.set_user_agent('granary (https://granary.io/)')
 
 
@@ -202,7 +297,7 @@ def demo():
 
 
 @app.route('/url', methods=('GET', 'HEAD'))
-@flask_util.cached(cache, RESPONSE_CACHE_TIME, http_5xx=True)
+@cached_response
 def url():
   """Handles URL requests from the interactive demo form on the front page.
 
@@ -222,6 +317,12 @@ def url():
   if fragment and input != 'html':
       raise BadRequest('URL fragments only supported with input=html.')
 
+  count = request.values.get('count')
+  if count is not None:
+    if not util.is_int(count) or int(count) < 0:
+      raise BadRequest(f'Invalid count: {count} (should be positive int)')
+    count = int(count)
+
   headers = {}
   if input == 'as2':
     headers['Accept'] = as2.CONTENT_TYPE
@@ -234,6 +335,139 @@ def url():
     # do this manually so that 504s for timeouts get cached
     return flask_util.handle_exception(e)
 
+  activities, actor, title, hfeed = convert(resp, input, fragment=fragment,
+                                            count=count)
+  logger.info(f'Converted to AS1: {json_dumps(activities, indent=2)}')
+
+  return make_response(source.Source.make_activities_base_response(activities),
+                       url=resp.url, actor=actor, title=title, hfeed=hfeed)
+
+
+@app.route('/urls', methods=('GET', 'HEAD'))
+@cached_response
+def urls():
+  """Fetches, converts, and merges multiple URLs into a single feed.
+
+  Takes repeated ``url`` and ``input`` query params, paired up in order. If
+  there's only one ``input``, it applies to every URL. Fetches the URLs
+  concurrently, at most :const:`URLS_PER_HOST` at a time per host, and gives up
+  on any that haven't finished after :const:`URLS_DEADLINE`.
+
+  Merges the activities from every URL that succeeded, sorts them by
+  ``published``, newest first, and renders them in the requested ``output``
+  format. URLs that failed are reported in the response's ``failures`` field,
+  a list of ``{'url': ..., 'error': ...}`` dicts, and don't fail the request.
+  Since feed formats like Atom and RSS have nowhere to put ``failures``, every
+  output format also lists the failed URLs, comma-separated, in the
+  ``Granary-Failed-Urls`` response header.
+
+  Fetches run on the shared :const:`URLS_EXECUTOR` pool. Fetches that haven't
+  started by the deadline are cancelled, and ones that are still running are
+  abandoned: they stop before their next step and their results are dropped.
+  """
+  orig_urls = request.values.getlist('url')
+  inputs = request.values.getlist('input')
+  if not orig_urls:
+    raise BadRequest('Missing required parameter: url')
+  elif len(orig_urls) > URLS_MAX:
+    raise BadRequest(f'At most {URLS_MAX} urls allowed')
+  elif len(inputs) == 1:
+    inputs *= len(orig_urls)
+  elif len(inputs) != len(orig_urls):
+    raise BadRequest('Expected either one input or one per url')
+
+  for input in inputs:
+    if input not in INPUTS:
+      raise BadRequest(f'Invalid input: {input}, expected one of {INPUTS!r}')
+
+  host_limits = collections.defaultdict(
+    lambda: threading.BoundedSemaphore(URLS_PER_HOST))
+  for orig_url in orig_urls:
+    host_limits[urllib.parse.urlparse(orig_url).netloc]
+
+  deadline = time.monotonic() + URLS_DEADLINE.total_seconds()
+  abandoned = threading.Event()
+
+  def fetch_and_convert(orig_url, input):
+    headers = {'Accept': as2.CONTENT_TYPE} if input == 'as2' else {}
+    fragment = urllib.parse.urlparse(orig_url).fragment
+    if fragment and input != 'html':
+      raise BadRequest('URL fragments only supported with input=html.')
+
+    host_limit = host_limits[urllib.parse.urlparse(orig_url).netloc]
+    if not host_limit.acquire(timeout=max(deadline - time.monotonic(), 0)):
+      raise TimeoutError('Timed out')
+    try:
+      if abandoned.is_set():
+        raise TimeoutError('Timed out')
+      resp = util.requests_get(orig_url, headers=headers, gateway=True)
+    except ValueError as e:
+      raise BadRequest(f'Invalid url: {e}')
+    finally:
+      host_limit.release()
+
+    if abandoned.is_set():
+      raise TimeoutError('Timed out')
+    return convert(resp, input, fragment=fragment)
+
+  fetches = {URLS_EXECUTOR.submit(fetch_and_convert, u, input): u
+             for u, input in zip(orig_urls, inputs)}
+  done, not_done = futures.wait(fetches,
+                                timeout=URLS_DEADLINE.total_seconds())
+  # don't wait for stragglers. cancel the ones that haven't started yet and
+  # tell the running ones to stop at their next checkpoint.
+  abandoned.set()
+  for fetch in not_done:
+    fetch.cancel()
+
+  activities = []
+  failures = []
+  for fetch, orig_url in fetches.items():
+    if fetch in not_done:
+      failures.append({'url': orig_url, 'error': 'Timed out'})
+      continue
+    try:
+      activities.extend(fetch.result()[0])
+    except HTTPException as e:
+      failures.append({'url': orig_url, 'error': e.description})
+    except Exception as e:
+      logger.warning(f'Fetching {orig_url} failed', exc_info=True)
+      failures.append({'url': orig_url, 'error': str(e)})
+
+  def published(activity):
+    return (as1.get_object(activity).get('published')
+            or activity.get('published') or '')
+  activities.sort(key=published, reverse=True)
+
+  response = source.Source.make_activities_base_response(activities)
+  response['sorted'] = True
+  headers = {}
+  if failures:
+    response['failures'] = failures
+    # only ASCII is safe in HTTP headers. commas are quoted, so they separate
+    headers['Granary-Failed-Urls'] = ','.join(
+      urllib.parse.quote(f['url'], safe=':/?&=%#') for f in failures)
+  return make_response(response, title=f'Feed for {len(orig_urls)} URLs',
+                       headers=headers)
+
+
+def convert(resp, input, fragment=None, count=None):
+  """Converts a fetched URL's contents to ActivityStreams 1.
+
+  Args:
+    resp (requests.Response)
+    input (str): one of :const:`INPUTS`
+    fragment (str): optional element id to extract, only for ``input=html``
+    count (int): optional maximum number of items to convert. Only supported
+      for ``input=rss`` so far.
+
+  Returns:
+    (list of dict activities, dict actor, str title, dict hfeed) tuple. actor,
+    title, and hfeed may be None.
+
+  Raises:
+    werkzeug.exceptions.BadRequest: if the contents can't be parsed as ``input``
+  """
   final_url = resp.url
 
   # decode data
@@ -264,10 +498,11 @@ def url():
   hfeed = None
   if mf2:
     logger.info(f'Got mf2: {json_dumps(mf2, indent=2)}')
+    author_pages = {}
     def fetch_mf2_func(url):
       if util.domain_or_parent_in(urllib.parse.urlparse(url).netloc, SILO_DOMAINS):
         return {'items': [{'type': ['h-card'], 'properties': {'url': [url]}}]}
-      return util.fetch_mf2(url, gateway=True)
+      return microformats2.fetch_author_mf2(url, memo=author_pages, gateway=True)
 
     try:
       actor = microformats2.find_author(mf2, fetch_mf2_func=fetch_mf2_func)
@@ -283,7 +518,7 @@ def url():
       activities = [as2.to_as1(obj) for obj in body_items]
     elif input == 'atom':
       try:
-        activities = atom.atom_to_activities(resp.text)
+        activities = list(atom.iter_atom_activities(resp.iter_content(64 * 1024)))
       except ElementTree.ParseError as e:
         raise BadRequest(f'Could not parse {final_url} as XML: {e}')
       except ValueError as e:
@@ -300,19 +535,16 @@ def url():
       activities, actor = jsonfeed.jsonfeed_to_activities(body_json)
     elif input == 'rss':
       try:
-        activities = rss.to_activities(resp.text)
+        activities = list(rss.iter_activities(resp, count=count))
       except ElementTree.ParseError as e:
         raise BadRequest(f'Could not parse {final_url} as XML: {e}')
       except ValueError as e:
         raise BadRequest(f'Could not parse {final_url} as Atom: {e}')
   except ValueError as e:
     logger.warning('parsing input failed', exc_info=True)
-    return abort(400, f'Could not parse {final_url} as {input}: {str(e)}')
+    raise BadRequest(f'Could not parse {final_url} as {input}: {str(e)}')
 
-  logger.info(f'Converted to AS1: {json_dumps(activities, indent=2)}')
-
-  return make_response(source.Source.make_activities_base_response(activities),
-                       url=final_url, actor=actor, title=title, hfeed=hfeed)
+  return activities, actor, title, hfeed
 
 
 @app.route('/<any(scraped,html):_>', methods=('POST',))
@@ -367,7 +599,8 @@ def scraped(_):
                        actor=actor, title=title)
 
 
-def make_response(response, actor=None, url=None, title=None, hfeed=None):
+def make_response(response, actor=None, url=None, title=None, hfeed=None,
+                  headers=None):
   """Converts ActivityStreams activities and returns a Flask response.
 
   Args:
@@ -378,12 +611,13 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
     url: the input URL
     title: string, used in feed output (Atom, JSON Feed, RSS)
     hfeed: dict, parsed mf2 h-feed, if available
+    headers: dict, optional additional HTTP response headers
   """
   format = request.values.get('format') or request.values.get('output') or 'json'
   if format not in FORMATS:
     raise BadRequest(f'Invalid format: {format}, expected one of {FORMATS!r}')
 
-  headers = {}
+  headers = dict(headers or {})
   if 'plaintext' in request.values:
     # override content type
     headers['Content-Type'] = 'text/plain'
@@ -402,7 +636,8 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
 
     elif format == 'as2':
       response.update({
-        'items': [as2.from_as1(a) for a in activities],
+        'items': [source.cached_conversion(as2.from_as1, a)
+                  for a in activities],
         'totalItems': response.pop('totalResults', None),
         'updated': response.pop('updatedSince', None),
         'filtered': None,
@@ -411,6 +646,8 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
       return util.trim_nulls(response), headers
 
     elif format == 'bluesky':
+      # not cached because from_as1 fills in a missing createdAt with the
+      # current time
       return {'feed': [bluesky.from_as1(a) for a in activities]}, headers
 
     elif format == 'atom':
@@ -430,7 +667,10 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
         link_hub = urllib.parse.quote(hub, safe=':/?&=')
         headers['Link'].append(f'<{link_hub}>; rel="hub"')
 
-      return atom.activities_to_atom(
+      # stream the feed in chunks if it's not going to be cached, since the
+      # cache needs the whole body
+      stream = skip_response_cache()
+      feed = atom.activities_to_atom(
         activities, actor,
         host_url=url or request.host_url + '/',
         request_url=request.url,
@@ -438,7 +678,11 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
         title=title,
         rels={'hub': hub} if hub else None,
         reader=(reader == 'true'),
-      ), headers
+        stream=stream,
+      )
+      if stream:
+        return stream_response(feed, headers)
+      return feed, headers
 
     elif format == 'rss':
       if not title:
@@ -452,11 +696,17 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
       return XML_TEMPLATE % util.to_xml(response), headers
 
     elif format == 'html':
-      return microformats2.activities_to_html(activities), headers
+      # stream if it's not going to be cached, like atom above
+      stream = skip_response_cache()
+      html = microformats2.activities_to_html(activities, stream=stream)
+      if stream:
+        return stream_response(html, headers)
+      return html, headers
 
     elif format in ('mf2-json', 'json-mf2'):
       return {
-        'items': [microformats2.activity_to_json(a) for a in activities],
+        'items': [source.cached_conversion(microformats2.activity_to_json, a)
+                  for a in activities],
       }, headers
 
     elif format == 'jsonfeed':
@@ -469,7 +719,8 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
 
     elif format == 'nostr':
       return {
-        'items': [nostr.from_as1(a) for a in activities],
+        'items': [source.cached_conversion(nostr.from_as1, a)
+                  for a in activities],
       }, headers
 
   except (ValueError, NotImplementedError) as e:
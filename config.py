@@ -11,4 +11,8 @@ if appengine_info.DEBUG:
 else:
   ENV = 'production'
   CACHE_TYPE = 'SimpleCache'
+  # max total size of serialized outputs in granary.source's conversion cache
+  CONVERSION_CACHE_SIZE = 20 * 1024 * 1024
+  # seconds to cache author pages in granary.microformats2.fetch_author_mf2
+  AUTHOR_PAGE_TTL = 10 * 60
   SECRET_KEY = util.read('flask_secret_key')
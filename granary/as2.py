@@ -8,7 +8,6 @@
    * http://activitystrea.ms/specs/json/1.0/
    * http://activitystrea.ms/specs/json/schema/activity-schema.html
 """
-import copy
 import datetime
 import logging
 import re
@@ -17,7 +16,7 @@ import urllib.parse
 from oauth_dropins.webutil import util
 
 from . import as1
-from .source import Source
+from .source import cached_parse_html, Source
 
 logger = logging.getLogger(__name__)
 
@@ -95,6 +94,9 @@ TYPE_TO_VERB.update({
 TYPES_WITH_OBJECT = {VERB_TO_TYPE[v] for v in as1.VERBS_WITH_OBJECT
                      if v in VERB_TO_TYPE}
 
+# values that util.trim_nulls removes
+NULLS = (None, {}, [], (), '', set(), frozenset())
+
 
 def get_urls(obj, key='url'):
   """Returns ``link['href']`` or ``link``, for each ``link`` in ``obj[key]``."""
@@ -102,9 +104,38 @@ def get_urls(obj, key='url'):
                           for link in util.get_list(obj, key))
 
 
+def _trim_nulls(obj, converted):
+  """Like :func:`util.trim_nulls`, but doesn't recurse into converted values.
+
+  :func:`from_as1` and :func:`to_as1` already trim their output, so trimming it
+  again at each level above would make conversion quadratic in nesting depth.
+
+  Args:
+    obj (dict)
+    converted (set of str): keys in ``obj`` whose values are output from
+      :func:`from_as1` or :func:`to_as1`, or lists of them
+
+  Returns:
+    dict: new dict
+  """
+  trimmed = {}
+  for key, val in obj.items():
+    if key not in converted:
+      val = util.trim_nulls(val)
+    elif isinstance(val, list):
+      val = [elem for elem in val if elem not in NULLS]
+    if val not in NULLS:
+      trimmed[key] = val
+  return trimmed
+
+
 def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   """Converts an ActivityStreams 1 activity or object to ActivityStreams 2.
 
+  Doesn't modify ``obj``. Nested objects are converted recursively, and
+  ``obj`` is only walked once; the output doesn't share any mutable values with
+  it.
+
   Args:
     obj (dict): AS1 activity or object
     type (str): default type if type inference can't determine a type.
@@ -120,7 +151,8 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   elif not isinstance(obj, dict):
     raise ValueError(f'Expected dict, got {obj!r}')
 
-  obj = copy.deepcopy(obj)
+  # shallow copy. only top level fields are popped or replaced below.
+  obj = dict(obj)
   actor = obj.get('actor')
   verb = obj.pop('verb', None)
   obj_type = obj.pop('objectType', None)
@@ -140,12 +172,12 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
     inner_objs = inner_objs[0]
     if verb == 'stop-following':
       type = 'Undo'
-      inner_objs = {
+      inner_objs = util.trim_nulls({
         '@context': context,
         'type': 'Follow',
         'actor': actor.get('id') if isinstance(actor, dict) else actor,
         'object': inner_objs.get('id'),
-      }
+      })
 
   replies = obj.get('replies', {})
 
@@ -158,7 +190,7 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   elif '@unlisted' in to_aliases and PUBLIC_AUDIENCE not in cc:
     cc.append(PUBLIC_AUDIENCE)
 
-  in_reply_to = util.trim_nulls(all_from_as1('inReplyTo'))
+  in_reply_to = [elem for elem in all_from_as1('inReplyTo') if elem not in NULLS]
   if len(in_reply_to) == 1:
     in_reply_to = in_reply_to[0]
 
@@ -222,6 +254,9 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   vote_field = 'oneOf' if voters == votes else 'anyOf'
   obj[vote_field] = all_from_as1('options')
 
+  converted = {'actor', 'attachment', 'attributedTo', 'inReplyTo', 'object',
+               'replies', 'tag', vote_field}
+
   # images; separate featured (aka header) and non-featured.
   images = util.get_list(obj, 'image')
   featured = []
@@ -240,10 +275,12 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
     if obj_type == 'person':
       obj['icon'] = from_as1((non_featured or featured)[0], type='Image',
                              context=None, top_level=False)
+      converted.add('icon')
     obj['image'] = [from_as1(img, type='Image', context=None)
                     for img in featured + non_featured]
     if len(obj['image']) == 1:
       obj['image'] = obj['image'][0]
+    converted.add('image')
 
   # other type-specific fields
   if obj_type == 'mention':
@@ -273,8 +310,9 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   loc = obj.get('location')
   if loc:
     obj['location'] = from_as1(loc, type='Place', context=None)
+    converted.add('location')
 
-  obj = util.trim_nulls(obj)
+  obj = _trim_nulls(obj, converted)
   if list(obj.keys()) == ['url']:
     return obj['url']
 
@@ -284,6 +322,10 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
 def to_as1(obj, use_type=True):
   """Converts an ActivityStreams 2 activity or object to ActivityStreams 1.
 
+  Doesn't modify ``obj``. Nested objects are converted recursively, and
+  ``obj`` is only walked once; the output doesn't share any mutable values with
+  it.
+
   Args:
     obj (dict): AS2 activity or object
     use_type (bool): whether to include ``objectType`` and ``verb``
@@ -302,7 +344,8 @@ def to_as1(obj, use_type=True):
   elif not isinstance(obj, dict):
     raise ValueError(f'Expected dict, got {obj!r}')
 
-  obj = copy.deepcopy(obj)
+  # shallow copy. only top level fields are popped or replaced below.
+  obj = dict(obj)
   obj.pop('@context', None)
 
   # type to objectType + verb
@@ -349,7 +392,7 @@ def to_as1(obj, use_type=True):
     value = att.get('value')
     if (att.get('type') == 'PropertyValue' and name and name != 'Link'
         and value and isinstance(value, str)):
-      a = util.parse_html(value).find('a')
+      a = cached_parse_html(value).find('a')
       if a and a.get('href'):
         names[a['href']] = name
 
@@ -376,8 +419,8 @@ def to_as1(obj, use_type=True):
   icons = util.pop_list(obj, 'icon')
   images = util.pop_list(obj, 'image')
   # by convention, first element in AS2 images field is banner/header
-  if type == 'Person' and images:
-    images[0]['objectType'] = 'featured'
+  if type == 'Person' and images and isinstance(images[0], dict):
+    images[0] = {**images[0], 'objectType': 'featured'}
 
   img_atts = [a for a in attachments
               if a.get('type') == 'Image'
@@ -393,7 +436,7 @@ def to_as1(obj, use_type=True):
   inner_objs = all_to_as1('object')
   actor = to_as1(as1.get_object(obj, 'actor'))
 
-  if type in ('Create', 'Update'):
+  if type in ('Create', 'Update') and actor:
     for inner_obj in inner_objs:
       if inner_obj.get('objectType') not in as1.ACTOR_TYPES:
         inner_obj.setdefault('author', {}).update(actor)
@@ -405,10 +448,10 @@ def to_as1(obj, use_type=True):
         and inner_objs.get('verb') == 'follow'):
       obj['verb'] = 'stop-following'
       inner_inner_obj = as1.get_object(inner_objs)
-      inner_objs = {
+      inner_objs = util.trim_nulls({
         'id': (inner_inner_obj.get('id') or util.get_url(inner_inner_obj, 'url')
                if isinstance(inner_inner_obj, dict) else inner_inner_obj),
-      }
+      })
 
   # audience, public or unlisted or neither
   to = sorted(util.get_list(obj, 'to'))
@@ -453,27 +496,33 @@ def to_as1(obj, use_type=True):
     if duration:
       duration = duration.total_seconds()
 
-    obj.setdefault('stream', {
+    stream = obj['stream'] = dict(obj['stream']) if 'stream' in obj else {
       # file size in bytes. nonstandard, not in AS1 proper
       'size': obj.pop('size', None),
       'duration': duration or None,
-    })
-    obj['stream'].setdefault('url', obj.pop('url', None))
+    }
+    stream.setdefault('url', obj.pop('url', None))
 
   # mention
   elif type == 'Mention':
     obj['url'] = obj.pop('href', None)
 
+  converted = {'actor', 'attachments', 'image', 'inReplyTo', 'location',
+               'object', 'options', 'replies', 'tags'}
+
   # object author
   attrib = util.pop_list(obj, 'attributedTo')
   if attrib:
     if len(attrib) > 1:
       logger.warning(f'ActivityStreams 1 only supports single author; dropping extra attributedTo values: {attrib[1:]}')
     attrib_as1 = to_as1(attrib[0])
-    obj.setdefault('author', {}).update(attrib_as1 if isinstance(attrib_as1, dict)
-                                        else {'id': attrib_as1})
+    if not isinstance(attrib_as1, dict):
+      attrib_as1 = {'id': attrib_as1}
+    author = obj.get('author')
+    obj['author'] = {**util.trim_nulls(author), **attrib_as1} if author else attrib_as1
+    converted.add('author')
 
-  return util.trim_nulls(Source.postprocess_object(obj))
+  return _trim_nulls(Source.postprocess_object(obj, trim=False), converted)
 
 
 def is_public(activity):
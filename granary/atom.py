@@ -28,8 +28,12 @@ NAMESPACES = {
   'thr': 'http://purl.org/syndication/thread/1.0',
 }
 
+# templates ship with the package and don't change at runtime, so compile them
+# once and never stat them again. (get_template and {% include %} otherwise
+# check the file's mtime on every call.)
 jinja_env = jinja2.Environment(
-  loader=jinja2.PackageLoader(__package__, 'templates'), autoescape=True)
+  loader=jinja2.PackageLoader(__package__, 'templates'), autoescape=True,
+  auto_reload=False)
 
 
 def _encode_ampersands(text):
@@ -113,8 +117,64 @@ class Defaulter(collections.defaultdict):
     return super().__hash__() if self else None.__hash__()
 
 
+class DefaulterView(dict):
+  """Read-only, lazy alternative to :class:`Defaulter`.
+
+  Lookups that fail return an empty :class:`DefaulterView`, just like
+  :class:`Defaulter`, but nested dicts and lists are only wrapped when they're
+  actually accessed, one level at a time, instead of recursively copying the
+  whole object up front. Wrapped values are memoized on this view. The
+  underlying object is never modified.
+  """
+  __slots__ = ()
+
+  def __init__(self, init={}):
+    super().__init__(init)
+
+  @classmethod
+  def _wrap(cls, obj):
+    if isinstance(obj, dict) and not isinstance(obj, DefaulterView):
+      return DefaulterView(obj)
+    elif isinstance(obj, (tuple, list)):
+      return obj.__class__(cls._wrap(elem) for elem in obj)
+    return obj
+
+  def __getitem__(self, key):
+    if key not in self:
+      return DefaulterView()
+    val = super().__getitem__(key)
+    wrapped = self._wrap(val)
+    if wrapped is not val:
+      super().__setitem__(key, wrapped)
+    return wrapped
+
+  def get(self, key, default=None):
+    return self[key] if key in self else default
+
+  def values(self):
+    return [self[key] for key in self]
+
+  def items(self):
+    return [(key, self[key]) for key in self]
+
+  def _read_only(self, *args, **kwargs):
+    raise TypeError('DefaulterView is read-only')
+
+  __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = \
+    _read_only
+
+  def __str__(self):
+    return dict.__repr__(self) if self else ''
+
+  __eq__ = dict.__eq__
+
+  def __hash__(self):
+    return super().__hash__() if self else None.__hash__()
+
+
 def activities_to_atom(activities, actor, title=None, request_url=None,
-                       host_url=None, xml_base=None, rels=None, reader=True):
+                       host_url=None, xml_base=None, rels=None, reader=True,
+                       stream=False):
   """Converts ActivityStreams 1 activities to an Atom feed.
 
   Args:
@@ -131,9 +191,12 @@ def activities_to_atom(activities, actor, title=None, request_url=None,
       string URLs.
     reader (bool): whether the output will be rendered in a feed reader.
       Currently just includes location if True, not otherwise.
+    stream (bool): if True, returns a generator that renders and yields the
+      feed in chunks, one activity at a time, instead of a single string.
+      Errors while rendering an activity are then raised during iteration.
 
   Returns:
-    str: Atom XML
+    str or generator of str: Atom XML
   """
   # Strip query params from URLs so that we don't include access tokens, etc
   host_url = (_remove_query_params(host_url) if host_url
@@ -142,8 +205,11 @@ def activities_to_atom(activities, actor, title=None, request_url=None,
     request_url = host_url
 
   _prepare_actor(actor)
-  for a in activities:
-    _prepare_activity(a, reader=reader)
+
+  def items():
+    for a in activities:
+      _prepare_activity(a, reader=reader)
+      yield DefaulterView(a)
 
   updated = (as1.get_object(activities[0]).get('published', '')
              if activities else '')
@@ -151,10 +217,11 @@ def activities_to_atom(activities, actor, title=None, request_url=None,
   if actor is None:
     actor = {}
 
-  return jinja_env.get_template(FEED_TEMPLATE).render(
-    actor=Defaulter(actor),
+  template = jinja_env.get_template(FEED_TEMPLATE)
+  return (template.generate if stream else template.render)(
+    actor=DefaulterView(actor),
     host_url=host_url,
-    items=[Defaulter(a) for a in activities],
+    items=items(),
     mimetypes=mimetypes,
     rels=rels or {},
     request_url=request_url,
@@ -182,7 +249,7 @@ def activity_to_atom(activity, xml_base=None, reader=True):
   """
   _prepare_activity(activity, reader=reader)
   return jinja_env.get_template(ENTRY_TEMPLATE).render(
-    activity=Defaulter(activity),
+    activity=DefaulterView(activity),
     mimetypes=mimetypes,
     VERBS_WITH_OBJECT=as1.VERBS_WITH_OBJECT,
     xml_base=xml_base,
@@ -207,6 +274,72 @@ def atom_to_activities(atom):
   return [_atom_to_activity(elem) for elem in feed if _tag(elem) == 'entry']
 
 
+def iter_atom_activities(atom, chunk_size=64 * 1024):
+  """Incrementally converts an Atom feed to ActivityStreams 1 activities.
+
+  Unlike :func:`atom_to_activities`, this never builds the whole document
+  tree. It parses the feed with :class:`xml.etree.ElementTree.XMLPullParser`,
+  yields one activity per top-level ``<entry>`` as soon as that entry is
+  complete, and then discards it, so memory use stays flat regardless of feed
+  size.
+
+  Args:
+    atom (bytes, str, file-like object, or iterable of bytes): Atom document
+      with top-level ``<feed>`` element. File-like objects are read in
+      ``chunk_size`` pieces; iterables, eg
+      :meth:`requests.Response.iter_content`, are consumed as they arrive.
+    chunk_size (int): read size for file-like objects
+
+  Yields:
+    dict: ActivityStreams activity
+
+  Raises:
+    ValueError: if the root element isn't ``<feed>``
+    xml.etree.ElementTree.ParseError: if the document isn't valid XML
+  """
+  if isinstance(atom, str):
+    chunks = [atom.encode('utf-8')]
+  elif isinstance(atom, (bytes, bytearray)):
+    chunks = [atom]
+  elif hasattr(atom, 'read'):
+    chunks = iter(lambda: atom.read(chunk_size), b'')
+  else:
+    chunks = atom
+
+  parser = ElementTree.XMLPullParser(events=('start', 'end'))
+  feed = None
+  depth = 0
+
+  def events():
+    nonlocal feed, depth
+    for event, elem in parser.read_events():
+      if event == 'start':
+        if feed is None:
+          if _tag(elem) != 'feed':
+            raise ValueError(f'Expected root feed tag; got {elem.tag}')
+          feed = elem
+        depth += 1
+        continue
+
+      depth -= 1
+      if depth == 1:
+        # top-level child of <feed>. convert entries, then drop them all so
+        # that the tree never grows past one child.
+        if _tag(elem) == 'entry':
+          yield _atom_to_activity(elem)
+        elem.clear()
+        feed.remove(elem)
+
+  for chunk in chunks:
+    if isinstance(chunk, str):
+      chunk = chunk.encode('utf-8')
+    parser.feed(chunk)
+    yield from events()
+
+  parser.close()
+  yield from events()
+
+
 def atom_to_activity(atom):
   """Converts an Atom entry to an ActivityStreams 1 activity.
 
@@ -334,7 +467,8 @@ def html_to_atom(html, url=None, fetch_author=False, reader=True):
     assert url, 'fetch_author=True requires url!'
 
   parsed = util.parse_mf2(html, url=url)
-  actor = microformats2.find_author(parsed, fetch_mf2_func=util.fetch_mf2)
+  actor = microformats2.find_author(
+    parsed, fetch_mf2_func=microformats2.fetch_author_mf2)
 
   return activities_to_atom(
     microformats2.html_to_activities(html, url, actor),
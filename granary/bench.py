@@ -0,0 +1,443 @@
+"""Benchmarks granary's converters over the canned test data corpus.
+
+Usage::
+
+    python -m granary.bench [--sizes 1000 10000 100000] [--depths 10 50]
+                            [--baseline FILE] [--save FILE] [--only SUBSTRING]
+
+Replays each converter over every matching fixture in ``granary/tests/testdata``
+that it supports, then over synthetic feeds of each ``--sizes`` number of items
+built by cycling through the ``*.as.json`` fixtures, then over synthetic reply
+threads nested each ``--depths`` levels deep. Reports throughput, p50 and p99 latency, and
+peak memory allocated during each converter's run, measured with
+:mod:`tracemalloc` in a separate, untimed pass.
+
+``--save`` writes the results as JSON. ``--baseline`` compares against a file
+written by ``--save`` and exits with status 1 if any converter's throughput
+dropped, or its peak memory grew, by more than ``--threshold``.
+"""
+import argparse
+import copy
+import functools
+import glob
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from oauth_dropins.webutil.util import json_dumps, json_loads
+
+from . import as2, atom, bluesky, jsonfeed, microformats2, rss
+
+logger = logging.getLogger(__name__)
+
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), 'tests', 'testdata')
+DEFAULT_SIZES = (1000,)
+DEFAULT_DEPTHS = (10, 50)
+DEFAULT_THRESHOLD = .2
+
+ACTOR = {
+  'objectType': 'person',
+  'displayName': 'Ms. Bench',
+  'url': 'https://bench.example/',
+}
+
+# name, input fixture extension, function that converts one decoded fixture
+CORPUS_CONVERTERS = (
+  ('microformats2.object_to_json', 'as.json', microformats2.object_to_json),
+  ('microformats2.object_to_html', 'as.json', microformats2.object_to_html),
+  ('microformats2.json_to_object', 'mf2.json', microformats2.json_to_object),
+  ('microformats2.json_to_html', 'mf2.json', microformats2.json_to_html),
+  ('as2.from_as1', 'as.json', as2.from_as1),
+  ('as2.to_as1', 'as2.json', as2.to_as1),
+  ('bluesky.from_as1', 'as.json', bluesky.from_as1),
+  ('bluesky.to_as1', 'bsky.json', bluesky.to_as1),
+  ('jsonfeed.activities_to_jsonfeed', 'as.json',
+   lambda obj: jsonfeed.activities_to_jsonfeed([{'object': obj}], ACTOR)),
+  ('jsonfeed.jsonfeed_to_activities', 'feed.json',
+   jsonfeed.jsonfeed_to_activities),
+  ('rss.to_activities', 'rss.xml', rss.to_activities),
+)
+
+# name, function that converts a list of AS1 activities to a feed
+FEED_WRITERS = (
+  ('atom.activities_to_atom',
+   lambda activities: atom.activities_to_atom(activities, ACTOR)),
+  ('rss.from_activities',
+   lambda activities: rss.from_activities(activities, ACTOR, title='Bench',
+                                          feed_url='https://bench.example/feed')),
+  ('jsonfeed.activities_to_jsonfeed',
+   lambda activities: jsonfeed.activities_to_jsonfeed(activities, ACTOR)),
+  ('microformats2.activities_to_html', microformats2.activities_to_html),
+)
+
+# name, function that converts a nested AS1 object to the input format, converter
+NESTED_CONVERTERS = (
+  ('as2.from_as1', lambda obj: obj, as2.from_as1),
+  ('as2.to_as1', as2.from_as1, as2.to_as1),
+)
+
+# name, name of the FEED_WRITERS entry whose output it reads, parser
+FEED_READERS = (
+  ('atom.atom_to_activities', 'atom.activities_to_atom', atom.atom_to_activities),
+  ('rss.to_activities', 'rss.from_activities', rss.to_activities),
+)
+
+
+@functools.lru_cache
+def load_fixtures(ext):
+  """Loads and decodes every test data file with a given extension.
+
+  Args:
+    ext (str): eg ``as.json``
+
+  Returns:
+    list of dict or str: decoded JSON, or raw text for HTML and XML. Cached, so
+    don't modify.
+  """
+  fixtures = []
+  for filename in sorted(glob.glob(os.path.join(TESTDATA_DIR, f'*.{ext}'))):
+    if os.path.basename(filename).split('.', 1)[1] != ext:
+      continue  # eg as-from-mf2.json when ext is mf2.json
+    with open(filename, encoding='utf-8') as f:
+      text = f.read()
+    if ext.endswith(('.html', '.xml')):
+      fixtures.append(text)
+      continue
+    try:
+      fixtures.append(json_loads(text))
+    except ValueError:
+      logger.warning(f"Skipping {filename}, couldn't decode JSON")
+  return fixtures
+
+
+def supported_fixtures(fn, fixtures):
+  """Returns the fixtures that a converter doesn't raise an exception on.
+
+  Some fixtures are types that a converter deliberately doesn't support, eg
+  ``bluesky.from_as1`` on events and RSVPs. Timing their error path would skew
+  the results.
+
+  Args:
+    fn (callable): converter
+    fixtures (sequence)
+
+  Returns:
+    list:
+  """
+  supported = []
+  for fixture in fixtures:
+    try:
+      fn(copy.deepcopy(fixture))
+    except Exception:
+      continue
+    supported.append(fixture)
+
+  if len(supported) < len(fixtures):
+    logger.info(f'Skipping {len(fixtures) - len(supported)} unsupported fixtures')
+  return supported
+
+
+@functools.lru_cache
+def _feed_fixtures():
+  """Returns the ``*.as.json`` fixtures that every feed writer can convert."""
+  activities = []
+  for obj in load_fixtures('as.json'):
+    if not isinstance(obj, dict):
+      continue
+    if obj.get('objectType') != 'activity':
+      obj = {'objectType': 'activity', 'verb': 'post', 'actor': ACTOR,
+             'object': obj}
+    try:
+      for _, fn in FEED_WRITERS:
+        fn([copy.deepcopy(obj)])
+    except Exception:
+      continue
+    activities.append(obj)
+  return activities
+
+
+def scaled_activities(size):
+  """Builds a synthetic list of AS1 activities by cycling through fixtures.
+
+  Only uses fixtures that every feed writer can convert.
+
+  Args:
+    size (int): number of activities
+
+  Returns:
+    list of dict: AS1 activities, each with a unique id
+  """
+  fixtures = _feed_fixtures()
+  activities = []
+  for i in range(size):
+    activity = copy.deepcopy(fixtures[i % len(fixtures)])
+    activity['id'] = f'tag:bench.example,2023:{i}'
+    activities.append(activity)
+  return activities
+
+
+def nested_object(depth):
+  """Builds a synthetic AS1 reply thread nested ``depth`` levels deep.
+
+  Each level is a comment with an author, a tag, an attachment, and a reply,
+  and is ``inReplyTo`` the level below it.
+
+  Args:
+    depth (int): number of levels
+
+  Returns:
+    dict: AS1 object
+  """
+  obj = {
+    'objectType': 'note',
+    'id': 'tag:bench.example,2023:0',
+    'content': 'Original post',
+    'author': ACTOR,
+  }
+  for i in range(1, depth):
+    obj = {
+      'objectType': 'comment',
+      'id': f'tag:bench.example,2023:{i}',
+      'content': f'Reply #{i}',
+      'author': {
+        'objectType': 'person',
+        'id': f'https://bench.example/user/{i}',
+        'displayName': f'User {i}',
+        'image': [{'url': f'https://bench.example/user/{i}.jpg'}],
+      },
+      'inReplyTo': [obj],
+      'tags': [{'objectType': 'hashtag', 'displayName': f'tag{i}'}],
+      'attachments': [{
+        'objectType': 'note',
+        'content': 'Quoted',
+        'url': f'https://bench.example/quote/{i}',
+      }],
+      'replies': {
+        'totalItems': 1,
+        'items': [{'objectType': 'comment', 'content': 'Me too'}],
+      },
+    }
+  return obj
+
+
+def peak_mem_kb(fn, inputs):
+  """Returns the most memory allocated by ``fn`` during any one call, in KB.
+
+  Uses :mod:`tracemalloc`, which only sees allocations made while it's
+  tracing, so unlike process RSS, this doesn't include earlier benchmarks.
+  Tracing slows everything down, so this runs separately from the timing.
+
+  Args:
+    fn (callable): takes one input
+    inputs (sequence)
+
+  Returns:
+    float:
+  """
+  already_tracing = tracemalloc.is_tracing()
+  if not already_tracing:
+    tracemalloc.start()
+
+  peak = 0
+  try:
+    for input in inputs:
+      input = copy.deepcopy(input)
+      tracemalloc.reset_peak()
+      baseline, _ = tracemalloc.get_traced_memory()
+      try:
+        fn(input)
+      except Exception:
+        pass
+      peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+  finally:
+    if not already_tracing:
+      tracemalloc.stop()
+
+  return round(peak / 1024, 1)
+
+
+def measure(fn, inputs, items_per_input=1):
+  """Times ``fn`` on each input.
+
+  Each input is deep copied before the call, outside the timing, since some
+  converters modify their input.
+
+  Args:
+    fn (callable): takes one input
+    inputs (sequence)
+    items_per_input (int): number of items in each input, for throughput
+
+  Returns:
+    dict: results with keys ``calls``, ``errors``, ``items_per_sec``,
+    ``p50_ms``, ``p99_ms``, ``peak_mem_kb``
+  """
+  latencies = []
+  errors = 0
+  for input in inputs:
+    input = copy.deepcopy(input)
+    start = time.perf_counter()
+    try:
+      fn(input)
+    except Exception:
+      errors += 1
+      logger.debug('converter failed', exc_info=True)
+      continue
+    latencies.append(time.perf_counter() - start)
+
+  total = sum(latencies)
+  return {
+    'calls': len(inputs),
+    'errors': errors,
+    'items_per_sec': (round(len(latencies) * items_per_input / total, 1)
+                      if total else None),
+    'p50_ms': percentile_ms(latencies, 50),
+    'p99_ms': percentile_ms(latencies, 99),
+    'peak_mem_kb': peak_mem_kb(fn, inputs),
+  }
+
+
+def percentile_ms(latencies, pct):
+  """Returns the given percentile of a list of seconds, in milliseconds."""
+  if not latencies:
+    return None
+  elif len(latencies) == 1:
+    return round(latencies[0] * 1000, 3)
+  return round(statistics.quantiles(latencies, n=100)[pct - 1] * 1000, 3)
+
+
+def run(sizes=DEFAULT_SIZES, depths=DEFAULT_DEPTHS, only=None):
+  """Runs all benchmarks.
+
+  Args:
+    sizes (sequence of int): synthetic feed sizes
+    depths (sequence of int): synthetic nested object depths
+    only (str): if provided, only run benchmarks whose names contain this
+
+  Returns:
+    dict: maps str benchmark name to results dict from :func:`measure`
+  """
+  results = {}
+
+  def bench(name, fn, inputs, items_per_input=1):
+    if only and only not in name:
+      return
+    logger.info(f'Running {name}')
+    results[name] = measure(fn, inputs, items_per_input=items_per_input)
+
+  for name, ext, fn in CORPUS_CONVERTERS:
+    if not only or only in f'corpus {name}':
+      bench(f'corpus {name}', fn, supported_fixtures(fn, load_fixtures(ext)))
+
+  writers = dict(FEED_WRITERS)
+  for size in sizes:
+    activities = scaled_activities(size)
+    for name, fn in FEED_WRITERS:
+      bench(f'{size} {name}', fn, [activities], items_per_input=size)
+
+    for name, writer, fn in FEED_READERS:
+      if not only or only in f'{size} {name}':
+        feed = writers[writer](copy.deepcopy(activities))
+        bench(f'{size} {name}', fn, [feed], items_per_input=size)
+
+  for depth in depths:
+    obj = nested_object(depth)
+    for name, prepare, fn in NESTED_CONVERTERS:
+      if not only or only in f'depth {depth} {name}':
+        bench(f'depth {depth} {name}', fn, [prepare(obj)], items_per_input=depth)
+
+  return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+  """Compares results against a baseline.
+
+  Args:
+    results (dict): from :func:`run`
+    baseline (dict): from an earlier :func:`run`
+    threshold (float): fraction of throughput that may be lost, or of peak
+      memory that may be gained, before it counts as a regression
+
+  Returns:
+    list of str: names of benchmarks that regressed
+  """
+  regressed = []
+  for name, result in results.items():
+    before = baseline.get(name, {}).get('items_per_sec')
+    after = result.get('items_per_sec')
+    if before and after is not None:
+      result['baseline_items_per_sec'] = before
+      if after < before * (1 - threshold):
+        regressed.append(name)
+        continue
+
+    before = baseline.get(name, {}).get('peak_mem_kb')
+    after = result.get('peak_mem_kb')
+    if before and after is not None and after > before * (1 + threshold):
+      regressed.append(name)
+  return regressed
+
+
+def format_results(results, regressed=()):
+  """Formats results as a plain text table.
+
+  Args:
+    results (dict): from :func:`run`
+    regressed (sequence of str): benchmark names to flag
+
+  Returns:
+    str
+  """
+  def fmt(val):
+    return '-' if val is None else str(val)
+
+  width = max([len(name) for name in results] + [9])
+  lines = [f'{"benchmark":<{width}}  {"items/s":>10}  {"baseline":>10}  '
+           f'{"p50 ms":>9}  {"p99 ms":>9}  {"peak KB":>9}  errors']
+  for name, r in results.items():
+    lines.append(
+      f'{name:<{width}}  {fmt(r["items_per_sec"]):>10}  '
+      f'{fmt(r.get("baseline_items_per_sec")):>10}  {fmt(r["p50_ms"]):>9}  '
+      f'{fmt(r["p99_ms"]):>9}  {fmt(r.get("peak_mem_kb")):>9}  {r["errors"]}'
+      + ('  REGRESSION' if name in regressed else ''))
+  return '\n'.join(lines)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    prog='python -m granary.bench',
+    description="Benchmarks granary's converters over its test data.")
+  parser.add_argument('--sizes', type=int, nargs='*', default=DEFAULT_SIZES,
+                      help='synthetic feed sizes, in items')
+  parser.add_argument('--depths', type=int, nargs='*', default=DEFAULT_DEPTHS,
+                      help='synthetic nested object depths, in levels')
+  parser.add_argument('--only', help='only run benchmarks whose names contain this')
+  parser.add_argument('--baseline', help='JSON file from --save to compare against')
+  parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                      help='throughput drop or peak memory growth, as a fraction, that counts as a regression')
+  parser.add_argument('--save', help='write results to this JSON file')
+  args = parser.parse_args(argv)
+
+  results = run(sizes=args.sizes, depths=args.depths, only=args.only)
+
+  regressed = []
+  if args.baseline:
+    with open(args.baseline, encoding='utf-8') as f:
+      regressed = compare(results, json_loads(f.read()), threshold=args.threshold)
+
+  print(format_results(results, regressed=regressed))
+
+  if args.save:
+    with open(args.save, 'w', encoding='utf-8') as f:
+      f.write(json_dumps(results, indent=2, sort_keys=True))
+
+  if regressed:
+    print(f'\n{len(regressed)} regression(s): {", ".join(regressed)}')
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -4,18 +4,39 @@
 * https://atproto.com/lexicons/app-bsky-actor
 * https://github.com/bluesky-social/atproto/tree/main/lexicons/app/bsky
 """
+import base64
+import collections
+import hashlib
 import json
 import logging
+import mmap
+import os
 import re
+import shutil
+import sqlite3
+import tempfile
+import threading
 from pathlib import Path
 import urllib.parse
 
+import dag_cbor
 from lexrpc import Client
+from lexrpc.client import LOGIN_NSID, REFRESH_NSID
+from multiformats import CID
 from oauth_dropins.webutil import util
 from oauth_dropins.webutil.util import trim_nulls
+import requests
 
 from . import as1
-from .source import FRIENDS, html_to_text, Source, OMIT_LINK
+from .source import (
+  FRIENDS,
+  html_to_text,
+  OMIT_LINK,
+  rate_limited_call,
+  RateLimited,
+  run_concurrently,
+  Source,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +62,21 @@ AT_URI_PATTERN = re.compile(rf"""
        (?:/([{_CHARS}]+))?)?  # rkey
     $""", re.VERBOSE)
 
+# maximum number of feed pages that Bluesky.get_activities_response fetches
+# while looking for min_id
+MAX_SINCE_PAGES = 10
+
+# record collections that repo_to_activities converts
+REPO_COLLECTIONS = (
+  'app.bsky.actor.profile',
+  'app.bsky.feed.like',
+  'app.bsky.feed.post',
+  'app.bsky.feed.repost',
+)
+
+# chunk size for copying non-seekable CAR streams to a temp file
+CAR_CHUNK_SIZE = 1024 * 1024
+
 # Maps AT Protocol NSID collections to path elements in bsky.app URLs.
 # Used in at_uri_to_web_url.
 #
@@ -88,6 +124,20 @@ BSKY_APP_URL_RE = re.compile(r"""
 DEFAULT_PDS_DOMAIN = 'bsky.social'
 DEFAULT_PDS = f'https://{DEFAULT_PDS_DOMAIN}/'
 DEFAULT_APPVIEW = 'https://api.bsky.app'
+PLC_DIRECTORY = 'https://plc.directory/'
+
+# identity cache defaults, in seconds and entries. see configure_identity_cache
+IDENTITY_TTL = 24 * 60 * 60
+IDENTITY_NEGATIVE_TTL = 5 * 60
+IDENTITY_CACHE_SIZE = 10000
+# when there's a shared backend, how long to trust the in-memory copy of a value
+# before reading the backend again, since other processes may have updated it
+IDENTITY_MEMORY_TTL = 5 * 60
+# refresh tokens are rotated on every refresh, and the rotated session is
+# written back to the cache, so this only needs to cover idle periods
+SESSION_TTL = 30 * 24 * 60 * 60
+# XRPC error names that mean a session's tokens are no longer valid
+AUTH_ERRORS = ('AuthenticationRequired', 'ExpiredToken', 'InvalidToken')
 
 
 def url_to_did_web(url):
@@ -236,6 +286,364 @@ def web_url_to_at_uri(url, handle=None, did=None):
     return f'at://{id}'
 
 
+class IdentityCache:
+  """In-memory LRU cache of identity lookups and sessions, with TTLs.
+
+  Values must be JSON-serializable. ``None`` values are negative results, eg
+  handles that don't resolve, and expire after ``negative_ttl``.
+
+  Attributes:
+    ttl (int): default lifetime of values, in seconds
+    negative_ttl (int): lifetime of ``None`` values, in seconds
+    max_size (int): maximum number of values to keep in memory
+    backend: optional shared second-level store, eg :class:`SqliteIdentityCache`
+    memory_ttl (int): if ``backend`` is set, maximum lifetime of values in
+      memory, in seconds, so that changes to the backend by other processes
+      show up here
+  """
+  _MISS = object()
+
+  def __init__(self, ttl=IDENTITY_TTL, negative_ttl=IDENTITY_NEGATIVE_TTL,
+               max_size=IDENTITY_CACHE_SIZE, backend=None,
+               memory_ttl=IDENTITY_MEMORY_TTL):
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self.max_size = max_size
+    self.backend = backend
+    self.memory_ttl = memory_ttl
+    # maps str key to (float expiration timestamp, value)
+    self._values = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, default=None):
+    """Returns the cached value for a key, or ``default`` if it's not cached.
+
+    A cached negative result is returned as ``None``.
+    """
+    now = util.now().timestamp()
+    with self._lock:
+      cached = self._values.get(key)
+      if cached:
+        expires, val = cached
+        if expires > now:
+          self._values.move_to_end(key)
+          return val
+        del self._values[key]
+
+    if self.backend:
+      cached = self.backend.get(key)
+      if cached:
+        expires, val = cached
+        if expires > now:
+          val = json.loads(val)
+          self._set(key, val, expires)
+          return val
+
+    return default
+
+  def set(self, key, val, ttl=None):
+    """Stores a value here and in the backend, if any.
+
+    Args:
+      key (str)
+      val: JSON-serializable value, or None for a negative result
+      ttl (int): lifetime in seconds. Defaults to ``ttl``, or ``negative_ttl``
+        if ``val`` is None.
+    """
+    if ttl is None:
+      ttl = self.negative_ttl if val is None else self.ttl
+    expires = util.now().timestamp() + ttl
+    self._set(key, val, expires)
+    if self.backend:
+      self.backend.set(key, json.dumps(val), expires)
+
+  def _set(self, key, val, expires):
+    if self.backend:
+      expires = min(expires, util.now().timestamp() + self.memory_ttl)
+    with self._lock:
+      self._values.pop(key, None)
+      self._values[key] = (expires, val)
+      while len(self._values) > self.max_size:
+        self._values.popitem(last=False)
+
+  def evict(self, key):
+    """Removes a value from memory only, so that the next get reads the backend."""
+    with self._lock:
+      self._values.pop(key, None)
+
+  def delete(self, key):
+    """Removes a value here and in the backend, if any."""
+    self.evict(key)
+    if self.backend:
+      self.backend.delete(key)
+
+  def lookup(self, key, fn):
+    """Returns the cached value for a key, or calls ``fn`` and caches its result.
+
+    If ``fn`` returns None, that's cached as a negative result. If it raises
+    an exception, nothing is cached.
+
+    Args:
+      key (str)
+      fn (callable): takes no arguments, returns the value
+    """
+    val = self.get(key, default=self._MISS)
+    if val is self._MISS:
+      val = fn()
+      self.set(key, val)
+    return val
+
+
+class SqliteIdentityCache:
+  """Stores identity cache values in a SQLite database.
+
+  Can be shared across processes and survives restarts. Expired values are
+  ignored on read and overwritten on write, but never deleted.
+
+  Note that this stores sessions, including refresh tokens, in plain text.
+
+  Attributes:
+    path (str): path to the database file. Created if it doesn't exist.
+  """
+  def __init__(self, path):
+    self.path = path
+    self._local = threading.local()
+    with self._conn() as conn:
+      conn.execute("""
+        CREATE TABLE IF NOT EXISTS identity_cache (
+          key TEXT PRIMARY KEY,
+          value TEXT NOT NULL,
+          expires REAL NOT NULL)
+        """)
+
+  def _conn(self):
+    # sqlite3 connections can't be shared across threads
+    conn = getattr(self._local, 'conn', None)
+    if not conn:
+      conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+      conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+  def get(self, key):
+    """Returns (float expiration timestamp, str value) for a key, or None."""
+    return self._conn().execute(
+      'SELECT expires, value FROM identity_cache WHERE key = ?', (key,)
+    ).fetchone()
+
+  def set(self, key, val, expires):
+    """Stores a str value with a float expiration timestamp."""
+    with self._conn() as conn:
+      conn.execute(
+        'INSERT OR REPLACE INTO identity_cache (key, value, expires) VALUES (?, ?, ?)',
+        (key, val, expires))
+
+  def delete(self, key):
+    with self._conn() as conn:
+      conn.execute('DELETE FROM identity_cache WHERE key = ?', (key,))
+
+
+_identity_cache = IdentityCache()
+
+
+def configure_identity_cache(ttl=IDENTITY_TTL, negative_ttl=IDENTITY_NEGATIVE_TTL,
+                             max_size=IDENTITY_CACHE_SIZE, backend=None,
+                             memory_ttl=IDENTITY_MEMORY_TTL):
+  """Configures the cache for handle and DID resolution and login sessions.
+
+  An in-memory cache with the default settings is enabled by default. Pass a
+  shared ``backend`` so that restarts and other processes can reuse sessions
+  and lookups.
+
+  Calling this discards the existing in-memory cache.
+
+  Args:
+    ttl (int): lifetime of lookups, in seconds
+    negative_ttl (int): lifetime of failed lookups, in seconds
+    max_size (int): maximum number of values to keep in memory
+    backend: optional shared second-level store with ``get(key)``,
+      ``set(key, val, expires)``, and ``delete(key)`` methods, eg
+      :class:`SqliteIdentityCache`
+    memory_ttl (int): if ``backend`` is set, maximum lifetime of values in
+      memory, in seconds
+  """
+  global _identity_cache
+  _identity_cache = IdentityCache(ttl=ttl, negative_ttl=negative_ttl,
+                                  max_size=max_size, backend=backend,
+                                  memory_ttl=memory_ttl)
+
+
+def resolve_handle(handle):
+  """Resolves a handle to a DID. Cached.
+
+  Tries ``https://[HANDLE]/.well-known/atproto-did`` first, then
+  ``com.atproto.identity.resolveHandle`` on :const:`DEFAULT_PDS`. DNS TXT
+  records aren't supported yet.
+
+  https://atproto.com/specs/handle#handle-resolution
+
+  Args:
+    handle (str)
+
+  Returns:
+    str: DID, or None if the handle doesn't resolve
+
+  Raises:
+    ValueError: if ``handle`` isn't a valid handle
+    requests.RequestException: if the PDS fails
+  """
+  handle = handle.lstrip('@').lower()
+  if not re.fullmatch(HANDLE_REGEX, handle):
+    raise ValueError(f'Invalid handle: {handle}')
+
+  def resolve():
+    try:
+      resp = util.requests_get(f'https://{handle}/.well-known/atproto-did')
+      if resp.ok:
+        did = resp.text.strip()
+        if did.startswith('did:'):
+          return did
+    except requests.RequestException as e:
+      logger.info(f"Couldn't fetch {handle}'s atproto-did: {e}")
+
+    resp = util.requests_get(urllib.parse.urljoin(
+      DEFAULT_PDS, f'/xrpc/com.atproto.identity.resolveHandle?handle={handle}'))
+    if resp.status_code // 100 == 5:
+      resp.raise_for_status()
+    return _json_or_none(resp).get('did')
+
+  return _identity_cache.lookup(f'handle {handle}', resolve)
+
+
+def resolve_did(did):
+  """Fetches a DID document. Cached.
+
+  ``did:plc`` documents come from :const:`PLC_DIRECTORY`, ``did:web`` documents
+  from ``https://[HOST]/.well-known/did.json``.
+
+  https://atproto.com/specs/did
+
+  Args:
+    did (str)
+
+  Returns:
+    dict: DID document, or None if it doesn't exist
+
+  Raises:
+    ValueError: if ``did`` isn't a ``did:plc`` or valid ``did:web``
+    requests.RequestException: if the fetch fails with a connection error or
+      HTTP 5xx
+  """
+  if did and did.startswith('did:plc:'):
+    url = PLC_DIRECTORY + did
+  else:
+    url = urllib.parse.urljoin(did_web_to_url(did), '/.well-known/did.json')
+
+  def resolve():
+    resp = util.requests_get(url)
+    if resp.status_code // 100 == 5:
+      resp.raise_for_status()
+    return _json_or_none(resp) or None
+
+  return _identity_cache.lookup(f'did {did}', resolve)
+
+
+def did_to_pds(did):
+  """Returns the base URL of the PDS that serves a DID's repo. Cached.
+
+  Args:
+    did (str)
+
+  Returns:
+    str: PDS URL, or None if the DID doesn't resolve or has no PDS
+
+  Raises:
+    same as :func:`resolve_did`
+  """
+  for service in (resolve_did(did) or {}).get('service', []):
+    if (service.get('id') in ('#atproto_pds', f'{did}#atproto_pds')
+        and service.get('type') == 'AtprotoPersonalDataServer'):
+      return service.get('serviceEndpoint')
+
+
+class _DeadSession(requests.HTTPError):
+  """Raised when a session's refresh token is rejected."""
+
+
+class _Client(Client):
+  """:class:`lexrpc.Client` that logs in again when its session dies.
+
+  lexrpc refreshes expired access tokens itself. If the refresh token has been
+  rotated or revoked too, eg by another process sharing the session, this calls
+  ``relogin`` with the dead session and retries the call once.
+
+  Attributes:
+    relogin (callable, dict => None): optional
+  """
+  relogin = None
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._refreshing = threading.local()
+
+  def call(self, nsid, input=None, **params):
+    if nsid == REFRESH_NSID:
+      # lexrpc retries refreshSession forever if it fails with ExpiredToken
+      if getattr(self._refreshing, 'val', False):
+        raise _DeadSession()
+      self._refreshing.val = True
+      try:
+        return super().call(nsid, input=input, **params)
+      finally:
+        self._refreshing.val = False
+
+    session = self.session
+    try:
+      return super().call(nsid, input=input, **params)
+    except requests.HTTPError as e:
+      if (not self.relogin or nsid == LOGIN_NSID
+          or not (isinstance(e, _DeadSession) or _is_auth_error(e))):
+        raise
+      logger.info(f'Session is no longer valid, logging in again: {e}')
+      self.relogin(session)
+      return super().call(nsid, input=input, **params)
+
+
+def _is_auth_error(e):
+  """Returns True if an XRPC HTTP error means the session is invalid."""
+  if e.response is None or e.response.status_code not in (400, 401):
+    return False
+  try:
+    return e.response.json().get('error') in AUTH_ERRORS
+  except (AttributeError, ValueError):
+    return False
+
+
+def _json_or_none(resp):
+  """Returns a successful response's JSON object body, or {}."""
+  if resp.ok:
+    try:
+      body = resp.json()
+      if isinstance(body, dict):
+        return body
+    except ValueError:
+      pass
+  return {}
+
+
+_truncator_source = None
+
+def _truncator():
+  """Returns a shared :class:`Bluesky` instance for :meth:`Source.truncate`.
+
+  Constructing one, and its :class:`lexrpc.Client`, takes milliseconds, so we
+  only do it once instead of on every :func:`from_as1` call.
+  """
+  global _truncator_source
+  if _truncator_source is None:
+    _truncator_source = Bluesky('unused')
+  return _truncator_source
+
+
 def from_as1(obj, out_type=None, blobs=None):
   """Converts an AS1 object to a Bluesky object.
 
@@ -384,10 +792,9 @@ def from_as1(obj, out_type=None, blobs=None):
 
   elif verb == 'post' and type in as1.POST_TYPES:
     # convert text to HTML and truncate
-    src = Bluesky('unused')
     content = obj.get('content')
     text = obj.get('summary') or content or obj.get('name') or ''
-    text = src.truncate(html_to_text(text), None, OMIT_LINK)
+    text = _truncator().truncate(html_to_text(text), None, OMIT_LINK)
 
     facets = []
     if text == content:
@@ -940,6 +1347,222 @@ def blob_to_url(*, blob, repo_did, pds=DEFAULT_PDS):
     return urllib.parse.urljoin(pds, path)
 
 
+def repo_to_activities(car, repo_handle=None, pds=DEFAULT_PDS):
+  """Converts the records in an AT Protocol repo CAR file to AS1 objects.
+
+  Reads a ``com.atproto.sync.getRepo`` response, walks its MST in key order,
+  and yields posts, likes, reposts, and profiles, converted with
+  :func:`to_as1`. Other collections are skipped.
+
+  Reads lazily. Files and paths are memory-mapped; other streams are copied in
+  chunks to a temporary file first. Only an index of block offsets is kept in
+  memory, and each record is decoded when it's reached.
+
+  https://atproto.com/specs/repository
+  https://ipld.io/specs/transport/car/carv1/
+
+  Args:
+    car (bytes or str or os.PathLike or file): CAR file contents, path, or
+      binary file object
+    repo_handle (str): optional handle of the repo's user
+    pds (str): base URL of the PDS that serves this repo, used for image URLs.
+      Defaults to :const:`DEFAULT_PDS`.
+
+  Returns:
+    generator of dict: AS1 objects
+
+  Raises:
+    ValueError: if ``car`` isn't a valid CAR file or has no commit
+  """
+  with _CarReader(car) as reader:
+    commit = reader.get(reader.root)
+    if not isinstance(commit, dict) or 'did' not in commit or 'data' not in commit:
+      raise ValueError("CAR file's root isn't a repo commit")
+    did = commit['did']
+
+    for key, cid in reader.walk_mst(commit['data']):
+      collection, _, rkey = key.partition('/')
+      if collection not in REPO_COLLECTIONS:
+        continue
+
+      record = reader.get(cid)
+      if record is None:
+        logger.warning(f'Record {key} {cid} missing from CAR file')
+        continue
+
+      uri = f'at://{did}/{collection}/{rkey}'
+      try:
+        obj = to_as1(_dag_cbor_to_json(record), type=collection, uri=uri,
+                     repo_did=did, repo_handle=repo_handle, pds=pds)
+      except (AssertionError, AttributeError, TypeError, ValueError) as e:
+        logger.warning(f"Couldn't convert {uri}: {e}")
+        continue
+
+      if obj:
+        yield obj
+
+
+def _dag_cbor_to_json(val):
+  """Converts decoded DAG-CBOR to the JSON form that :func:`to_as1` expects.
+
+  CIDs become ``{'$link': ...}`` and bytes become ``{'$bytes': ...}``.
+  https://atproto.com/specs/data-model#json-representation
+  """
+  if isinstance(val, CID):
+    return {'$link': val.encode('base32')}
+  elif isinstance(val, bytes):
+    return {'$bytes': base64.b64encode(val).decode().rstrip('=')}
+  elif isinstance(val, dict):
+    return {k: _dag_cbor_to_json(v) for k, v in val.items()}
+  elif isinstance(val, list):
+    return [_dag_cbor_to_json(v) for v in val]
+  return val
+
+
+def _read_varint(buf, pos):
+  """Reads an unsigned LEB128 varint. Returns (int value, int new pos)."""
+  val = shift = 0
+  while True:
+    if pos >= len(buf):
+      raise ValueError('Truncated varint in CAR file')
+    byte = buf[pos]
+    pos += 1
+    val |= (byte & 0x7f) << shift
+    if not byte & 0x80:
+      return val, pos
+    shift += 7
+
+
+class _CarReader:
+  """Random access to the blocks in a CARv1 file.
+
+  Indexes block offsets on open but doesn't decode blocks until :meth:`get`.
+  Use as a context manager.
+
+  Attributes:
+    root (bytes): binary CID of the first root, ie the repo commit
+  """
+  def __init__(self, car):
+    self._file = self._mmap = None
+
+    if isinstance(car, (bytes, bytearray, memoryview)):
+      self._buf = memoryview(car)
+    else:
+      if isinstance(car, (str, os.PathLike)):
+        self._file = car = open(car, 'rb')
+      try:
+        car.seek(0, os.SEEK_END)
+        empty = car.tell() == 0
+        car.seek(0)
+        fileno = car.fileno()
+      except (AttributeError, OSError, ValueError):
+        # not a real seekable file, eg a response stream. spool to disk.
+        tmp = tempfile.TemporaryFile()
+        shutil.copyfileobj(car, tmp, CAR_CHUNK_SIZE)
+        if self._file:
+          self._file.close()
+        self._file = car = tmp
+        car.seek(0, os.SEEK_END)
+        empty = car.tell() == 0
+        fileno = car.fileno()
+
+      if empty:
+        self.close()
+        raise ValueError('Empty CAR file')
+      self._mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+      self._buf = memoryview(self._mmap)
+
+    try:
+      self._index()
+    except BaseException:
+      self.close()
+      raise
+
+  def _index(self):
+    buf = self._buf
+    length, pos = _read_varint(buf, 0)
+    try:
+      header = dag_cbor.decode(bytes(buf[pos:pos + length]))
+    except Exception as e:
+      raise ValueError(f'Invalid CAR header: {e}')
+    if (not isinstance(header, dict) or header.get('version') != 1
+        or not header.get('roots')):
+      raise ValueError(f'Unsupported CAR header: {header}')
+    self.root = bytes(header['roots'][0])
+
+    # maps binary CID to (start, end) offsets of the block's data
+    self._blocks = {}
+    pos += length
+    while pos < len(buf):
+      length, pos = _read_varint(buf, pos)
+      end = pos + length
+      if end > len(buf):
+        raise ValueError('Truncated block in CAR file')
+
+      # CIDv0 is a bare sha2-256 multihash; CIDv1 is version, codec, multihash
+      cid_start = pos
+      if buf[pos] == 0x12 and pos + 1 < end and buf[pos + 1] == 0x20:
+        pos += 34
+      else:
+        for _ in range(3):  # version, codec, multihash code
+          _, pos = _read_varint(buf, pos)
+        digest_len, pos = _read_varint(buf, pos)
+        pos += digest_len
+
+      self._blocks[bytes(buf[cid_start:pos])] = (pos, end)
+      pos = end
+
+  def get(self, cid):
+    """Decodes and returns a block, or None if it's not in this file.
+
+    Args:
+      cid (bytes or multiformats.CID)
+    """
+    offsets = self._blocks.get(bytes(cid))
+    if offsets:
+      start, end = offsets
+      return dag_cbor.decode(bytes(self._buf[start:end]))
+
+  def walk_mst(self, cid):
+    """Yields (str key, CID value) pairs from an MST, in key order.
+
+    https://atproto.com/specs/repository#mst-structure
+    """
+    node = self.get(cid) if cid else None
+    if node is None:
+      if cid:
+        logger.warning(f'MST node {cid} missing from CAR file')
+      return
+
+    yield from self.walk_mst(node.get('l'))
+    key = b''
+    for entry in node.get('e', []):
+      key = key[:entry['p']] + entry['k']
+      yield key.decode(), entry['v']
+      yield from self.walk_mst(entry.get('t'))
+
+  def close(self):
+    if self._mmap:
+      self._buf.release()
+      self._mmap.close()
+      self._mmap = None
+    if self._file:
+      self._file.close()
+      self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+
+def _is_repost(feed_view_post):
+  """Returns True if an ``app.bsky.feed.defs#feedViewPost`` is a repost."""
+  reason = feed_view_post.get('reason')
+  return bool(reason and reason.get('$type') == 'app.bsky.feed.defs#reasonRepost')
+
+
 class Bluesky(Source):
   """Bluesky source class. See file docstring and :class:`Source` class for
   details.
@@ -948,6 +1571,15 @@ class Bluesky(Source):
     handle (str)
     did (str)
     client (lexrpc.Client)
+    threads (int): if set, :meth:`get_activities_response` fetches likes,
+      reposts, and replies for all posts concurrently with this many threads
+    max_requests (int): if set, maximum number of likes, reposts, and replies
+      XRPC calls to make per :meth:`get_activities_response` call. These calls
+      also go through the shared rate limiter, see
+      :func:`granary.source.configure_rate_limiter`. Extras for later posts
+      beyond either budget are skipped, with a warning, and not cached, so
+      they'll be fetched on a later call.
+    max_reply_depth (int): if set, maximum depth of replies to fetch in threads
   """
 
   DOMAIN = 'bsky.app'
@@ -960,7 +1592,8 @@ class Bluesky(Source):
   _app_password = None
 
   def __init__(self, handle, did=None, access_token=None, refresh_token=None,
-               app_password=None, session_callback=None):
+               app_password=None, session_callback=None, threads=None,
+               max_requests=None, max_reply_depth=None):
     """Constructor.
 
     Args:
@@ -968,31 +1601,95 @@ class Bluesky(Source):
       did (str): did:plc or did:web, optional
       access_token (str): optional
       refresh_token (str): optional
-      app_password (str): optional
+      app_password (str): optional. Sessions created with it are stored in the
+        identity cache, see :func:`configure_identity_cache`, and reused by
+        other instances with the same handle or DID and app password.
       session_callback (callable, dict => None): passed to :class:`lexrpc.Client`
         constructor, called when a new session is created or refreshed
+      threads (int): optional, see class docstring
+      max_requests (int): optional, see class docstring
+      max_reply_depth (int): optional, see class docstring
     """
     self.handle = handle
     self.did = did
     self._app_password = app_password
+    self.threads = threads
+    self.max_requests = max_requests
+    self.max_reply_depth = max_reply_depth
+
+    self._session_key = None
+    if app_password:
+      identifier = f'{did or handle} {app_password}'
+      self._session_key = \
+        f'session {hashlib.sha256(identifier.encode()).hexdigest()}'
+
+    def store_session(session):
+      # called by lexrpc on createSession and refreshSession
+      if self._session_key:
+        _identity_cache.set(self._session_key, session, ttl=SESSION_TTL)
+      if session_callback:
+        session_callback(session)
 
     headers = {'User-Agent': util.user_agent}
-    self._client = Client(access_token=access_token, refresh_token=refresh_token,
-                          headers=headers, session_callback=session_callback)
+    self._client = _Client(access_token=access_token,
+                           refresh_token=refresh_token, headers=headers,
+                           session_callback=store_session)
+    if app_password:
+      self._client.relogin = self._relogin
+      self._login_lock = threading.Lock()
 
   @property
   def client(self):
-    if not self._client.session and self._app_password:
-      # log in
-      resp = self._client.com.atproto.server.createSession({
-        'identifier': self.did or self.handle,
-        'password': self._app_password,
-      })
-      self.handle = resp['handle']
-      self.did = resp['did']
+    if not self._client.session.get('accessJwt') and self._app_password:
+      pds = self._pds()
+      if pds:
+        self._client.address = pds
+      session = _identity_cache.get(self._session_key)
+      if session:
+        self._client.session = session
+      else:
+        session = self._login()
+      self.handle = session['handle']
+      self.did = session['did']
 
     return self._client
 
+  def _pds(self):
+    """Returns the base URL of this account's PDS, or None if it's unknown."""
+    try:
+      did = self.did or resolve_handle(self.handle)
+      return did and did_to_pds(did)
+    except (ValueError, requests.RequestException) as e:
+      logger.info(f"Couldn't resolve PDS for {self.did or self.handle}: {e}")
+
+  def _login(self):
+    """Creates a new session with the app password."""
+    return self._client.com.atproto.server.createSession({
+      'identifier': self.did or self.handle,
+      'password': self._app_password,
+    })
+
+  def _relogin(self, dead):
+    """Replaces a dead session with the cached one if it's newer, or logs in.
+
+    Args:
+      dead (dict): the session that failed
+    """
+    with self._login_lock:
+      if self._client.session.get('refreshJwt') != dead.get('refreshJwt'):
+        return  # another thread already replaced it
+
+      # another process may have refreshed the session in the shared backend
+      _identity_cache.evict(self._session_key)
+      session = _identity_cache.get(self._session_key)
+      if session and session.get('refreshJwt') != dead.get('refreshJwt'):
+        self._client.session = session
+        return
+
+      _identity_cache.delete(self._session_key)
+      self._client.session = {}
+      self._login()
+
   @classmethod
   def user_url(cls, handle):
     """Returns the profile URL for a given handle.
@@ -1056,7 +1753,8 @@ class Bluesky(Source):
                               fetch_likes=False, fetch_shares=False,
                               include_shares=True, fetch_events=False,
                               fetch_mentions=False, search_query=None,
-                              start_index=None, count=None, cache=None, **kwargs):
+                              start_index=None, count=None, cache=None,
+                              min_id=None, cursor=None, **kwargs):
     """Fetches posts and converts them to AS1 activities.
 
     See :meth:`Source.get_activities_response` for more information.
@@ -1065,14 +1763,30 @@ class Bluesky(Source):
 
     Args:
       activity_id (str): an ``at://`` URI
+      count (int): page size
+      min_id (str): ``at://`` URI of the newest post already seen. If provided,
+        follows cursors through up to :const:`MAX_SINCE_PAGES` pages of the
+        feed until it reaches this post, and only returns posts newer than it.
+        ``count`` still sets the size of each page, so this may return more
+        than ``count`` posts.
+      cursor (str): opaque cursor from a previous response's ``cursor``
+        value. If provided, starts at that page of the feed.
+
+    Returns:
+      dict: as described in :meth:`Source.get_activities_response`, plus
+      ``cursor``, an opaque cursor for the next (older) page of the feed, if
+      there is one. Omitted if ``min_id`` was provided and reached.
     """
     assert not start_index
 
     params = {}
     if count is not None:
       params['limit'] = count
+    if cursor:
+      params['cursor'] = cursor
 
     posts = None
+    next_cursor = None
     handle = self.handle
     if activity_id:
       if not activity_id.startswith('at://'):
@@ -1080,26 +1794,45 @@ class Bluesky(Source):
       resp = self.client.app.bsky.feed.getPostThread({}, uri=activity_id, depth=1)
       posts = [resp.get('thread', {})]
 
-    elif group_id in (None, FRIENDS):
-      resp = self.client.app.bsky.feed.getTimeline({}, **params)
-      posts = resp.get('feed', [])
-
-    else:  # eg group_id SELF
-      actor = user_id or self.did or self.handle
-      if not actor:
-        raise ValueError('user_id is required')
-      resp = self.client.app.bsky.feed.getAuthorFeed({}, actor=actor, **params)
-      posts = resp.get('feed', [])
+    else:
+      if group_id in (None, FRIENDS):
+        get_feed = self.client.app.bsky.feed.getTimeline
+      else:  # eg group_id SELF
+        actor = user_id or self.did or self.handle
+        if not actor:
+          raise ValueError('user_id is required')
+        params['actor'] = actor
+        get_feed = self.client.app.bsky.feed.getAuthorFeed
+
+      posts = []
+      for _ in range(MAX_SINCE_PAGES if min_id else 1):
+        resp = get_feed({}, **params)
+        page = resp.get('feed', [])
+        next_cursor = resp.get('cursor')
+
+        if min_id:
+          for i, post in enumerate(page):
+            if (not _is_repost(post)
+                and post.get('post', {}).get('uri') == min_id):
+              page = page[:i]
+              next_cursor = None
+              break
+
+        posts.extend(page)
+        if not next_cursor or not page:
+          break
+        params['cursor'] = next_cursor
 
     if cache is None:
       # for convenience, throwaway object just for this method
       cache = {}
 
     activities = []
+    # (cache key prefix, count, XRPC call, bluesky post, AS1 object) tuples
+    extras = []
 
     for post in posts:
-      reason = post.get('reason')
-      is_repost = reason and reason.get('$type') == 'app.bsky.feed.defs#reasonRepost'
+      is_repost = _is_repost(post)
       if is_repost and not include_shares:
         continue
 
@@ -1107,40 +1840,64 @@ class Bluesky(Source):
       activities.append(activity)
       obj = activity['object']
       id = obj.get('id')
-      tags = obj.setdefault('tags', [])
+      obj.setdefault('tags', [])
 
       if is_repost:
         # If it's a repost we're not interested in responses to it.
         continue
       bs_post = post.get('post')
       if bs_post and id:
-        # Likes
-        like_count = bs_post.get('likeCount')
-        if fetch_likes and like_count and like_count != cache.get('ABL ' + id):
-          likers = self.client.app.bsky.feed.getLikes({}, uri=bs_post.get('uri'))
-          tags.extend(self._make_like(bs_post, l.get('actor')) for l in likers.get('likes'))
-          cache['ABL ' + id] = like_count
-
-        # Reposts
-        repost_count = bs_post.get('repostCount')
-        if fetch_shares and repost_count and repost_count != cache.get('ABRP ' + id):
-          reposters = self.client.app.bsky.feed.getRepostedBy({}, uri=bs_post.get('uri'))
-          tags.extend(self._make_share(bs_post, r) for r in reposters.get('repostedBy'))
-          cache['ABRP ' + id] = repost_count
-
-        # Replies
-        reply_count = bs_post.get('replyCount')
-        if fetch_replies and reply_count and reply_count != cache.get('ABR ' + id):
-          replies = self._get_replies(bs_post.get('uri'))
-          replies = [to_as1(reply, 'app.bsky.feed.defs#threadViewPost') for reply in replies]
-          for r in replies:
-            r['id'] = self.tag_uri(r['id'])
-          obj['replies'] = {
-            'items': replies,
-          }
-          cache['ABR ' + id] = reply_count
+        uri = bs_post.get('uri')
+        for prefix, fetch, count, nsid, call in (
+            ('ABL', fetch_likes, bs_post.get('likeCount'),
+             'app.bsky.feed.getLikes',
+             lambda uri=uri: self.client.app.bsky.feed.getLikes({}, uri=uri)),
+            ('ABRP', fetch_shares, bs_post.get('repostCount'),
+             'app.bsky.feed.getRepostedBy',
+             lambda uri=uri: self.client.app.bsky.feed.getRepostedBy({}, uri=uri)),
+            ('ABR', fetch_replies, bs_post.get('replyCount'),
+             'app.bsky.feed.getPostThread',
+             lambda uri=uri: self._get_replies(uri)),
+        ):
+          if fetch and count and count != cache.get(f'{prefix} {id}'):
+            call = (lambda nsid=nsid, call=call:
+                    self._rate_limited_extra(nsid, call))
+            extras.append((prefix, count, call, bs_post, obj))
+
+    if self.max_requests is not None and len(extras) > self.max_requests:
+      logger.warning(f'Skipping {len(extras) - self.max_requests} likes/reposts/replies fetches, over budget of {self.max_requests}. Results will be incomplete!')
+      extras = extras[:self.max_requests]
+
+    results = run_concurrently([call for _, _, call, _, _ in extras],
+                               threads=self.threads)
+
+    skipped = 0
+    for (prefix, count, _, bs_post, obj), result in zip(extras, results):
+      if result is None:
+        skipped += 1
+        continue
+      elif prefix == 'ABL':
+        obj['tags'].extend(self._make_like(bs_post, l.get('actor'))
+                           for l in result.get('likes'))
+      elif prefix == 'ABRP':
+        obj['tags'].extend(self._make_share(bs_post, r)
+                           for r in result.get('repostedBy'))
+      elif prefix == 'ABR':
+        replies = [to_as1(reply, 'app.bsky.feed.defs#threadViewPost')
+                   for reply in result]
+        for r in replies:
+          r['id'] = self.tag_uri(r['id'])
+        obj['replies'] = {
+          'items': replies,
+        }
+      cache[f'{prefix} {obj["id"]}'] = count
+
+    if skipped:
+      logger.warning(f'Rate limited, skipped {skipped} likes/reposts/replies fetches. Results will be incomplete!')
 
     resp = self.make_activities_base_response(util.trim_nulls(activities))
+    if next_cursor:
+      resp['cursor'] = next_cursor
     return resp
 
   def get_actor(self, user_id=None):
@@ -1224,6 +1981,25 @@ class Bluesky(Source):
       'author': author,
     }
 
+  def _rate_limited_extra(self, nsid, call):
+    """Makes a likes, reposts, or replies XRPC call through the rate limiter.
+
+    Args:
+      nsid (str): XRPC method, for the rate limit bucket
+      call (callable): makes the call
+
+    Returns:
+      the return value of ``call``, or None if we're rate limited
+    """
+    try:
+      return rate_limited_call(('bluesky', nsid, self.did or self.handle), call)
+    except RateLimited as e:
+      logger.info(e)
+    except requests.HTTPError as e:
+      if e.response is None or e.response.status_code != 429:
+        raise
+      logger.info(f'{nsid} is rate limited: {e}')
+
   def _get_replies(self, uri):
     """
     Gets the replies to a specific post and returns them
@@ -1235,25 +2011,33 @@ class Bluesky(Source):
     Returns: list, Bluesky app.bsky.feed.defs#threadViewPost
     """
     ret = []
-    resp = self.client.app.bsky.feed.getPostThread({}, uri=uri)
+    params = {}
+    if self.max_reply_depth is not None:
+      params['depth'] = self.max_reply_depth
+    resp = self.client.app.bsky.feed.getPostThread({}, uri=uri, **params)
     thread = resp.get('thread')
     if thread:
-      ret = self._recurse_replies(thread)
+      ret = self._recurse_replies(thread, depth=self.max_reply_depth)
     return sorted(ret, key = lambda thread: thread.get('post', {}).get('record', {}).get('createdAt'))
 
-  # TODO this ought to take a depth limit.
-  def _recurse_replies(self, thread):
+  def _recurse_replies(self, thread, depth=None):
     """
     Recurses through a Bluesky app.bsky.feed.defs#threadViewPost
     and returns its replies as a list.
 
     Args:
       thread: dict, Bluesky app.bsky.feed.defs#threadViewPost
+      depth: int, optional maximum depth of replies to return. 1 is just direct
+        replies to ``thread``.
 
     Returns: list, Bluesky app.bsky.feed.defs#threadViewPost
     """
+    if depth is not None and depth <= 0:
+      return []
+
     ret = []
     for r in thread.get('replies', []):
         ret += [r]
-        ret += self._recurse_replies(r)
+        ret += self._recurse_replies(
+          r, depth=None if depth is None else depth - 1)
     return ret
@@ -5,7 +5,9 @@ https://developers.facebook.com/docs/graph-api/using-graph-api/
 import collections
 import copy
 from datetime import datetime
+import functools
 import html
+import itertools
 import logging
 import re
 import urllib.error, urllib.parse, urllib.request
@@ -86,6 +88,8 @@ API_NOTIFICATION = '%s/notifications'
 API_UPLOAD_VIDEO = 'https://graph-video.facebook.com/v4.0/me/videos'
 
 MAX_IDS = 50  # for the ids query param
+# https://developers.facebook.com/docs/graph-api/making-multiple-requests#limits
+MAX_BATCH_SIZE = 50
 
 M_HTML_BASE_URL = 'https://mbasic.facebook.com/'
 M_HTML_TIMELINE_URL = '%s?v=timeline'
@@ -194,7 +198,7 @@ class Facebook(source.Source):
   """
 
   def __init__(self, access_token=None, user_id=None, scrape=False,
-               cookie_c_user=None, cookie_xs=None):
+               cookie_c_user=None, cookie_xs=None, threads=None):
     """Constructor.
 
     If an OAuth access token is provided, it will be passed on to Facebook. This
@@ -210,6 +214,9 @@ class Facebook(source.Source):
         use the API (False)
       cookie_c_user (str): optional ``c_user`` cookie to use when scraping
       cookie_xs (str): optional ``xs`` cookie to use when scraping
+      threads (int): optional, maximum number of concurrent batch API calls to
+        make when fetching extras in :meth:`get_activities_response`. Defaults
+        to making them serially.
     """
     if scrape:
       assert cookie_c_user and cookie_xs
@@ -218,6 +225,7 @@ class Facebook(source.Source):
     self.scrape = scrape
     self.cookie_c_user = cookie_c_user
     self.cookie_xs = cookie_xs
+    self.threads = threads
 
   def object_url(self, id):
     # Facebook always uses www. They redirect bare facebook.com URLs to it.
@@ -301,27 +309,48 @@ class Facebook(source.Source):
       if count:
         url = util.add_query_params(url, {'limit': count})
       headers = {'If-None-Match': etag} if etag else {}
-      try:
-        resp = self.urlopen(url, headers=headers, _as=None)
-        etag = resp.info().get('ETag')
-        posts = self._as(list, source.load_json(resp.read(), url))
-      except urllib.error.HTTPError as e:
-        if e.code == 304:  # Not Modified, from a matching ETag
-          posts = []
-        else:
-          raise
 
       if group_id == source.SELF:
-        # TODO: save and use ETag for all of these extra calls
-        # TODO: use batch API to get photos, events, etc in one request
-        # https://developers.facebook.com/docs/graph-api/making-multiple-requests
+        # fetch the feed and photos, albums, etc in one batch request
         # https://github.com/snarfed/bridgy/issues/44
+        # TODO: save and use ETag for all of these extra calls
+        extra_urls = [API_PHOTOS_UPLOADED % user_id, API_ALBUMS % user_id]
+        if fetch_news:
+          extra_urls.append(API_NEWS_PUBLISHES % user_id)
+        if fetch_events:
+          extra_urls.append(API_USER_EVENTS)
+
+        feed_resp, *extra_resps = self._urlopen_batched(
+          [{'relative_url': url, 'headers': headers}] +
+          [{'relative_url': extra_url} for extra_url in extra_urls])
+
+        if feed_resp.get('code') == 304:  # Not Modified, from a matching ETag
+          posts = []
+        else:
+          posts = self._as(list, self._batch_body(url, feed_resp))
+          etag = feed_resp.get('headers', {}).get('ETag')
+
+        photos, albums, *extras = [
+          self._as(list, self._batch_body(extra_url, resp))
+          for extra_url, resp in zip(extra_urls, extra_resps)]
         if fetch_news:
-          posts.extend(self.urlopen(API_NEWS_PUBLISHES % user_id, _as=list))
-        posts = self._merge_photos(posts, user_id)
+          posts.extend(extras.pop(0))
+        posts = self._merge_photos(posts, user_id, photos=photos, albums=albums)
         if fetch_events:
-          activities.extend(self._get_events(owner_id=event_owner_id))
+          activities.extend(self._get_events(owner_id=event_owner_id,
+                                             events=extras.pop(0)))
+
       else:
+        try:
+          resp = self.urlopen(url, headers=headers, _as=None)
+          etag = resp.info().get('ETag')
+          posts = self._as(list, source.load_json(resp.read(), url))
+        except urllib.error.HTTPError as e:
+          if e.code == 304:  # Not Modified, from a matching ETag
+            posts = []
+          else:
+            raise
+
         # for group feeds, filter out some shared_story posts because they tend
         # to be very tangential - friends' likes, related posts, etc.
         #
@@ -349,35 +378,34 @@ class Facebook(source.Source):
     # don't fetch extras for Facebook notes. if you pass /comments a note id, it
     # 400s with "notes API is deprecated for versions ..."
     # https://github.com/snarfed/bridgy/issues/480
+    id_calls = {}
     if fetch_shares and fetch_shares_ids:
-      # some sharedposts requests 400, not sure why.
-      # https://github.com/snarfed/bridgy/issues/348
-      with util.ignore_http_4xx_error():
-        for id, shares in self._split_id_requests(API_SHARES, fetch_shares_ids).items():
-          activity = id_to_activity.get(id)
-          if activity:
-            activity['object'].setdefault('tags', []).extend(
-              [self.share_to_object(share) for share in shares])
-
+      id_calls[API_SHARES] = fetch_shares_ids
     if fetch_replies and fetch_comments_ids:
-      # some comments requests 400, not sure why.
-      with util.ignore_http_4xx_error():
-        for id, comments in self._split_id_requests(API_COMMENTS_ALL,
-                                                    fetch_comments_ids).items():
-          activity = id_to_activity.get(id)
-          if activity:
-            replies = activity['object'].setdefault('replies', {}
-                                       ).setdefault('items', [])
-            existing_ids = {reply['fb_id'] for reply in replies}
-            for comment in comments:
-              if comment['id'] not in existing_ids:
-                replies.append(self.comment_to_object(comment))
+      id_calls[API_COMMENTS_ALL] = fetch_comments_ids
+    extras = self._split_id_requests(id_calls)
+
+    for id, shares in extras.get(API_SHARES, {}).items():
+      activity = id_to_activity.get(id)
+      if activity:
+        activity['object'].setdefault('tags', []).extend(
+          [self.share_to_object(share) for share in shares])
+
+    for id, comments in extras.get(API_COMMENTS_ALL, {}).items():
+      activity = id_to_activity.get(id)
+      if activity:
+        replies = activity['object'].setdefault('replies', {}
+                                   ).setdefault('items', [])
+        existing_ids = {reply['fb_id'] for reply in replies}
+        for comment in comments:
+          if comment['id'] not in existing_ids:
+            replies.append(self.comment_to_object(comment))
 
     response = self.make_activities_base_response(util.trim_nulls(activities))
     response['etag'] = etag
     return response
 
-  def _merge_photos(self, posts, user_id):
+  def _merge_photos(self, posts, user_id, photos=None, albums=None):
     """Fetches and merges photo objects into posts, replacing matching posts.
 
     Have to fetch uploaded photos manually since facebook sometimes collapses
@@ -395,7 +423,11 @@ class Facebook(source.Source):
     Args:
       posts (list of dict): Facebook post objects
       user_id (str): Facebook user id
- 
+      photos (list of dict): optional, Facebook photo objects. If not provided,
+        they're fetched from ``API_PHOTOS_UPLOADED``.
+      albums (list of dict): optional, Facebook album objects. If not provided,
+        they're fetched from ``API_ALBUMS`` if necessary.
+
     Returns:
       list of dict: new post and photo objects
     """
@@ -410,9 +442,12 @@ class Facebook(source.Source):
           logger.warning(f"merging posts for object_id {obj_id}: overwriting {existing.get('id')} with {post.get('id')}!")
         posts_by_obj_id[obj_id] = post
 
-    albums = None  # lazy loaded, maps facebook id to ActivityStreams object
+    # lazy loaded if not provided, maps facebook id to album object
+    if albums is not None:
+      albums = {a.get('id'): a for a in albums}
 
-    photos = self.urlopen(API_PHOTOS_UPLOADED % user_id, _as=list)
+    if photos is None:
+      photos = self.urlopen(API_PHOTOS_UPLOADED % user_id, _as=list)
     for photo in photos:
       album_id = photo.get('album', {}).get('id')
       post = posts_by_obj_id.pop(photo.get('id'), {})
@@ -432,28 +467,43 @@ class Facebook(source.Source):
     return ([p for p in posts if not p.get('object_id')] +
             list(posts_by_obj_id.values()) + photos)
 
-  def _split_id_requests(self, api_call, ids):
-    """Splits an API call into multiple to stay under the ``MAX_IDS`` limit per call.
+  def _split_id_requests(self, calls):
+    """Splits API calls into multiple to stay under the ``MAX_IDS`` limit per call.
+
+    Sends all of the resulting calls together via :meth:`_urlopen_batched`.
+    Ignores individual calls that return HTTP 4xx, since some sharedposts and
+    comments requests 400, not sure why.
+    https://github.com/snarfed/bridgy/issues/348
 
     https://developers.facebook.com/docs/graph-api/using-graph-api#multiidlookup
 
     Args:
-      api_call (str): with ``%s` placeholder for ``ids`` query param
-      ids (sequence of str): ids
+      calls (dict): maps str API call, with ``%s`` placeholder for ``ids`` query
+        param, to sequence of str ids
 
     Returns:
-      list of dict: merged objects from the responses' ``data`` fields
+      dict: maps str API call to dict that maps str id to list of dict merged
+      objects from the responses' ``data`` fields
     """
-    results = {}
-    for i in range(0, len(ids), MAX_IDS):
-      resp = self.urlopen(api_call % ','.join(ids[i:i + MAX_IDS]))
-      for id, objs in resp.items():
+    urls = [(api_call, api_call % ','.join(ids[i:i + MAX_IDS]))
+            for api_call, ids in calls.items()
+            for i in range(0, len(ids), MAX_IDS)]
+    resps = self._urlopen_batched([{'relative_url': url} for _, url in urls])
+
+    results = {api_call: {} for api_call in calls}
+    for (api_call, url), resp in zip(urls, resps):
+      code = int(resp.get('code') or 0)
+      if code // 100 == 4:
+        logger.info(f'Ignoring HTTP {code} for {url}')
+        continue
+      for id, objs in self._as(dict, self._batch_body(url, resp)).items():
         # objs is usually a dict but sometimes a bool. (oh FB, never change!)
-        results.setdefault(id, []).extend(self._as(dict, objs).get('data', []))
+        results[api_call].setdefault(id, []).extend(
+          self._as(dict, objs).get('data', []))
 
     return results
 
-  def _get_events(self, owner_id=None):
+  def _get_events(self, owner_id=None, events=None):
     """Fetches the current user's events.
 
     * https://developers.facebook.com/docs/graph-api/reference/user/events/
@@ -464,11 +514,14 @@ class Facebook(source.Source):
 
     Args:
       owner_id (str): if provided, only returns events owned by this user
+      events (list of dict): optional, Facebook event objects. If not provided,
+        they're fetched from ``API_USER_EVENTS``.
 
     Returns:
       list of dict: ActivityStreams event objects
     """
-    events = self.urlopen(API_USER_EVENTS, _as=list)
+    if events is None:
+      events = self.urlopen(API_USER_EVENTS, _as=list)
     return [self.event_to_activity(event) for event in events
             if not owner_id or owner_id == event.get('owner', {}).get('id')]
 
@@ -1744,7 +1797,7 @@ class Facebook(source.Source):
       resp = util.requests_get(url, allow_redirects=allow_redirects, headers={
         'Cookie': cookie,
         'User-Agent': SCRAPE_USER_AGENT,
-      })
+      }, session=source.http_session(url))
       resp.raise_for_status()
       return resp
 
@@ -2573,16 +2626,30 @@ class Facebook(source.Source):
       or raw str bodies
     """
     resps = self.urlopen_batch_full([{'relative_url': url} for url in urls])
+    return [self._batch_body(url, resp) for url, resp in zip(urls, resps)]
 
-    bodies = []
-    for url, resp in zip(urls, resps):
-      code = int(resp.get('code', 0))
-      body = resp.get('body')
-      if code // 100 in (4, 5):
-        raise urllib.error.HTTPError(url, code, body, resp.get('headers'), None)
-      bodies.append(body)
+  @staticmethod
+  def _batch_body(url, resp):
+    """Returns a batch API response's body, or raises if it failed.
 
-    return bodies
+    Args:
+      url (str): the request's relative API URL
+      resp (dict): response in :meth:`urlopen_batch_full`'s format
+
+    Returns:
+      decoded JSON object or raw str body
+
+    Raises:
+      :class:`urllib.error.HTTPError`: if the response is HTTP 4xx or 5xx
+    """
+    if resp.get('error'):
+      raise resp['error']
+
+    code = int(resp.get('code') or 0)
+    body = resp.get('body')
+    if code // 100 in (4, 5):
+      raise urllib.error.HTTPError(url, code, body, resp.get('headers'), None)
+    return body
 
   def urlopen_batch_full(self, requests):
     """Sends a batch of multiple API calls using Facebook's batch API.
@@ -2614,6 +2681,9 @@ class Facebook(source.Source):
            },
            ...
           ]
+
+      Calls that Facebook didn't finish, which it returns as null, get
+      :meth:`_batch_timeout` responses with HTTP 504 instead.
     """
     for req in requests:
       if 'method' not in req:
@@ -2623,7 +2693,10 @@ class Facebook(source.Source):
                           for n, v in sorted(req['headers'].items())]
 
     data = 'batch=' + json_dumps(util.trim_nulls(requests), sort_keys=True)
+    # Facebook returns null for calls that timed out
     resps = self.urlopen('', data=data, _as=list)
+    resps = [resp or self._batch_timeout(req['relative_url'])
+             for req, resp in zip(requests, resps)]
 
     for resp in resps:
       if 'headers' in resp:
@@ -2637,3 +2710,59 @@ class Facebook(source.Source):
           pass
 
     return resps
+
+  @staticmethod
+  def _batch_timeout(url):
+    """Returns a response for a batch call that didn't finish.
+
+    :meth:`_batch_body` raises its HTTP 504 error, which callers can retry.
+
+    Args:
+      url (str): the request's relative API URL
+
+    Returns:
+      dict: response in :meth:`urlopen_batch_full`'s format
+    """
+    return {
+      'code': 504,
+      'error': urllib.error.HTTPError(
+        url, 504, 'Facebook batch API call timed out', {}, None),
+    }
+
+  def _urlopen_batched(self, requests):
+    """Sends API calls with as few HTTP requests as possible.
+
+    Sends up to ``MAX_BATCH_SIZE`` calls per batch API request, and sends batch
+    requests concurrently if ``threads`` was passed to the constructor. A single
+    call is sent directly, without the batch API.
+
+    Args:
+      requests (sequence of dict): requests in :meth:`urlopen_batch_full`'s
+        format
+
+    Returns:
+      list of dict: responses in :meth:`urlopen_batch_full`'s format, in the
+      same order as ``requests``. Doesn't raise on individual calls' HTTP
+      errors; pass responses to :meth:`_batch_body` to check them.
+    """
+    if len(requests) == 1:
+      url = requests[0]['relative_url']
+      try:
+        resp = self.urlopen(url, headers=requests[0].get('headers') or {},
+                            _as=None)
+      except urllib.error.HTTPError as e:
+        return [{'code': e.code, 'error': e}]
+      return [{'code': resp.getcode(), 'headers': dict(resp.info().items()),
+               'body': source.load_json(resp.read(), url)}]
+
+    batches = [requests[i:i + MAX_BATCH_SIZE]
+               for i in range(0, len(requests), MAX_BATCH_SIZE)]
+    resps = source.run_concurrently(
+      [functools.partial(self.urlopen_batch_full, batch) for batch in batches],
+      threads=self.threads)
+
+    # pad short responses so that they line up with requests
+    return list(itertools.chain.from_iterable(
+      resp + [self._batch_timeout(req['relative_url'])
+              for req in batch[len(resp):]]
+      for batch, resp in zip(batches, resps)))
@@ -178,7 +178,8 @@ class Flickr(source.Source):
         params.append(('tags', ','.join((f'"{t}"' if ' ' in t else t)
                                         for t in hashtags)))
 
-      file = util.urlopen(video_url or image_url)
+      media_url = video_url or image_url
+      file = source.fetch_media(media_url) or util.urlopen(media_url)
       try:
         resp = self.upload(params, file)
       except requests.exceptions.ConnectionError as e:
@@ -187,6 +188,8 @@ class Flickr(source.Source):
           return source.creation_result(error_plain=msg, error_html=msg)
         else:
           raise
+      finally:
+        file.close()
 
       photo_id = resp.get('id')
       resp.update({
@@ -154,6 +154,41 @@ mutation {
   }
 }
 """
+# batched issue/PR hydration for get_activities. each subject gets its own
+# aliased repository(...) field, eg s0, s1, ...
+# https://docs.github.com/en/graphql/guides/forming-calls-with-graphql#working-with-aliases
+GRAPHQL_BATCH_SUBJECT = """
+  s%(i)d: repository(owner: "%%(owner%(i)d)s", name: "%%(repo%(i)d)s") {
+    issueOrPullRequest(number: %(number)d) {...issue ...pull}
+  }"""
+GRAPHQL_BATCH_ISSUE_FIELDS = """
+  id number url title body createdAt updatedAt
+  author {...actor}
+  labels(first: 100) {nodes {name}}"""
+GRAPHQL_BATCH_COMMENTS = """
+  comments(last: 100) {
+    nodes {id databaseId url body createdAt updatedAt author {...actor}}
+  }"""
+GRAPHQL_BATCH_REACTIONS = """
+  reactions(last: 100) {
+    nodes {content createdAt user {""" + GRAPHQL_USER_FIELDS + """}}
+  }"""
+GRAPHQL_BATCH_FRAGMENTS = """
+fragment actor on Actor {
+  ... on Bot {""" + GRAPHQL_BOT_FIELDS + """}
+  ... on Organization {""" + GRAPHQL_ORG_FIELDS + """}
+  ... on User {""" + GRAPHQL_USER_FIELDS + """}
+}
+fragment issue on Issue {%(fields)s
+}
+fragment pull on PullRequest {%(fields)s
+  merged baseRefName
+}
+"""
+# https://docs.github.com/en/graphql/overview/rate-limits-and-query-limits-for-the-graphql-api#node-limit
+GRAPHQL_MAX_NODES = 500000
+# page size of each connection in GRAPHQL_BATCH_*
+GRAPHQL_PAGE_SIZE = 100
 
 # key is unicode emoji string, value is GraphQL ReactionContent enum value.
 # https://developer.github.com/v4/enum/reactioncontent/
@@ -181,6 +216,7 @@ REACTIONS_REST = {
   u'👀': 'eyes',
 }
 REACTIONS_REST_CHARS = {char: name for name, char, in REACTIONS_REST.items()}
+REACTIONS_GRAPHQL_CHARS = {enum: char for char, enum in REACTIONS_GRAPHQL.items()}
 
 
 # preserve some HTML elements instead of converting them. eg <code> so that
@@ -216,6 +252,11 @@ class GitHub(source.Source):
 
   Attributes:
     access_token (str): optional, OAuth access token
+    graphql_batch_size (int): optional, if set, ``get_activities`` fetches
+      issues, PRs, comments, and reactions with batched GraphQL queries of up
+      to this many issues and PRs each
+    graphql_rate_limit (dict): GraphQL ``rateLimit`` from the most recent
+      batched query, with ``cost``, ``remaining``, and ``resetAt``
   """
   DOMAIN = 'github.com'
   BASE_URL = 'https://github.com/'
@@ -247,13 +288,18 @@ class GitHub(source.Source):
   }
   OPTIMIZED_COMMENTS = True
 
-  def __init__(self, access_token=None):
+  def __init__(self, access_token=None, graphql_batch_size=None):
     """Constructor.
 
     Args:
       access_token (str): optional OAuth access token
+      graphql_batch_size (int): optional, max issues and PRs per batched
+        GraphQL query in ``get_activities``. If unset, uses one REST API call
+        per issue, comments list, and reactions list instead.
     """
     self.access_token = access_token
+    self.graphql_batch_size = graphql_batch_size
+    self.graphql_rate_limit = None
 
   def user_url(self, username):
     return self.BASE_URL + username
@@ -272,29 +318,35 @@ class GitHub(source.Source):
     if len(parts) == 4 and util.is_int(parts[3]):
       return ':'.join((parts[0], parts[1], parts[3]))
 
-  def graphql(self, graphql, kwargs):
+  def graphql(self, graphql, kwargs, ignore_errors=()):
     """Makes a v4 GraphQL API call.
 
     Args:
       graphql (str): GraphQL operation
+      ignore_errors (sequence of str): error types, eg ``NOT_FOUND``, to log
+        and ignore instead of raising. The data for those fields will be null.
 
     Returns:
       dict: parsed JSON response
     """
     escaped = {k: (email.utils.quote(v) if isinstance(v, str) else v)
                for k, v in kwargs.items()}
-    resp = util.requests_post(
-      GRAPHQL_BASE, json={'query': graphql % escaped},
-      headers={
-        'Authorization': f'bearer {self.access_token}',
-      })
+    resp = source.rate_limited_call(
+      ('github', 'graphql', self.access_token),
+      lambda: util.requests_post(
+        GRAPHQL_BASE, json={'query': graphql % escaped},
+        session=source.http_session(GRAPHQL_BASE),
+        headers={
+          'Authorization': f'bearer {self.access_token}',
+        }))
     resp.raise_for_status()
     result = resp.json()
 
     errs = result.get('errors')
     if errs:
       logger.warning(result)
-      raise ValueError('\n'.join(e.get('message') for e in errs))
+      if not all(e.get('type') in ignore_errors for e in errs):
+        raise ValueError('\n'.join(e.get('message') for e in errs))
 
     return result['data']
 
@@ -316,11 +368,15 @@ class GitHub(source.Source):
     kwargs['headers'].update({
       'Authorization': f'token {self.access_token}',
     })
+    kwargs['session'] = source.http_session(url)
 
+    # GitHub's REST limits are per token across all endpoints
+    # https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
     if data is None:
-      resp = util.requests_get(url, **kwargs)
+      call = lambda: util.requests_get(url, **kwargs)
     else:
-      resp = util.requests_post(url, json=data, **kwargs)
+      call = lambda: util.requests_post(url, json=data, **kwargs)
+    resp = source.rate_limited_call(('github', 'rest', self.access_token), call)
     resp.raise_for_status()
 
     return resp.json() if parse_json else resp
@@ -360,21 +416,37 @@ class GitHub(source.Source):
     since = datetime.datetime(*etag_parsed[:6]) if etag_parsed else None
     issues = []
     activities = []
+    # (comments, reactions) for each issue, from batched GraphQL queries. None
+    # if they still need to be fetched.
+    prefetched = []
 
     if activity_id:
       # single issue
       parts = tuple(activity_id.split(':'))
       if len(parts) != 3:
         raise ValueError('GitHub activity ids must be of the form USER:REPO:ISSUE_OR_PR')
-      try:
-        issues = [self.rest(REST_ISSUE % parts)]
-        activities = [self.issue_to_object(issues[0])]
-      except BaseException as e:
-        code, body = util.interpret_http_exception(e)
-        if util.is_int(code) and int(code) in HTTP_NON_FATAL_CODES:
-          activities = []
-        else:
-          raise
+      hydrated = {}
+      if self.graphql_batch_size and util.is_int(parts[2]):
+        subject = (parts[0], parts[1], int(parts[2]))
+        hydrated = self._hydrate_issues([subject], fetch_replies=fetch_replies,
+                                        fetch_likes=fetch_likes, since=since)
+      if hydrated:
+        issue, comments, reactions = hydrated[subject]
+        if issue:
+          issues = [issue]
+          activities = [self.issue_to_object(issue)]
+          prefetched = [(comments, reactions)]
+      else:
+        try:
+          issues = [self.rest(REST_ISSUE % parts)]
+          activities = [self.issue_to_object(issues[0])]
+          prefetched = [(None, None)]
+        except BaseException as e:
+          code, body = util.interpret_http_exception(e)
+          if util.is_int(code) and int(code) in HTTP_NON_FATAL_CODES:
+            activities = []
+          else:
+            raise
 
     else:
       # all issues/PRs, based on notifications
@@ -386,6 +458,7 @@ class GitHub(source.Source):
       etag = resp.headers.get('Last-Modified')
       notifs = [] if resp.status_code == 304 else resp.json()
 
+      subjects = []  # (notification, subject url, (owner, repo, number))
       for notif in notifs:
         id = notif.get('id')
         subject_url = notif.get('subject').get('url')
@@ -398,14 +471,29 @@ class GitHub(source.Source):
             'Skipping thread %s with subject %s, only issues and PRs right now',
             id, subject_url)
           continue
-
-        try:
-          issue = self.rest(subject_url)
-        except requests.HTTPError as e:
-          if e.response.status_code in HTTP_NON_FATAL_CODES:
-            util.interpret_http_exception(e)
+        subjects.append((notif, subject_url,
+                         (split[-4], split[-3], util.is_int(split[-1]) and int(split[-1]))))
+
+      hydrated = {}
+      if self.graphql_batch_size:
+        hydrated = self._hydrate_issues(
+          [s for _, _, s in subjects if s[2] is not False],
+          fetch_replies=fetch_replies, fetch_likes=fetch_likes, since=since)
+
+      for notif, subject_url, subject in subjects:
+        if subject in hydrated:
+          issue, comments, reactions = hydrated[subject]
+          if not issue:
             continue
-          raise
+        else:
+          comments = reactions = None
+          try:
+            issue = self.rest(subject_url)
+          except requests.HTTPError as e:
+            if e.response.status_code in HTTP_NON_FATAL_CODES:
+              util.interpret_http_exception(e)
+              continue
+            raise
 
         obj = self.issue_to_object(issue)
 
@@ -418,15 +506,17 @@ class GitHub(source.Source):
 
         issues.append(issue)
         activities.append(obj)
+        prefetched.append((comments, reactions))
 
     # add comments and reactions, if requested
-    assert len(issues) == len(activities)
-    for issue, obj in zip(issues, activities):
+    assert len(issues) == len(activities) == len(prefetched)
+    for issue, obj, (comments, reactions) in zip(issues, activities, prefetched):
       comments_url = issue.get('comments_url')
-      if fetch_replies and comments_url:
+      if fetch_replies and comments is None and comments_url:
         if since:
           comments_url += f'?since={since.isoformat()}' + 'Z'
         comments = self.rest(comments_url)
+      if fetch_replies and comments is not None:
         comment_objs = list(util.trim_nulls(
           self.comment_to_object(c) for c in comments))
         obj['replies'] = {
@@ -435,8 +525,9 @@ class GitHub(source.Source):
         }
 
       if fetch_likes:
-        issue_url = issue['url'].replace('pulls', 'issues')
-        reactions = self.rest(issue_url + '/reactions')
+        if reactions is None:
+          issue_url = issue['url'].replace('pulls', 'issues')
+          reactions = self.rest(issue_url + '/reactions')
         obj.setdefault('tags', []).extend(
           self.reaction_to_object(r, obj) for r in reactions)
 
@@ -444,6 +535,113 @@ class GitHub(source.Source):
     response['etag'] = etag
     return response
 
+  def _hydrate_issues(self, subjects, fetch_replies=False, fetch_likes=False,
+                      since=None):
+    """Fetches issues and PRs, and optionally their comments and reactions.
+
+    Uses aliased v4 GraphQL queries of up to :attr:`graphql_batch_size` issues
+    and PRs each, fewer if needed to stay under GitHub's node limit. Converts
+    the results to the v3 REST API shapes that :meth:`issue_to_object`,
+    :meth:`comment_to_object`, and :meth:`reaction_to_object` expect.
+
+    Stops early if the last query's ``rateLimit`` says there aren't enough
+    points left for the next one. Callers should fall back to the REST API for
+    subjects that aren't in the returned dict.
+
+    * https://docs.github.com/en/graphql/guides/forming-calls-with-graphql#working-with-aliases
+    * https://docs.github.com/en/graphql/overview/rate-limits-and-query-limits-for-the-graphql-api
+
+    Args:
+      subjects (sequence of tuple): ``(owner, repo, number)``
+      fetch_replies (bool): whether to fetch comments
+      fetch_likes (bool): whether to fetch emoji reactions
+      since (datetime.datetime): optional, only include comments updated at or
+        after this time
+
+    Returns:
+      dict: maps ``(owner, repo, number)`` tuple to ``(issue, comments,
+      reactions)`` tuple. ``issue`` is None if it wasn't found, eg it or its
+      repo was deleted. ``comments`` and ``reactions`` are lists if they were
+      fetched, otherwise None.
+    """
+    subjects = list(dict.fromkeys(subjects))
+
+    fields = GRAPHQL_BATCH_ISSUE_FIELDS
+    connections = 1  # labels
+    if fetch_replies:
+      fields += GRAPHQL_BATCH_COMMENTS
+      connections += 1
+    if fetch_likes:
+      fields += GRAPHQL_BATCH_REACTIONS
+      connections += 1
+    fragments = GRAPHQL_BATCH_FRAGMENTS % {'fields': fields}
+
+    nodes_per_subject = 1 + connections * GRAPHQL_PAGE_SIZE
+    batch_size = max(1, min(self.graphql_batch_size,
+                            GRAPHQL_MAX_NODES // nodes_per_subject))
+    since_str = since.isoformat() + 'Z' if since else None
+
+    hydrated = {}
+    for start in range(0, len(subjects), batch_size):
+      batch = subjects[start:start + batch_size]
+
+      # each connection costs one request per subject, and GitHub charges one
+      # point per 100 requests, minimum one
+      cost = max(1, round(len(batch) * connections / 100))
+      limit = self.graphql_rate_limit
+      if (limit and limit.get('remaining', cost) < cost
+          and util.parse_iso8601(limit['resetAt']) > util.now()):
+        logger.warning(f'Out of GraphQL rate limit points until {limit["resetAt"]}, skipping {len(subjects) - start} issues and PRs')
+        break
+
+      query = ('query {\n  rateLimit {cost remaining resetAt}' +
+               ''.join(GRAPHQL_BATCH_SUBJECT % {'i': i, 'number': number}
+                       for i, (_, _, number) in enumerate(batch)) +
+               '\n}\n' + fragments)
+      kwargs = {}
+      for i, (owner, repo, _) in enumerate(batch):
+        kwargs[f'owner{i}'] = owner
+        kwargs[f'repo{i}'] = repo
+
+      data = self.graphql(query, kwargs, ignore_errors=('NOT_FOUND',))
+      self.graphql_rate_limit = data.get('rateLimit')
+
+      for i, subject in enumerate(batch):
+        node = (data.get(f's{i}') or {}).get('issueOrPullRequest')
+        if not node:
+          logger.info(f'Skipping {":".join(map(str, subject))}, not found')
+          hydrated[subject] = (None, None, None)
+          continue
+
+        issue = {
+          **node,
+          'labels': (node.get('labels') or {}).get('nodes') or [],
+          'updated_at': node.get('updatedAt'),
+        }
+        if 'baseRefName' in node:
+          issue['base'] = {'ref': node['baseRefName']}
+
+        comments = reactions = None
+        if fetch_replies:
+          comments = [{
+            **c,
+            'id': c.get('databaseId'),
+            'node_id': c.get('id'),
+            'updated_at': c.get('updatedAt'),
+          } for c in (issue.pop('comments', None) or {}).get('nodes') or []
+            if not since_str or (c.get('updatedAt') or '') >= since_str]
+        if fetch_likes:
+          reactions = [{
+            'content': REACTIONS_REST.get(
+              REACTIONS_GRAPHQL_CHARS.get(r.get('content'))),
+            'created_at': r.get('createdAt'),
+            'user': r.get('user'),
+          } for r in (issue.pop('reactions', None) or {}).get('nodes') or []]
+
+        hydrated[subject] = (issue, comments, reactions)
+
+    return hydrated
+
   def get_actor(self, user_id=None):
     """Fetches and returns a user.
 
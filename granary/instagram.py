@@ -8,12 +8,18 @@ not, so the Audience Targeting ``to`` field is currently always set to
 * https://groups.google.com/forum/m/#!topic/instagram-api-developers/DAO7OriVFsw
 * https://groups.google.com/forum/#!searchin/instagram-api-developers/private
 """
+import collections
 import datetime
+import functools
+import hashlib
 import itertools
+import json
 import logging
 import operator
 import re
 import string
+import threading
+import time
 import urllib.parse, urllib.request
 import xml.sax.saxutils
 
@@ -59,6 +65,13 @@ HTML_DEFINES_RE = re.compile(r"""
   handleWithCustomApplyEach\(ScheduledApplyEach, *
   (.+?)
   \);}\);}""", re.VERBOSE)
+# start of the media node's JSON in a photo or video permalink page
+HTML_SHORTCODE_MEDIA_RE = re.compile(r'"shortcode_media"\s*:\s*(?={)')
+# start of a feed_v2 style items array. other JSON in the page, eg nav and
+# config, also has "items" arrays, so check that they're media too.
+HTML_ITEMS_RE = re.compile(r'"items"\s*:\s*(?=\[)')
+# fields that feed_v2 style media items have. not pk, since users have it too.
+MEDIA_ITEM_FIELDS = ('code', 'media_type')
 
 # duplicated in bridgy/browser-extension/instagram.js and
 # instagram-atom/browser-extension/instagram.js
@@ -76,6 +89,19 @@ MENTION_RE = re.compile(r'@([A-Za-z0-9._]+)')
 RATE_LIMIT_BACKOFF = datetime.timedelta(seconds=5 * 60)
 _last_rate_limited = None      # datetime
 _last_rate_limited_exc = None  # requests.HTTPError
+RATE_LIMIT_HTTP_CODES = ('302', '401', '429', '503')
+
+# minimum time between starting concurrent permalink page fetches for extras
+# with the same cookie, in seconds. only used when threads is set; serial
+# fetches aren't paced.
+SCRAPE_EXTRAS_INTERVAL = .2
+# maps hash of cookie to time.monotonic() value, least recently used first
+_next_extras_fetch = collections.OrderedDict()
+_next_extras_fetch_lock = threading.Lock()
+_NEXT_EXTRAS_FETCH_MAX_SIZE = 1000
+
+# alias allows unit tests to mock this function
+sleep_fn = time.sleep
 
 AUTO_ALT_TEXT_PREFIXES = (
   'No photo description available.',
@@ -101,7 +127,7 @@ class Instagram(source.Source):
   """
 
   def __init__(self, access_token=None, allow_comment_creation=False,
-               scrape=False, cookie=None):
+               scrape=False, cookie=None, threads=None):
     """Constructor.
 
     If an OAuth access token is provided, it will be passed on to Instagram.
@@ -115,11 +141,15 @@ class Instagram(source.Source):
       scrape (bool): whether to scrape instagram.com's HTML (True) or use
         the API (False)
       cookie (str): optional sessionid cookie to use when scraping.
+      threads (int): optional, maximum number of concurrent photo and video
+        page fetches when scraping likes and comments. Defaults to fetching
+        them serially.
     """
     self.access_token = access_token
     self.allow_comment_creation = allow_comment_creation
     self.scrape = scrape
     self.cookie = cookie
+    self.threads = threads
 
   def urlopen(self, url, **kwargs):
     """Wraps :func:`urllib2.urlopen()` and passes through the access token."""
@@ -237,7 +267,7 @@ class Instagram(source.Source):
           cookie=cookie, fetch_extras=fetch_replies or fetch_likes, cache=cache)
       except Exception as e:
         code, body = util.interpret_http_exception(e)
-        if not ignore_rate_limit and code in ('302', '401', '429', '503'):
+        if not ignore_rate_limit and code in RATE_LIMIT_HTTP_CODES:
           logger.info(f'Got rate limited! Remembering for {RATE_LIMIT_BACKOFF}')
           _last_rate_limited = now
           _last_rate_limited_exc = e
@@ -325,7 +355,8 @@ class Instagram(source.Source):
     url = (HTML_MEDIA % shortcode if shortcode
            else HTML_PROFILE % user_id if user_id and group_id == source.SELF
            else HTML_BASE_URL)
-    get_kwargs = {'allow_redirects': False}
+    get_kwargs = {'allow_redirects': False,
+                  'session': source.http_session(HTML_BASE_URL)}
     if cookie:
       if not cookie.startswith('sessionid='):
         cookie = 'sessionid=' + cookie
@@ -353,6 +384,7 @@ class Instagram(source.Source):
         # for convenience, throwaway object just for this method
         cache = {}
 
+      changed = []  # (index, cache updates) tuples
       for i, activity in enumerate(activities):
         obj = activity['object']
         _, id = util.parse_tag_uri(activity['id'])
@@ -363,22 +395,129 @@ class Instagram(source.Source):
 
         if (likes and likes != cache.get(likes_key) or
             comments and comments != cache.get(comments_key)):
-          if not activity_id and not shortcode:
-            url = activity['url'].replace(self.BASE_URL, HTML_BASE_URL)
-            resp = util.requests_get(url, **get_kwargs)
-            resp.raise_for_status()
-          # otherwise resp is a fetch of just this activity; reuse it
-
-          full_activity, _ = self.scraped_to_activities(
-            resp.text, cookie=cookie, count=count, fetch_extras=fetch_extras)
-          if full_activity:
-            activities[i] = full_activity[0]
-            cache.update({likes_key: likes, comments_key: comments})
+          changed.append((i, {likes_key: likes, comments_key: comments}))
+
+      def fetch(activity):
+        if activity_id or shortcode:
+          # resp is a fetch of just this activity; reuse it
+          html = resp.text
+        else:
+          url = activity['url'].replace(self.BASE_URL, HTML_BASE_URL)
+          html = self._scrape_extras_page(url, cookie, get_kwargs,
+                                          pace=bool(self.threads))
+        return self._scraped_media_to_activities(html, cookie=cookie, count=count)
+
+      full_activities = source.run_concurrently(
+        [functools.partial(fetch, activities[i]) for i, _ in changed],
+        threads=self.threads)
+
+      for (i, cache_updates), full_activity in zip(changed, full_activities):
+        if full_activity:
+          activities[i] = full_activity[0]
+          cache.update(cache_updates)
 
     resp = self.make_activities_base_response(activities)
     resp['actor'] = actor
     return resp
 
+  @staticmethod
+  def _scrape_extras_page(url, cookie, get_kwargs, pace=False):
+    """Fetches a photo or video permalink page for extras.
+
+    If ``pace`` is True, starts fetches with the same cookie at least
+    ``SCRAPE_EXTRAS_INTERVAL`` apart. Honors ``RATE_LIMIT_BACKOFF``: if we've
+    been rate limited recently, raises the remembered exception instead of
+    fetching. If this fetch gets rate limited, remembers it right away so that
+    concurrent fetches stop too.
+
+    Args:
+      url (str)
+      cookie (str)
+      get_kwargs (dict): passed through to
+        :func:`oauth_dropins.webutil.util.requests_get`
+      pace (bool): whether to pace fetches, eg when they're concurrent
+
+    Returns:
+      str: HTML
+    """
+    global _last_rate_limited, _last_rate_limited_exc
+    if (_last_rate_limited and
+        datetime.datetime.now() < _last_rate_limited + RATE_LIMIT_BACKOFF):
+      raise _last_rate_limited_exc
+
+    if pace:
+      # don't keep raw session cookies around
+      key = hashlib.sha256((cookie or '').encode()).hexdigest()
+      with _next_extras_fetch_lock:
+        now = time.monotonic()
+        start = max(now, _next_extras_fetch.get(key, now))
+        _next_extras_fetch[key] = start + SCRAPE_EXTRAS_INTERVAL
+        _next_extras_fetch.move_to_end(key)
+        while len(_next_extras_fetch) > _NEXT_EXTRAS_FETCH_MAX_SIZE:
+          _next_extras_fetch.popitem(last=False)
+      if start > now:
+        sleep_fn(start - now)
+
+    try:
+      resp = util.requests_get(url, **get_kwargs)
+      resp.raise_for_status()
+    except BaseException as e:
+      code, _ = util.interpret_http_exception(e)
+      if code in RATE_LIMIT_HTTP_CODES:
+        logger.info(f'Got rate limited! Remembering for {RATE_LIMIT_BACKOFF}')
+        _last_rate_limited = datetime.datetime.now()
+        _last_rate_limited_exc = e
+      raise
+
+    return resp.text
+
+  def _scraped_media_to_activities(self, input, cookie=None, count=None):
+    """Converts a scraped photo or video permalink page to activities, with extras.
+
+    Only extracts and parses the media node's JSON, not the whole page. Falls
+    back to :meth:`scraped_to_activities` if it can't find it. ``"items"``
+    arrays are skipped unless they contain media items, since pages have
+    other, unrelated ones.
+
+    Args:
+      input (str): HTML or JSON
+      cookie (str): optional ``sessionid`` cookie for extra HTTP fetches
+      count (int): number of activities to return, None for all
+
+    Returns:
+      list of dict: ActivityStreams activities
+    """
+    def is_media_items(items):
+      return (isinstance(items, list) and items and
+              all(isinstance(item, dict) and
+                  any(field in (item.get('media_or_ad') or item)
+                      for field in MEDIA_ITEM_FIELDS)
+                  for item in items))
+
+    decoder = json.JSONDecoder()
+    for regex, wrap, valid in (
+        (HTML_SHORTCODE_MEDIA_RE,
+         lambda media: {'graphql': {'shortcode_media': media}},
+         lambda media: isinstance(media, dict)),
+        (HTML_ITEMS_RE, lambda items: {'items': items}, is_media_items),
+    ):
+      for match in regex.finditer(input):
+        try:
+          node, _ = decoder.raw_decode(input, match.end())
+        except ValueError:
+          continue
+        if not valid(node):
+          continue
+        activities, _ = self.scraped_json_to_activities(
+          util.trim_nulls(wrap(node)), cookie=cookie, count=count,
+          fetch_extras=True)
+        if activities:
+          return activities
+
+    activities, _ = self.scraped_to_activities(
+      input, cookie=cookie, count=count, fetch_extras=True)
+    return activities
+
   def get_comment(self, comment_id, activity_id=None, activity_author_id=None,
                   activity=None):
     """Returns an ActivityStreams comment object.
@@ -1095,7 +1234,8 @@ class Instagram(source.Source):
       cookie = 'sessionid=' + cookie
     headers = {'Cookie': cookie, **HEADERS}
 
-    resp = util.requests_get(url, allow_redirects=False, headers=headers)
+    resp = util.requests_get(url, allow_redirects=False, headers=headers,
+                             session=source.http_session(url))
     resp.raise_for_status()
 
     try:
@@ -7,6 +7,7 @@ https://docs.joinmastodon.org/api/
 May also be used for services with Mastodon-compatible APIs, eg Pleroma:
 https://docs-develop.pleroma.social/backend/API/differences_in_mastoapi_responses/
 """
+import functools
 import itertools
 import logging
 import re
@@ -73,6 +74,8 @@ class Mastodon(source.Source):
     instance (str): base URL of Mastodon instance, eg ``https://mastodon.social/``
     user_id (int): optional, current user's id (not username!) on this instance
     access_token (str): optional, OAuth access token
+    threads (int): optional, maximum number of concurrent API calls when
+      fetching extras and uploading media
   """
   DOMAIN = 'N/A'
   BASE_URL = 'N/A'
@@ -88,7 +91,7 @@ class Mastodon(source.Source):
   TRUNCATE_URL_LENGTH = 23
 
   def __init__(self, instance, access_token, user_id=None,
-               truncate_text_length=None):
+               truncate_text_length=None, threads=None):
     """Constructor.
 
     If ``user_id`` is not provided, it will be fetched via the API.
@@ -100,6 +103,10 @@ class Mastodon(source.Source):
       access_token (str): optional OAuth access token
       truncate_text_length (int): optional character limit for toots, overrides
         the default of 500
+      threads (int): optional, maximum number of concurrent API calls to make
+        when fetching replies, likes, and reblogs in
+        :meth:`get_activities_response` and uploading media in
+        :meth:`upload_media`. Defaults to making them serially.
     """
     assert instance
     self.instance = self.BASE_URL = instance
@@ -108,6 +115,7 @@ class Mastodon(source.Source):
     self.TRUNCATE_TEXT_LENGTH = (
       truncate_text_length if truncate_text_length is not None
       else DEFAULT_TRUNCATE_TEXT_LENGTH)
+    self.threads = threads
     self.DOMAIN = util.domain_from_link(instance)
 
     if user_id:
@@ -133,7 +141,11 @@ class Mastodon(source.Source):
     headers['Authorization'] = 'Bearer ' + self.access_token
 
     url = urllib.parse.urljoin(self.instance, path)
-    resp = fn(url, *args, **kwargs)
+    # Mastodon's limits are per account across all endpoints
+    # https://docs.joinmastodon.org/api/rate-limits/
+    resp = source.rate_limited_call(
+      ('mastodon', self.instance, self.access_token),
+      lambda: fn(url, *args, session=source.http_session(url), **kwargs))
     try:
       resp.raise_for_status()
     except BaseException as e:
@@ -222,7 +234,9 @@ class Mastodon(source.Source):
       # for convenience, throwaway object just for this method
       cache = {}
 
-    # fetch extras if necessary
+    # collect the extras we need to fetch. each element is a tuple:
+    # (cache key prefix, count, API path, status, AS1 object)
+    extras = []
     for status in statuses[start_index:]:
       if not include_shares and status.get('reblog'):
         continue
@@ -234,27 +248,34 @@ class Mastodon(source.Source):
         continue
 
       obj = activity['object']
-      count = status.get('replies_count')
-      if fetch_replies and count and count != cache.get('AMRE ' + id):
-        context = self._get(API_CONTEXT % id)
+      for fetch, prefix, field, path in (
+          (fetch_replies, 'AMRE', 'replies_count', API_CONTEXT),
+          (fetch_likes, 'AMF', 'favourites_count', API_FAVORITED_BY),
+          (fetch_shares, 'AMRB', 'reblogs_count', API_REBLOGGED_BY),
+      ):
+        count = status.get(field)
+        if fetch and count and count != cache.get(f'{prefix} {id}'):
+          extras.append((prefix, count, path % id, status, obj))
+
+    # fetch them, possibly concurrently, then merge the results in order so
+    # that the output and cache are deterministic
+    results = source.run_concurrently(
+      [functools.partial(self._get, path) for _, _, path, _, _ in extras],
+      threads=self.threads)
+
+    for (prefix, count, _, status, obj), result in zip(extras, results):
+      if prefix == 'AMRE':
         obj['replies'] = {
           'items': [self.status_to_activity(reply)
-                    for reply in context.get('descendants', [])]
+                    for reply in result.get('descendants', [])]
         }
-        cache['AMRE ' + id] = count
-
-      tags = obj.setdefault('tags', [])
-      count = status.get('favourites_count')
-      if fetch_likes and count and count != cache.get('AMF ' + id):
-        likers = self._get(API_FAVORITED_BY % id)
-        tags.extend(self._make_like(status, l) for l in likers)
-        cache['AMF ' + id] = count
-
-      count = status.get('reblogs_count')
-      if fetch_shares and count and count != cache.get('AMRB ' + id):
-        sharers = self._get(API_REBLOGGED_BY % id)
-        tags.extend(self._make_share(status, s) for s in sharers)
-        cache['AMRB ' + id] = count
+      elif prefix == 'AMF':
+        obj.setdefault('tags', []).extend(
+          self._make_like(status, l) for l in result)
+      elif prefix == 'AMRB':
+        obj.setdefault('tags', []).extend(
+          self._make_share(status, s) for s in result)
+      cache[f"{prefix} {status['id']}"] = count
 
     if fetch_mentions:
       # https://docs.joinmastodon.org/methods/notifications/
@@ -775,6 +796,9 @@ class Mastodon(source.Source):
     * https://docs.joinmastodon.org/methods/statuses/media/
     * https://docs.joinmastodon.org/user/posting/#attachments
 
+    Uploads files concurrently if ``threads`` was passed to the constructor.
+    Each file is streamed from its source URL straight into the upload.
+
     Args:
       media (sequence of dict): AS image or stream objects, eg:
         ``[{'url': 'http://picture', 'displayName': 'a thing'}, ...]``
@@ -782,30 +806,35 @@ class Mastodon(source.Source):
     Returns:
       list of str: media ids for uploaded files
     """
-    uploaded = set()  # URLs uploaded so far; for de-duping
-    ids = []
-
+    to_upload = {}  # maps URL to object; for de-duping
     for obj in media:
       url = util.get_url(obj, key='stream') or util.get_url(obj)
-      if not url or url in uploaded:
-        continue
+      if url and url not in to_upload:
+        to_upload[url] = obj
 
+    def upload(url, obj):
       data = {}
       alt = obj.get('displayName')
       if alt:
         data['description'] = util.ellipsize(alt, chars=MAX_ALT_LENGTH)
 
       # TODO: mime type check?
-      with util.requests_get(url, stream=True) as fetch:
-        fetch.raise_for_status()
-        upload = self._post(API_MEDIA, files={'file': fetch.raw}, data=data)
+      cached = source.fetch_media(url)
+      if cached:
+        with cached:
+          upload = self._post(API_MEDIA, files={'file': cached}, data=data)
+      else:
+        with util.requests_get(url, stream=True,
+                               session=source.http_session(url)) as fetch:
+          fetch.raise_for_status()
+          upload = self._post(API_MEDIA, files={'file': fetch.raw}, data=data)
 
       logger.info(f'Got: {upload}')
-      media_id = upload['id']
-      ids.append(media_id)
-      uploaded.add(url)
+      return upload['id']
 
-    return ids
+    return source.run_concurrently(
+      [functools.partial(upload, url, obj) for url, obj in to_upload.items()],
+      threads=self.threads)
 
   def delete(self, id):
     """Deletes a toot. The authenticated user must have authored it.
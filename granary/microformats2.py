@@ -4,7 +4,7 @@ Microformats2 specs: http://microformats.org/wiki/microformats2
 
 ActivityStreams 1 specs: http://activitystrea.ms/specs/
 """
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import copy
 import html
 import itertools
@@ -12,6 +12,7 @@ import logging
 import urllib.parse
 import string
 import re
+import threading
 import xml.sax.saxutils
 
 import dateutil.parser
@@ -63,6 +64,31 @@ HCARD = string.Template("""\
   </span>
 """)
 LINK = string.Template('  <a class="u-$cls" href="$url"></a>')
+
+
+def _compile_template(template):
+  """Converts a :class:`string.Template` to an equivalent :meth:`str.format` string.
+
+  :meth:`string.Template.substitute` runs a regexp over the whole template on
+  every call. :meth:`str.format_map` is implemented in C and much faster.
+
+  Args:
+    template (string.Template): may only use ``$name`` placeholders
+
+  Returns:
+    str: format string
+  """
+  return template.pattern.sub(
+    lambda match: '{%s}' % match.group('named'),
+    template.template.replace('{', '{{').replace('}', '}}'))
+
+
+# compiled versions of the templates above, used in json_to_html and
+# hcard_to_html
+_HENTRY = _compile_template(HENTRY)
+_HCARD = _compile_template(HCARD)
+_LINK = _compile_template(LINK)
+
 AS_TO_MF2_TYPE = {
   'event': ['h-event'],
   'organization': ['h-card'],
@@ -98,6 +124,10 @@ MF2_TO_AS_TYPE_VERB = {
 # ISO 6709 location string. http://en.wikipedia.org/wiki/ISO_6709
 ISO_6709_RE = re.compile(r'^([-+][0-9.]+)([-+][0-9.]+).*/$')
 
+# author page cache defaults, in seconds and entries. see configure_author_cache
+AUTHOR_PAGE_TTL = 10 * 60
+AUTHOR_PAGE_CACHE_SIZE = 1000
+
 
 def get_string_urls(objs):
   """Extracts string URLs from a list of either string URLs or mf2 dicts.
@@ -173,6 +203,33 @@ def maybe_normalize_iso8601(val):
     return val
 
 
+def _trim_nulls(value):
+  """Like :func:`util.trim_nulls`, but faster for dicts and lists.
+
+  :func:`object_to_json` output is almost entirely dicts, lists, and scalars,
+  so this checks for those first and only falls back to
+  :func:`util.trim_nulls` for other containers. Removes the same values,
+  ie everything falsy except zero and ``False``.
+  """
+  if isinstance(value, dict):
+    trimmed = {}
+    for k, v in value.items():
+      v = _trim_nulls(v)
+      if v or v == 0:
+        trimmed[k] = v
+    return trimmed
+  elif isinstance(value, list):
+    trimmed = []
+    for v in value:
+      v = _trim_nulls(v)
+      if v or v == 0:
+        trimmed.append(v)
+    return trimmed
+  elif isinstance(value, (str, int, float, type(None))):
+    return value
+  return util.trim_nulls(value)
+
+
 def activity_to_json(activity, **kwargs):
   """Converts an ActivityStreams activity to microformats2 JSON.
 
@@ -408,7 +465,7 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
     ret['properties']['longitude'] = [str(long)]
 
   if trim_nulls:
-    ret = util.trim_nulls(ret)
+    ret = _trim_nulls(ret)
   return ret
 
 
@@ -426,8 +483,10 @@ def json_to_object(mf2, actor=None, fetch_mf2=False, rel_urls=None):
     mf2 (dict): decoded JSON microformats2 object
     actor (dict): optional author AS actor object. usually comes from a
       ``rel="author"`` link. if ``mf2`` has its own author, that overrides this
-    fetch_mf2 (bool): whether to fetch additional pages via HTTP if necessary,
-      eg to determine authorship: https://indieweb.org/authorship
+    fetch_mf2 (bool or callable): whether to fetch additional pages via HTTP if
+      necessary, eg to determine authorship: https://indieweb.org/authorship .
+      Pages are fetched with :func:`fetch_author_mf2`. May also be a function
+      with the same signature as :func:`util.fetch_mf2` to use instead.
     rel_urls (dict): optional `rel-urls` field from parsed mf2
 
   Returns:
@@ -447,8 +506,14 @@ def json_to_object(mf2, actor=None, fetch_mf2=False, rel_urls=None):
   else:
     # the author h-card may be on another page. run full authorship algorithm:
     # https://indieweb.org/authorship
+    fetch_mf2_func = None
+    if callable(fetch_mf2):
+      fetch_mf2_func = fetch_mf2
+    elif fetch_mf2:
+      memo = {}
+      fetch_mf2_func = lambda url: fetch_author_mf2(url, memo=memo)
     author = find_author({'items': [mf2]}, hentry=mf2,
-                         fetch_mf2_func=util.fetch_mf2 if fetch_mf2 else None)
+                         fetch_mf2_func=fetch_mf2_func)
 
   if not author:
     author = actor
@@ -648,7 +713,7 @@ def json_to_object(mf2, actor=None, fetch_mf2=False, rel_urls=None):
   return source.Source.postprocess_object(obj)
 
 
-def html_to_activities(html, url=None, actor=None, id=None):
+def html_to_activities(html, url=None, actor=None, id=None, fetch_mf2=False):
   """Converts a microformats2 HTML ``h-feed`` to ActivityStreams activities.
 
   Args:
@@ -658,20 +723,25 @@ def html_to_activities(html, url=None, actor=None, id=None):
       from a ``rel="author"`` link.
     id (str): optional id of specific element to extract and parse. defaults
       to the whole page.
+    fetch_mf2 (bool): passed through to :func:`json_to_activities`
 
   Returns:
     list of dict: ActivityStreams activities
   """
-  return json_to_activities(util.parse_mf2(html, url=url, id=id), actor=actor)
+  return json_to_activities(util.parse_mf2(html, url=url, id=id), actor=actor,
+                            fetch_mf2=fetch_mf2)
 
 
-def json_to_activities(parsed, actor=None):
+def json_to_activities(parsed, actor=None, fetch_mf2=False):
   """Converts parsed microformats2 JSON to ActivityStreams activities.
 
   Args:
     parsed (dict): parsed JSON microformats2 object
     actor (dict): optional author AS actor object for all activities. usually
       comes from a ``rel="author"`` link.
+    fetch_mf2 (bool): whether to fetch author pages via HTTP if necessary to
+      determine authorship. Each author page is fetched at most once, no matter
+      how many items it's the author of.
 
   Returns:
     list of dict: ActivityStreams activities
@@ -679,11 +749,15 @@ def json_to_activities(parsed, actor=None):
   hfeed = mf2util.find_first_entry(parsed, ['h-feed'])
   items = hfeed.get('children', []) if hfeed else parsed.get('items', [])
 
+  if fetch_mf2:
+    memo = {}
+    fetch_mf2 = lambda url: fetch_author_mf2(url, memo=memo)
+
   activities = []
   for item in items:
     types = item.get('type', [])
     if 'h-entry' in types or 'h-event' in types or 'h-cite' in types:
-      obj = json_to_object(item, actor=actor)
+      obj = json_to_object(item, actor=actor, fetch_mf2=fetch_mf2)
       obj['content_is_html'] = True
       if obj.get('verb') or obj.get('objectType') == 'activity':
         activities.append(obj)
@@ -697,31 +771,41 @@ def json_to_activities(parsed, actor=None):
   return activities
 
 
-def activities_to_html(activities, extra='', body_class=''):
+def activities_to_html(activities, extra='', body_class='', stream=False):
   """Converts ActivityStreams activities to a microformats2 HTML ``h-feed``.
 
   Args:
     obj (dict): a decoded JSON ActivityStreams object
     extra (str): extra HTML to be included inside the body tag, at the top
     body_class (str): included as the body tag's class attribute
+    stream (bool): if True, returns a generator that renders and yields the
+      page in chunks, one activity at a time, instead of a single string.
+      Errors while rendering an activity are then raised during iteration.
 
   Returns:
-    str: the content field in ``obj`` with the tags in the ``tags`` field
-    converted to links if they have ``startIndex`` and ``length``, otherwise
-    added to the end.
+    str or generator of str: the content field in ``obj`` with the tags in the
+    ``tags`` field converted to links if they have ``startIndex`` and
+    ``length``, otherwise added to the end.
   """
-  html = '\n'.join(object_to_html(_activity_or_object(a)) for a in activities)
-  return f"""\
+  def chunks():
+    yield f"""\
 <!DOCTYPE html>
 <html>
 <head><meta charset="utf-8"></head>
 <body class="{body_class}">
 {extra}
-{html}
+"""
+    for i, activity in enumerate(activities):
+      if i:
+        yield '\n'
+      yield object_to_html(_activity_or_object(activity))
+    yield """
 </body>
 </html>
 """
 
+  return chunks() if stream else ''.join(chunks())
+
 
 def object_to_html(obj, parent_props=None, synthesize_content=True):
   """Converts an ActivityStreams object to microformats2 HTML.
@@ -776,7 +860,7 @@ def json_to_html(obj, parent_props=None):
 
   links = []
   for prop in 'in-reply-to', 'tag-of':
-    links.extend(LINK.substitute(cls=prop, url=url)
+    links.extend(_LINK.format(cls=prop, url=url)
                  for url in sorted(get_string_urls(props.get(prop, []))))
 
   prop = first_props(props)
@@ -884,8 +968,8 @@ def json_to_html(obj, parent_props=None):
     event_times.append('  to')
   event_times += [f'  <time class="dt-end">{time}</time>' for time in end]
 
-  return HENTRY.substitute(
-    prop,
+  return _HENTRY.format(
+    uid=prop['uid'],
     published=maybe_datetime(prop.get('published'), 'dt-published'),
     updated=maybe_datetime(prop.get('updated'), 'dt-updated'),
     types=' '.join(parent_props + types),
@@ -931,7 +1015,7 @@ def hcard_to_html(hcard, parent_props=None):
   if not prop:
     return ''
 
-  return HCARD.substitute(
+  return _HCARD.format(
     types=' '.join(uniquify(parent_props + hcard.get('type', []))),
     ids='\n'.join([f'<data class="p-uid" value="{uid}"></data>'
                    for uid in props.get('uid', []) if uid] +
@@ -992,14 +1076,15 @@ def render_content(obj, include_location=True, synthesize_content=True,
     mentions.sort(key=lambda t: t['startIndex'])
     last_end = 0
     orig = util.WideUnicode(content)
-    content = util.WideUnicode('')
+    parts = []
     for tag in mentions:
       start = tag['startIndex']
       end = start + tag['length']
-      content = util.WideUnicode(f"{content}{orig[last_end:start]}<a href=\"{tag['url']}\">{orig[start:end]}</a>")
+      parts.append(f"{orig[last_end:start]}<a href=\"{tag['url']}\">{orig[start:end]}</a>")
       last_end = end
 
-    content += orig[last_end:]
+    parts.append(orig[last_end:])
+    content = ''.join(parts)
 
   # is whitespace in this content meaningful? standard heuristic: if there are
   # no HTML tags in it, and it has a newline, then assume yes.
@@ -1174,6 +1259,140 @@ def find_author(parsed, **kwargs):
     })
 
 
+class AuthorPageCache:
+  """In-memory LRU cache of fetched and parsed author pages, with a TTL.
+
+  Used by :func:`fetch_author_mf2`. Pages are served from the cache until
+  their TTL expires, then revalidated with ``If-None-Match`` and
+  ``If-Modified-Since`` if they had an ``ETag`` or ``Last-Modified`` header.
+
+  Attributes:
+    ttl (int): how long to use a cached page without revalidating it, in seconds
+    max_size (int): maximum number of pages to keep
+  """
+  def __init__(self, ttl=AUTHOR_PAGE_TTL, max_size=AUTHOR_PAGE_CACHE_SIZE):
+    self.ttl = ttl
+    self.max_size = max_size
+    # maps str URL to (float expiration timestamp, dict mf2, dict headers)
+    self._pages = OrderedDict()
+    self._lock = threading.Lock()
+
+  def fetch(self, url, gateway=False):
+    """Fetches and parses a page's mf2, or returns it from the cache.
+
+    Args:
+      url (str)
+      gateway (bool): passed through to :func:`util.requests_get`
+
+    Returns:
+      dict: parsed mf2, with the final URL after redirects in ``url``. Shared,
+      so don't modify it!
+
+    Raises:
+      requests.HTTPError: if the fetch fails
+    """
+    now = util.now().timestamp()
+    with self._lock:
+      cached = self._pages.get(url)
+      if cached:
+        self._pages.move_to_end(url)
+
+    headers = {}
+    if cached:
+      expires, mf2, validators = cached
+      if expires > now:
+        return mf2
+      if validators.get('ETag'):
+        headers['If-None-Match'] = validators['ETag']
+      if validators.get('Last-Modified'):
+        headers['If-Modified-Since'] = validators['Last-Modified']
+
+    kwargs = {'headers': headers} if headers else {}
+    resp = util.requests_get(util.fragmentless(url), gateway=gateway,
+                             session=source.http_session(url), **kwargs)
+    if headers and resp.status_code == 304:
+      self._set(url, mf2, validators)
+      return mf2
+
+    resp.raise_for_status()
+    mf2 = util.parse_mf2(resp, id=urllib.parse.urlparse(url).fragment)
+    if mf2 is not None:
+      mf2['url'] = resp.url
+
+    self._set(url, mf2, {name: resp.headers[name]
+                         for name in ('ETag', 'Last-Modified')
+                         if resp.headers.get(name)})
+    return mf2
+
+  def _set(self, url, mf2, validators):
+    if self.ttl <= 0 and not validators:
+      return
+
+    with self._lock:
+      self._pages.pop(url, None)
+      self._pages[url] = (util.now().timestamp() + self.ttl, mf2, validators)
+      while len(self._pages) > self.max_size:
+        self._pages.popitem(last=False)
+
+
+# see configure_author_cache()
+_author_page_cache = None
+
+
+def configure_author_cache(ttl=AUTHOR_PAGE_TTL, max_size=AUTHOR_PAGE_CACHE_SIZE):
+  """Enables and configures the cache of author pages used by :func:`fetch_author_mf2`.
+
+  Cached pages may be up to ``ttl`` seconds stale, so this is disabled by
+  default. Pass ``ttl=0`` to revalidate cached pages on every fetch.
+
+  Can be called again to change the settings. Doing so discards the existing
+  cache.
+
+  Args:
+    ttl (int): how long to use a cached page without revalidating it, in seconds
+    max_size (int): maximum number of pages to keep
+  """
+  global _author_page_cache
+  _author_page_cache = AuthorPageCache(ttl=ttl, max_size=max_size)
+
+
+def disable_author_cache():
+  """Disables the cache from :func:`configure_author_cache`."""
+  global _author_page_cache
+  _author_page_cache = None
+
+
+def fetch_author_mf2(url, memo=None, gateway=False):
+  """Fetches and parses an author page, for :func:`find_author`.
+
+  Drop-in replacement for :func:`util.fetch_mf2` as ``fetch_mf2_func``. If
+  :func:`configure_author_cache` has been called, pages are cached across calls
+  in an :class:`AuthorPageCache`.
+
+  Args:
+    url (str)
+    memo (dict): optional, maps str URL to parsed mf2. Pages in here are
+      returned as is, without checking the cache or revalidating. Fetched
+      pages are added to it. Use one per request to fetch each page at most
+      once, even if it expires from the cache partway through.
+    gateway (bool): passed through to :func:`util.requests_get`
+
+  Returns:
+    dict: parsed mf2. Shared, so don't modify it!
+  """
+  if memo is not None and url in memo:
+    return memo[url]
+
+  cache = _author_page_cache
+  if cache:
+    mf2 = cache.fetch(url, gateway=gateway)
+  else:
+    mf2 = util.fetch_mf2(url, gateway=gateway, session=source.http_session(url))
+  if memo is not None:
+    memo[url] = mf2
+  return mf2
+
+
 def get_title(mf2):
   """Returns an mf2 object's title, ie its ``name``.
 
@@ -35,19 +35,33 @@ TODO:
 * 46: "Nostr Connect," signing proxy that holds user's keys
 * 65: user relays. what would this be in AS1? anything?
 """
+from concurrent import futures
 from datetime import datetime
 from hashlib import sha256
 import logging
 import secrets
+import threading
+import time
 
 import bech32
+try:
+  import coincurve
+except ImportError:
+  coincurve = None
 from oauth_dropins.webutil import util
 from oauth_dropins.webutil.util import HTTP_TIMEOUT, json_dumps, json_loads
-from websockets.exceptions import ConnectionClosed
+from websockets.exceptions import ConnectionClosed, WebSocketException
 from websockets.sync.client import connect
 
 from . import as1
-from .source import creation_result, FRIENDS, INCLUDE_LINK, OMIT_LINK, Source
+from .source import (
+  creation_result,
+  FRIENDS,
+  INCLUDE_LINK,
+  OMIT_LINK,
+  run_concurrently,
+  Source,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -72,6 +86,40 @@ PLATFORMS = {
   'mastodon': 'https://',
 }
 
+# BIP-340 Schnorr signatures over secp256k1, used by NIP-01
+# https://github.com/bitcoin/bips/blob/master/bip-0340.mediawiki
+SECP256K1_P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+SECP256K1_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+SECP256K1_G = (
+  0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+  0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8,
+)
+BIP340_CHALLENGE_TAG = sha256(b'BIP0340/challenge').digest()
+
+# number of events per task in verify_events's process pool
+VERIFY_CHUNK_SIZE = 500
+
+
+def _serialize(event):
+  """Serializes a Nostr event for hashing according to NIP-01.
+
+  Args:
+    event (dict): Nostr event. Fields other than the ones that are hashed, eg
+      ``id`` and ``sig``, are ignored.
+
+  Returns:
+    bytes:
+  """
+  return json_dumps([
+    0,
+    event['pubkey'],
+    event['created_at'],
+    event['kind'],
+    event.get('tags') or [],
+    event['content'],
+  ]).encode()
+
+
 def id_for(event):
   """Generates an id for a Nostr event.
 
@@ -79,19 +127,205 @@ def id_for(event):
     event (dict): Nostr event
 
   Returns:
-    str: 32-character hex-encoded sha256 hash of the event, serialized
+    str: 64-character hex-encoded sha256 hash of the event, serialized
     according to NIP-01
   """
   event.setdefault('tags', [])
   assert event.keys() == set(('content', 'created_at', 'kind', 'pubkey', 'tags'))
-  return sha256(json_dumps([
-    0,
-    event['pubkey'],
-    event['created_at'],
-    event['kind'],
-    event['tags'],
-    event['content'],
-  ]).encode()).hexdigest()
+  return sha256(_serialize(event)).hexdigest()
+
+
+def ids_for(events):
+  """Generates ids for many Nostr events at once.
+
+  Unlike :func:`id_for`, doesn't modify the events, and ignores fields that
+  aren't hashed, eg ``id`` and ``sig``, so it can be used on events received
+  from relays.
+
+  Args:
+    events (iterable of dict): Nostr events
+
+  Returns:
+    list of str: 64-character hex-encoded sha256 hashes, in the same order as
+    ``events``
+  """
+  return [sha256(_serialize(event)).hexdigest() for event in events]
+
+
+def verify_events(events, check_sigs=True, processes=None):
+  """Checks that many Nostr events have valid ids and, optionally, signatures.
+
+  An event is valid if its ``id`` matches its NIP-01 hash and, if
+  ``check_sigs`` is True, its ``sig`` is a valid BIP-340 Schnorr signature of
+  that id by its ``pubkey``.
+
+  Signature checking is CPU bound, so it can optionally be spread across a
+  process pool.
+
+  Args:
+    events (sequence of dict): Nostr events
+    check_sigs (bool): whether to check signatures as well as ids
+    processes (int): optional number of worker processes to check signatures
+      in. If ``None`` or ``0``, checks them in the current process.
+
+  Returns:
+    list of bool: whether each event is valid, in the same order as ``events``
+  """
+  events = list(events)
+  if not processes or not check_sigs or len(events) <= VERIFY_CHUNK_SIZE:
+    return _verify_chunk(events, check_sigs=check_sigs)
+
+  chunks = [events[i:i + VERIFY_CHUNK_SIZE]
+            for i in range(0, len(events), VERIFY_CHUNK_SIZE)]
+  with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+    return sum(executor.map(_verify_chunk, chunks), [])
+
+
+def _verify_chunk(events, check_sigs=True):
+  """Verifies a list of events. See :func:`verify_events`."""
+  results = []
+  for event in events:
+    try:
+      id = sha256(_serialize(event)).digest()
+      valid = (id.hex() == event.get('id') and
+               (not check_sigs or verify_sig(id, event['pubkey'], event['sig'])))
+    except (KeyError, TypeError, ValueError):
+      valid = False
+    results.append(valid)
+
+  return results
+
+
+def verify_sig(msg, pubkey, sig):
+  """Verifies a BIP-340 Schnorr signature.
+
+  Uses `coincurve <https://github.com/ofek/coincurve>`_ (libsecp256k1) if it's
+  installed, otherwise falls back to a much slower pure Python implementation.
+
+  Args:
+    msg (bytes): signed message, for Nostr the raw 32-byte event id
+    pubkey (str): hex-encoded 32-byte x-only public key
+    sig (str): hex-encoded 64-byte signature
+
+  Returns:
+    bool:
+  """
+  pubkey = bytes.fromhex(pubkey)
+  sig = bytes.fromhex(sig)
+  if len(pubkey) != 32 or len(sig) != 64:
+    return False
+
+  if coincurve:
+    try:
+      return coincurve.PublicKeyXOnly(pubkey).verify(sig, msg)
+    except ValueError:  # invalid public key
+      return False
+
+  return _verify_sig_python(msg, pubkey, sig)
+
+
+def _verify_sig_python(msg, pubkey, sig):
+  """Pure Python BIP-340 verification. See :func:`verify_sig`.
+
+  Args:
+    msg (bytes)
+    pubkey (bytes): 32 bytes
+    sig (bytes): 64 bytes
+
+  Returns:
+    bool:
+  """
+  p, n = SECP256K1_P, SECP256K1_N
+
+  P = _lift_x(int.from_bytes(pubkey, 'big'))
+  r = int.from_bytes(sig[:32], 'big')
+  s = int.from_bytes(sig[32:], 'big')
+  if P is None or r >= p or s >= n:
+    return False
+
+  e = int.from_bytes(sha256(BIP340_CHALLENGE_TAG + BIP340_CHALLENGE_TAG +
+                            sig[:32] + pubkey + msg).digest(), 'big') % n
+
+  # R = s*G - e*P, in Jacobian coordinates to avoid a modular inverse per step
+  R = _jacobian_add(_jacobian_mul(SECP256K1_G, s), _jacobian_mul(P, n - e))
+  if R is None:
+    return False
+
+  x, y, z = R
+  z_inv = pow(z, p - 2, p)
+  z_inv_2 = z_inv * z_inv % p
+  return (x * z_inv_2 % p == r and
+          (y * z_inv_2 * z_inv % p) % 2 == 0)
+
+
+def _lift_x(x):
+  """Returns the secp256k1 point with x coordinate x and even y, or None."""
+  p = SECP256K1_P
+  if x >= p:
+    return None
+
+  y_sq = (pow(x, 3, p) + 7) % p
+  y = pow(y_sq, (p + 1) // 4, p)
+  if y * y % p != y_sq:
+    return None
+
+  return (x, y if y % 2 == 0 else p - y)
+
+
+def _jacobian_double(P):
+  if P is None:
+    return None
+
+  p = SECP256K1_P
+  x, y, z = P
+  if y == 0:
+    return None
+
+  y_sq = y * y % p
+  s = 4 * x * y_sq % p
+  m = 3 * x * x % p
+  x3 = (m * m - 2 * s) % p
+  return (x3, (m * (s - x3) - 8 * y_sq * y_sq) % p, 2 * y * z % p)
+
+
+def _jacobian_add(P, Q):
+  if P is None:
+    return Q
+  elif Q is None:
+    return P
+
+  p = SECP256K1_P
+  x1, y1, z1 = P
+  x2, y2, z2 = Q
+  z1_sq = z1 * z1 % p
+  z2_sq = z2 * z2 % p
+  u1 = x1 * z2_sq % p
+  u2 = x2 * z1_sq % p
+  s1 = y1 * z2_sq * z2 % p
+  s2 = y2 * z1_sq * z1 % p
+
+  if u1 == u2:
+    return _jacobian_double(P) if s1 == s2 else None
+
+  h = (u2 - u1) % p
+  r = (s2 - s1) % p
+  h_sq = h * h % p
+  h_cu = h_sq * h % p
+  u1_h_sq = u1 * h_sq % p
+  x3 = (r * r - h_cu - 2 * u1_h_sq) % p
+  return (x3, (r * (u1_h_sq - x3) - s1 * h_cu) % p, h * z1 * z2 % p)
+
+
+def _jacobian_mul(P, k):
+  """Multiplies an affine point by a scalar, returns a Jacobian point."""
+  R = None
+  Q = (P[0], P[1], 1)
+  while k:
+    if k & 1:
+      R = _jacobian_add(R, Q)
+    Q = _jacobian_double(Q)
+    k >>= 1
+  return R
 
 
 def is_bech32(id):
@@ -401,21 +635,289 @@ def to_as1(event):
   return util.trim_nulls(Source.postprocess_object(obj))
 
 
+class Relay:
+  """A long-lived websocket connection to a single Nostr relay.
+
+  Opens the connection lazily, on first use, and reopens it if it closes. Many
+  concurrent subscriptions (and ``EVENT`` publishes) can share the connection.
+  One waiting thread at a time reads from the socket and routes messages for
+  other subscriptions to their queues, so there's no background reader thread.
+  The other waiting threads only block on the socket indirectly, until the
+  reader hands them a message or finishes its read.
+
+  Attributes:
+    uri (str): relay websocket URI
+  """
+  def __init__(self, uri):
+    self.uri = uri
+    self._websocket = None
+    self._send_lock = threading.Lock()
+    # guards _queues and _reading. notified whenever a read finishes.
+    self._recv_cond = threading.Condition()
+    # whether a thread is currently reading from _websocket
+    self._reading = False
+    # maps str subscription id or event id to list of received messages
+    self._queues = {}
+
+  def subscribe(self, key):
+    """Starts buffering messages for a subscription id or event id."""
+    with self._recv_cond:
+      self._queues.setdefault(key, [])
+
+  def unsubscribe(self, key):
+    """Stops buffering messages for a subscription id or event id."""
+    with self._recv_cond:
+      self._queues.pop(key, None)
+
+  def send(self, msg):
+    """Sends a message, opening the connection first if necessary.
+
+    Args:
+      msg (list): Nostr message, eg ``['REQ', ...]``
+
+    If the connection was closed, eg because the relay dropped it while it
+    was idle, reconnects and retries once.
+
+    Returns:
+      bool: True if the message was sent, False if the connection closed
+
+    Raises:
+      OSError or :class:`websockets.exceptions.WebSocketException`: if
+      connecting fails
+    """
+    with self._send_lock:
+      for _ in range(2):
+        if not self._websocket:
+          logger.info(f'Connecting to {self.uri}')
+          self._websocket = connect(self.uri,
+                                    open_timeout=HTTP_TIMEOUT,
+                                    close_timeout=HTTP_TIMEOUT)
+        logger.debug(f'Sending to {self.uri}: {json_dumps(msg)}')
+        try:
+          self._websocket.send(json_dumps(msg))
+          return True
+        except ConnectionClosed as cc:
+          logger.warning(cc)
+          self._websocket = None
+
+      return False
+
+  def recv(self, key):
+    """Receives the next message for a subscription id or event id.
+
+    :meth:`subscribe` must be called for ``key`` first.
+
+    Args:
+      key (str): subscription id or event id
+
+    Returns:
+      list: Nostr message, or None if the connection closed or timed out
+    """
+    deadline = time.monotonic() + HTTP_TIMEOUT
+
+    while True:
+      # wait until we have a message or it's our turn to read
+      with self._recv_cond:
+        while True:
+          queue = self._queues.get(key)
+          if queue:
+            return queue.pop(0)
+
+          websocket = self._websocket
+          if not websocket:
+            return None
+          elif not self._reading:
+            self._reading = True
+            break
+
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            logger.warning(f'Timed out waiting for {self.uri}')
+            return None
+          self._recv_cond.wait(remaining)
+
+      # read without holding the lock so other threads can check their queues
+      msg = None
+      try:
+        msg = websocket.recv(timeout=HTTP_TIMEOUT)
+      except ConnectionClosed as cc:
+        logger.warning(cc)
+        with self._send_lock:
+          if self._websocket is websocket:
+            self._websocket = None
+      except TimeoutError:
+        logger.warning(f'Timed out waiting for {self.uri}')
+
+      with self._recv_cond:
+        self._reading = False
+        self._recv_cond.notify_all()
+
+        if msg is None:
+          return None
+
+        logger.debug(f'Received from {self.uri}: {msg[:500]}')
+        resp = json_loads(msg)
+        if not isinstance(resp, list) or len(resp) < 2:
+          continue
+        elif resp[0] == 'NOTICE':
+          logger.info(f'NOTICE from {self.uri}: {resp[1]}')
+        elif resp[1] == key:
+          return resp
+        elif resp[1] in self._queues:
+          self._queues[resp[1]].append(resp)
+
+  def close(self):
+    """Closes the connection, if it's open."""
+    with self._send_lock:
+      if self._websocket:
+        self._websocket.close()
+        self._websocket = None
+
+
+class RelayPool:
+  """Long-lived connections to Nostr relays, shared across :class:`Nostr`
+  instances and calls.
+
+  Queries and publishes go to all of the given relays at once, one thread per
+  relay, and their results are merged.
+  """
+  def __init__(self):
+    # maps str URI to Relay
+    self._relays = {}
+    self._lock = threading.Lock()
+
+  def relay(self, uri):
+    """Returns the :class:`Relay` for a URI, creating it if necessary."""
+    with self._lock:
+      relay = self._relays.get(uri)
+      if not relay:
+        relay = self._relays[uri] = Relay(uri)
+      return relay
+
+  def query(self, uris, filter):
+    """Runs a Nostr ``REQ`` query on one or more relays and merges the results.
+
+    Events are de-duplicated by id and returned in relay order, then the order
+    each relay returned them. If ``limit`` is not set on the filter, it defaults
+    to 20. Relays that can't be reached are logged and skipped.
+
+    Args:
+      uris (sequence of str): relay URIs
+      filter (dict):  NIP-01 ``REQ`` filter
+
+    Returns:
+      list of dict: Nostr events
+    """
+    limit = filter.setdefault('limit', 20)
+    subscription = secrets.token_urlsafe(16)
+
+    results = run_concurrently(
+      [lambda uri=uri: self._call(
+        uri, lambda relay: self._query(relay, subscription, filter, limit), [])
+       for uri in uris], threads=len(uris))
+
+    events = {}
+    for event in sum(results, []):
+      id = event.get('id')
+      if id not in events:
+        events[id] = event
+
+    return list(events.values())[:limit]
+
+  def _call(self, uri, fn, default):
+    """Calls ``fn(relay)``, returning ``default`` if connecting fails."""
+    try:
+      return fn(self.relay(uri))
+    except (OSError, WebSocketException) as e:
+      logger.warning(f"Couldn't connect to {uri}: {e}")
+      return default
+
+  @staticmethod
+  def _query(relay, subscription, filter, limit):
+    relay.subscribe(subscription)
+    try:
+      if not relay.send(['REQ', subscription, filter]):
+        return []
+
+      events = []
+      while True:
+        resp = relay.recv(subscription)
+        if resp is None:
+          # connection closed, no need to CLOSE the subscription
+          return events
+        elif resp[:3] == ['OK', subscription, False]:
+          return events
+        elif resp[0] == 'EVENT' and len(resp) >= 3:
+          events.append(resp[2])
+          if len(events) >= limit:
+            break
+        elif resp[0] in ('EOSE', 'CLOSED'):
+          break
+
+      relay.send(['CLOSE', subscription])
+      return events
+
+    finally:
+      relay.unsubscribe(subscription)
+
+  def publish(self, uris, event):
+    """Sends an ``EVENT`` to one or more relays.
+
+    Args:
+      uris (sequence of str): relay URIs
+      event (dict): Nostr event
+
+    Returns:
+      list of list: ``OK`` responses, one per relay that responded, in relay
+      order. Relays that can't be reached are logged and skipped.
+    """
+    def publish(relay):
+      relay.subscribe(event['id'])
+      try:
+        if relay.send(['EVENT', event]):
+          return relay.recv(event['id'])
+      finally:
+        relay.unsubscribe(event['id'])
+
+    return [resp for resp in run_concurrently(
+      [lambda uri=uri: self._call(uri, publish, None) for uri in uris],
+      threads=len(uris)) if resp]
+
+  def close(self):
+    """Closes all connections."""
+    with self._lock:
+      for relay in self._relays.values():
+        relay.close()
+      self._relays = {}
+
+
+default_pool = RelayPool()
+"""Default :class:`RelayPool`, shared across :class:`Nostr` instances."""
+
+
 class Nostr(Source):
   """Nostr source class. See file docstring and :class:`Source` for details.
 
   Attributes:
     relays (sequence of str): relay hostnames
+    pool (RelayPool)
   """
 
   DOMAIN = None
   BASE_URL = None
   NAME = 'Nostr'
 
-  def __init__(self, relays):
-    """Constructor."""
+  def __init__(self, relays, pool=None):
+    """Constructor.
+
+    Args:
+      relays (sequence of str): relay websocket URIs. Queries and creates go to
+        all of them.
+      pool (RelayPool): optional, defaults to :attr:`default_pool`
+    """
     assert relays
     self.relays = relays
+    self.pool = pool or default_pool
 
   def get_actor(self, user_id=None):
     """Fetches and returns a Nostr user profile.
@@ -431,19 +933,14 @@ class Nostr(Source):
 
     id = uri_to_id(user_id)
 
-    # query for activities
-    with connect(self.relays[0],
-                 open_timeout=HTTP_TIMEOUT,
-                 close_timeout=HTTP_TIMEOUT,
-                 ) as websocket:
-      events = self.query(websocket, {
-        'authors': [id],
-        'kinds': [0],
-      })
+    events = self.query({
+      'authors': [id],
+      'kinds': [0],
+    })
 
     if events:
-      # will we ever get multiple here? if so, assume the last is the most recent?
-      return to_as1(events[-1])
+      # we may get one from each relay. use the most recent.
+      return to_as1(max(reversed(events), key=lambda e: e.get('created_at') or 0))
 
   def get_activities_response(self, user_id=None, group_id=None, app_id=None,
                               activity_id=None, fetch_replies=False,
@@ -478,87 +975,48 @@ class Nostr(Source):
     if search_query:
       filter['search'] = search_query
 
-    events = []
-    logger.info(f'Connecting to {self.relays[0]}')
-
     # query for activities
-    with connect(self.relays[0],
-                 open_timeout=HTTP_TIMEOUT,
-                 close_timeout=HTTP_TIMEOUT,
-                 ) as websocket:
-      events = self.query(websocket, filter)
-      event_ids = [e['id'] for e in events]
-      # maps raw Nostr id to activity
-      activities = {uri_to_id(a['id']): a
-                    for a in [to_as1(e) for e in events]}
-      assert len(activities) == len(events)
-
-      # query for replies/shares
-      if event_ids and (fetch_replies or fetch_shares):
-        for event in self.query(websocket, {'#e': event_ids}):
-          obj = to_as1(event)
-          if in_reply_to := obj.get('inReplyTo'):
-            activity = activities.get(uri_to_id(in_reply_to))
-            if activity:
-              replies = activity.setdefault('replies', {
-                'items': [],
-                'totalItems': 0,
-              })
-              replies['items'].append(obj)
-              replies['totalItems'] += 1
-          elif obj.get('verb') == 'share':
-            activity = activities.get(uri_to_id(as1.get_object(obj).get('id')))
-            if activity:
-              activity.setdefault('tags', []).append(obj)
+    events = self.query(filter)
+    event_ids = [e['id'] for e in events]
+    # maps raw Nostr id to activity
+    activities = {uri_to_id(a['id']): a
+                  for a in [to_as1(e) for e in events]}
+    assert len(activities) == len(events)
+
+    # query for replies/shares
+    if event_ids and (fetch_replies or fetch_shares):
+      for event in self.query({'#e': event_ids}):
+        obj = to_as1(event)
+        if in_reply_to := obj.get('inReplyTo'):
+          activity = activities.get(uri_to_id(in_reply_to))
+          if activity:
+            replies = activity.setdefault('replies', {
+              'items': [],
+              'totalItems': 0,
+            })
+            replies['items'].append(obj)
+            replies['totalItems'] += 1
+        elif obj.get('verb') == 'share':
+          activity = activities.get(uri_to_id(as1.get_object(obj).get('id')))
+          if activity:
+            activity.setdefault('tags', []).append(obj)
 
     return self.make_activities_base_response(util.trim_nulls(activities.values()))
 
-  def query(self, websocket, filter):
-    """Runs a Nostr ``REQ`` query on an open websocket.
+  def query(self, filter):
+    """Runs a Nostr ``REQ`` query on all of this source's relays.
 
     Sends the query, collects the responses, and closes the ``REQ`` subscription.
-    If ``limit`` is not set on the filter, it defaults to 20.
+    If ``limit`` is not set on the filter, it defaults to 20. Results from all
+    relays are merged and de-duplicated by event id.
 
     Args:
-      websocket (websockets.sync.client.ClientConnection)
       filter (dict):  NIP-01 ``REQ`` filter
-      limit (int)
 
     Returns:
       list of dict: Nostr events
-
-    Raises:
-      AssertionError: if the filter ``limit`` field is not set.
     """
-    limit = filter.setdefault('limit', 20)
-
-    subscription = secrets.token_urlsafe(16)
-    req = ['REQ', subscription, filter]
-    logger.debug(f'Sending: {json_dumps(req)}')
-    websocket.send(json_dumps(req))
-
-    events = []
-    while True:
-      try:
-        msg = websocket.recv(timeout=HTTP_TIMEOUT)
-      except ConnectionClosed as cc:
-        logger.warning(cc)
-        break
-
-      logger.debug(f'Received: {msg[:500]}')
-      resp = json_loads(msg)
-      if resp[:3] == ['OK', subscription, False]:
-        return events
-      elif resp[:2] == ['EVENT', subscription]:
-        events.append(resp[2])
-      elif len(events) >= limit or resp[:2] == ['EOSE', subscription]:
-        break
-
-    close = ['CLOSE', subscription]
-    logger.debug(f'Sending: {json_dumps(close)}')
-    websocket.send(json_dumps(close))
-
-    return events
+    return self.pool.query(self.relays, filter)
 
   def create(self, obj, include_link=OMIT_LINK, ignore_formatting=False):
     """Creates a new object: a post, comment, like, repost, etc.
@@ -581,22 +1039,13 @@ class Nostr(Source):
         content += '\n' + url
       event['content'] = content
 
-    with connect(self.relays[0],
-                 open_timeout=HTTP_TIMEOUT,
-                 close_timeout=HTTP_TIMEOUT,
-                 ) as websocket:
-      create = ['EVENT', event]
-      logger.debug(f'Sending: {json_dumps(create)}')
-      websocket.send(json_dumps(create))
-      try:
-        msg = websocket.recv(timeout=HTTP_TIMEOUT)
-      except ConnectionClosed as cc:
-        logger.warning(cc)
-        return
+    resps = self.pool.publish(self.relays, event)
+    if not resps:
+      return
 
-    logger.debug(f'Received: {msg}')
-    resp = json_loads(msg)
-    if resp[:3] == ['OK', event['id'], True]:
-      return creation_result(event)
+    # succeed if any relay accepted it
+    for resp in resps:
+      if resp[:3] == ['OK', event['id'], True]:
+        return creation_result(event)
 
-    return creation_result(error_plain=resp[-1], abort=True)
+    return creation_result(error_plain=resps[0][-1], abort=True)
@@ -14,9 +14,11 @@ Notably:
 * Images should be JPEG or PNG, 1400x1400 to 3000x3000.
 * HTTP server that hosts assets and files should support range requests.
 """
+import collections
 from datetime import datetime, time, timezone
 import logging
 import mimetypes
+from xml.etree import ElementTree
 
 import dateutil.parser
 from feedgen.feed import FeedGenerator
@@ -32,6 +34,8 @@ logger = logging.getLogger(__name__)
 CONTENT_TYPE = 'application/rss+xml; charset=utf-8'
 # allowed ActivityStreams objectTypes for media enclosures
 ENCLOSURE_TYPES = {'audio', 'video'}
+# local names of per-post elements: RSS 0.9x, 1.0, 2.0, and Atom
+ITEM_TAGS = {'item', 'entry'}
 
 
 def from_activities(activities, actor=None, title=None, feed_url=None,
@@ -193,16 +197,189 @@ def to_activities(rss):
     list of dict: ActivityStreams activity
   """
   parsed = feedparser.parse(rss)
-  activities = []
+  actor = _feed_to_actor(parsed.get('feed', {}))
+  return util.trim_nulls([_entry_to_activity(entry, actor)
+                          for entry in parsed.get('entries', [])])
 
-  feed = parsed.get('feed', {})
-  actor = {
+
+def iter_activities(rss, count=None, chunk_size=64 * 1024):
+  """Incrementally converts an RSS feed to ActivityStreams 1 activities.
+
+  Parses the feed with :class:`xml.etree.ElementTree.XMLPullParser` and runs
+  each ``<item>`` through feedparser on its own, along with the channel-level
+  elements before the first item, as soon as the item has been parsed. Only
+  one item is held in memory at a time. Channel-level elements after the first
+  item are ignored, so if a feed puts eg its ``<title>`` after its items, the
+  actor may differ from :func:`to_activities`. If ``count`` is provided, stops
+  reading the feed as soon as it has converted that many items.
+
+  If a ``str`` or ``bytes`` feed, or a response whose body has already been
+  read, isn't well-formed XML, which feedparser tolerates, falls back to
+  parsing the whole document with feedparser. Streamed feeds aren't kept in
+  memory, so they don't fall back.
+
+  Args:
+    rss (bytes, str, file-like object, iterable of bytes, or
+      :class:`requests.Response`): RSS document with top-level ``<rss>``
+      element. Responses are read with
+      :meth:`requests.Response.iter_content`, so they can be fetched with
+      ``stream=True``.
+    count (int): if provided, stop after this many activities
+    chunk_size (int): read size for file-like objects and responses
+
+  Yields:
+    dict: ActivityStreams activity
+
+  Raises:
+    xml.etree.ElementTree.ParseError: if a streamed feed isn't well-formed XML
+  """
+  if count is not None and count <= 0:
+    return
+
+  doc = None
+  if isinstance(rss, str):
+    doc = rss.encode('utf-8')
+  elif isinstance(rss, (bytes, bytearray)):
+    doc = rss
+  elif isinstance(getattr(rss, '_content', None), bytes):
+    # requests.Response that's already been read, eg by util.requests_get to
+    # check its size
+    doc = rss.content
+
+  if doc is not None:
+    chunks = [doc]
+  elif hasattr(rss, 'iter_content'):
+    chunks = rss.iter_content(chunk_size)
+  elif hasattr(rss, 'read'):
+    chunks = iter(lambda: rss.read(chunk_size), b'')
+  else:
+    chunks = rss
+
+  yielded = 0
+  try:
+    for activity in _iter_items(chunks):
+      yield activity
+      yielded += 1
+      if yielded == count:
+        return
+  except ElementTree.ParseError:
+    if doc is None:
+      raise
+    logger.info('Feed is not well-formed XML, falling back to feedparser')
+    remaining = None if count is None else count - yielded
+    activities = to_activities(doc)[yielded:]
+    yield from activities[:remaining]
+
+
+def _iter_items(chunks):
+  """Yields an activity for each item in a stream of RSS bytes.
+
+  Each item is converted as soon as its end tag is parsed, so callers can stop
+  iterating, and stop reading ``chunks``, at any point.
+
+  Args:
+    chunks (iterable of bytes or str)
+
+  Raises:
+    xml.etree.ElementTree.ParseError: if the document isn't well-formed XML
+  """
+  parser = ElementTree.XMLPullParser(events=('start', 'end'))
+  # open elements. the parser builds the tree ahead of the events we've
+  # handled, so we track feed-level children ourselves, keyed by parent,
+  # instead of serializing the tree as is.
+  stack = []
+  children = collections.defaultdict(list)
+  # maps tuple of ancestor elements to (root, innermost element) of a copy of
+  # them with just their feed-level children before the first item. built once,
+  # at the first item, and reused for every item after that.
+  shells = {}
+
+  def is_item(elem):
+    return elem.tag.split('}')[-1] in ITEM_TAGS
+
+  def shell_for(ancestors):
+    if ancestors not in shells:
+      root = parent = None
+      for ancestor in ancestors:
+        shell = ElementTree.Element(ancestor.tag, ancestor.attrib)
+        shell.extend(children[ancestor])
+        if parent is None:
+          root = shell
+        else:
+          parent.append(shell)
+        parent = shell
+      shells[ancestors] = (root, parent)
+    return shells[ancestors]
+
+  def convert(ancestors, elem):
+    # build a document with just this item and the feed-level elements
+    # around it
+    root, parent = shell_for(ancestors)
+    parent.append(elem)
+    try:
+      parsed = feedparser.parse(ElementTree.tostring(root))
+    finally:
+      parent.remove(elem)
+      elem.clear()
+
+    actor = _feed_to_actor(parsed.get('feed', {}))
+    for entry in parsed.get('entries', []):
+      yield util.trim_nulls(_entry_to_activity(entry, actor))
+
+  def handle_events():
+    for event, elem in parser.read_events():
+      if event == 'start':
+        stack.append(elem)
+        continue
+
+      stack.pop()
+      if not stack or any(is_item(e) for e in stack):
+        continue
+
+      stack[-1].remove(elem)
+      if is_item(elem):
+        yield from convert(tuple(stack), elem)
+      elif shells:
+        elem.clear()  # feed-level element after the first item
+      else:
+        children[stack[-1]].append(elem)
+
+  for chunk in chunks:
+    parser.feed(chunk)
+    yield from handle_events()
+
+  parser.close()
+  yield from handle_events()
+
+
+def _feed_to_actor(feed):
+  """Converts a feedparser feed to an ActivityStreams 1 actor.
+
+  Args:
+    feed (dict): feedparser ``feed`` value
+
+  Returns:
+    dict: ActivityStreams actor
+  """
+  return {
     'displayName': feed.get('title'),
     'url': feed.get('link'),
     'summary': feed.get('info') or feed.get('description'),
     'image': [{'url': feed.get('image', {}).get('href') or feed.get('logo')}],
   }
 
+
+def _entry_to_activity(entry, actor):
+  """Converts a feedparser entry to an ActivityStreams 1 activity.
+
+  Args:
+    entry (dict): feedparser entry
+    actor (dict): ActivityStreams actor for the feed, used if the entry
+      doesn't have its own author
+
+  Returns:
+    dict: ActivityStreams activity
+  """
   def iso_datetime(field):
     # check for existence because feedparser returns 'published' for 'updated'
     # when you [] or .get() it
@@ -215,53 +392,50 @@ def to_activities(rss):
   def as_int(val):
     return int(val) if util.is_int(val) else val
 
-  for entry in parsed.get('entries', []):
-    id = entry.get('id')
-    uri = entry.get('uri') or entry.get('link')
-
-    attachments = []
-    for e in entry.get('enclosures', []):
-      url = e.get('href')
-      if url:
-        mime = e.get('type') or mimetypes.guess_type(url)[0] or ''
-        type = mime.split('/')[0]
-        attachments.append({
-          'stream': {
-            'url': url,
-            'size': as_int(e.get('length')),
-            'duration': as_int(entry.get('itunes_duration')),
-          },
-          'objectType': type if type in ENCLOSURE_TYPES else None,
-        })
-
-    detail = entry.get('author_detail', {})
-    author = util.trim_nulls({
-      'displayName': detail.get('name') or entry.get('author'),
-      'url': detail.get('href'),
-      'email': detail.get('email'),
-    })
-    if not author:
-      author = actor
-
-    activities.append(Source.postprocess_activity({
-      'objectType': 'activity',
-      'verb': 'post',
-      'id': id,
+  id = entry.get('id')
+  uri = entry.get('uri') or entry.get('link')
+
+  attachments = []
+  for e in entry.get('enclosures', []):
+    url = e.get('href')
+    if url:
+      mime = e.get('type') or mimetypes.guess_type(url)[0] or ''
+      type = mime.split('/')[0]
+      attachments.append({
+        'stream': {
+          'url': url,
+          'size': as_int(e.get('length')),
+          'duration': as_int(entry.get('itunes_duration')),
+        },
+        'objectType': type if type in ENCLOSURE_TYPES else None,
+      })
+
+  detail = entry.get('author_detail', {})
+  author = util.trim_nulls({
+    'displayName': detail.get('name') or entry.get('author'),
+    'url': detail.get('href'),
+    'email': detail.get('email'),
+  })
+  if not author:
+    author = actor
+
+  return Source.postprocess_activity({
+    'objectType': 'activity',
+    'verb': 'post',
+    'id': id,
+    'url': uri,
+    'actor': author,
+    'object': {
+      'objectType': 'article',
+      'id': id or uri,
       'url': uri,
-      'actor': author,
-      'object': {
-        'objectType': 'article',
-        'id': id or uri,
-        'url': uri,
-        'displayName': entry.get('title'),
-        'content': entry.get('content', [{}])[0].get('value') or entry.get('description'),
-        'published': iso_datetime('published'),
-        'updated': iso_datetime('updated'),
-        'author': author,
-        'tags': [{'displayName': tag.get('term') for tag in entry.get('tags', [])}],
-        'attachments': attachments,
-        'stream': [a['stream'] for a in attachments],
-      },
-    }))
-
-  return util.trim_nulls(activities)
+      'displayName': entry.get('title'),
+      'content': entry.get('content', [{}])[0].get('value') or entry.get('description'),
+      'published': iso_datetime('published'),
+      'updated': iso_datetime('updated'),
+      'author': author,
+      'tags': [{'displayName': tag.get('term') for tag in entry.get('tags', [])}],
+      'attachments': attachments,
+      'stream': [a['stream'] for a in attachments],
+    },
+  })
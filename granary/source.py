@@ -9,15 +9,29 @@ activity's privacy settings. It's set to a group with alias ``@public`` or
 http://activitystrea.ms/specs/json/targeting/1.0/#anchor3
 """
 import collections
+from concurrent import futures
 import copy
+import functools
+import hashlib
 from html import escape, unescape
+import http.cookiejar
+import io
 import logging
+import mimetypes
+import os
 import re
+import struct
+import tempfile
+import threading
+import time
+import urllib.error
 import urllib.parse
 
 import brevity
 from bs4 import BeautifulSoup
+import dateutil.parser
 import html2text
+import requests
 from oauth_dropins.webutil import util
 from oauth_dropins.webutil.util import json_dumps, json_loads
 
@@ -42,10 +56,50 @@ HTML_ENTITY_RE = re.compile(r'&#?[a-zA-Z0-9]+;')
 
 # WebFinger-style @-@ identifier
 FEDIVERSE_HANDLE = re.compile('^@[^@ ]+@[a-z0-9-.]+$')
+# cheap check for whether HTML might have a link, before parsing it
+HTML_LINK_RE = re.compile(r'<a[\s>]', re.IGNORECASE)
+
+# number of distinct HTML strings to keep parsed by cached_parse_html, per
+# thread, and converted by html_to_text
+HTML_CACHE_SIZE = 256
+# HTML strings longer than this, in characters, aren't cached by
+# cached_parse_html, so that it doesn't keep big parse trees alive
+HTML_CACHE_MAX_LENGTH = 10 * 1024
 
 # maps lower case string short name to Source subclass. populated by SourceMeta.
 sources = {}
 
+# pooled, keep-alive HTTP sessions, shared across all Source instances. maps
+# str scheme://host to :class:`requests.Session`. None if disabled. see
+# enable_http_sessions().
+_http_sessions = None
+_http_sessions_lock = threading.Lock()
+_http_pool_size = None
+_http_timeout = None
+
+# content-addressed cache of serialized format conversions. None if disabled.
+# see enable_conversion_cache().
+_conversion_cache = None
+_conversion_cache_lock = threading.Lock()
+
+# on-disk cache of fetched media files. None if disabled. see
+# enable_media_cache().
+_media_cache = None
+MEDIA_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # bytes
+# how long to use a cached media file without revalidating it, in seconds
+MEDIA_CACHE_MAX_AGE = 60 * 60
+MEDIA_CACHE_CHUNK_SIZE = 1024 * 1024  # bytes
+
+# how long to back off after an HTTP 429 or 503 without a Retry-After or
+# X-RateLimit-Reset header, in seconds
+RATE_LIMIT_DEFAULT_BACKOFF = 60
+# maximum number of rate limit buckets to track. least recently used buckets
+# are dropped first.
+RATE_LIMIT_MAX_BUCKETS = 10000
+
+# alias allows unit tests to mock this function
+sleep_fn = time.sleep
+
 CreationResult = collections.namedtuple('CreationResult', [
   'content', 'description', 'abort', 'error_plain', 'error_html'])
 """Result of creating a new object in a silo.
@@ -79,9 +133,55 @@ class RateLimited(BaseException):
     super(RateLimited, self).__init__(*args, **kwargs)
 
 
+# cached_parse_html's per-thread LRU caches. cache attribute is an OrderedDict
+# that maps str HTML to BeautifulSoup, least recently used first.
+_parsed_html = threading.local()
+
+
+def cached_parse_html(html):
+  """Parses an HTML string with :func:`util.parse_html`, cached.
+
+  The same content is often parsed several times while converting or creating a
+  single object, eg by :meth:`Source.postprocess_object` and
+  :meth:`Source._content_for_create`. This parses each distinct string once and
+  shares the result.
+
+  Each thread has its own cache of up to :const:`HTML_CACHE_SIZE` parse trees,
+  so trees aren't shared across threads. Strings longer than
+  :const:`HTML_CACHE_MAX_LENGTH` are parsed fresh every time.
+
+  Args:
+    html (str)
+
+  Returns:
+    bs4.BeautifulSoup: shared, so don't modify it! Parse a fresh copy with
+    :func:`util.parse_html` instead.
+  """
+  if len(html or '') > HTML_CACHE_MAX_LENGTH:
+    return util.parse_html(html)
+
+  cache = getattr(_parsed_html, 'cache', None)
+  if cache is None:
+    cache = _parsed_html.cache = collections.OrderedDict()
+
+  soup = cache.get(html)
+  if soup is None:
+    soup = cache[html] = util.parse_html(html)
+    while len(cache) > HTML_CACHE_SIZE:
+      cache.popitem(last=False)
+  else:
+    cache.move_to_end(html)
+
+  return soup
+
+
 def html_to_text(html, baseurl='', **kwargs):
   """Converts HTML to plain text with html2text.
 
+  Results are cached by input and options, up to :const:`HTML_CACHE_SIZE` of
+  them. Strings longer than :const:`HTML_CACHE_MAX_LENGTH` are converted fresh
+  every time.
+
   Args:
     html (str): input HTML content
     baseurl (str): base URL to use when resolving relative URLs. Passed through
@@ -92,6 +192,14 @@ def html_to_text(html, baseurl='', **kwargs):
   Returns:
     str: converted plain text
   """
+  if len(html or '') > HTML_CACHE_MAX_LENGTH:
+    return _html_to_text.__wrapped__(html, baseurl=baseurl, **kwargs)
+  return _html_to_text(html, baseurl=baseurl, **kwargs)
+
+
+@functools.lru_cache(maxsize=HTML_CACHE_SIZE)
+def _html_to_text(html, baseurl='', **kwargs):
+  """Cached implementation of :func:`html_to_text`."""
   if not html:
     return ''
 
@@ -127,6 +235,827 @@ def load_json(body, url):
     raise urllib.error.HTTPError(url, 502, msg, {}, None)
 
 
+def run_concurrently(calls, threads=None):
+  """Runs zero-argument callables, optionally concurrently, in a thread pool.
+
+  Results are returned in the same order as ``calls``, regardless of which
+  finishes first. If any call raises an exception, the first one in order is
+  re-raised here.
+
+  Args:
+    calls (sequence of callable): functions to call with no arguments
+    threads (int): maximum number of calls to run at once. If ``None`` or
+      ``0``, runs them serially, in order, in the current thread.
+
+  Returns:
+    list: the calls' return values
+  """
+  calls = list(calls)
+  if not threads or len(calls) <= 1:
+    return [call() for call in calls]
+
+  with futures.ThreadPoolExecutor(max_workers=threads) as executor:
+    return list(executor.map(lambda call: call(), calls))
+
+
+def run_chunked(stream, size, fn, threads=None):
+  """Reads a file-like object in chunks and passes them to a function.
+
+  Reads up to ``threads`` chunks at a time and passes them to ``fn``
+  concurrently via :func:`run_concurrently`, so at most ``threads`` chunks are
+  held in memory at once. Always calls ``fn`` at least once, even if ``stream``
+  is empty.
+
+  Args:
+    stream: file-like object, eg an HTTP response
+    size (int): chunk size, in bytes
+    fn (callable): takes int chunk index and :class:`io.BytesIO` chunk
+    threads (int): maximum number of chunks to process at once. If ``None`` or
+      ``0``, processes them serially, one at a time.
+
+  Returns:
+    list: ``fn``'s return values, in chunk order
+  """
+  results = []
+  index = 0
+
+  while True:
+    calls = []
+    while len(calls) < (threads or 1):
+      data = stream.read(size)
+      if isinstance(data, str):
+        data = data.encode()
+      if data or index == 0:
+        calls.append(functools.partial(fn, index, io.BytesIO(data)))
+        index += 1
+      if len(data) < size:
+        break
+
+    results.extend(run_concurrently(calls, threads=threads))
+    if len(data) < size:
+      return results
+
+
+class _PooledSession(requests.Session):
+  """:class:`requests.Session` with an optional fixed timeout and no cookies.
+
+  Cookies are disabled since these sessions are shared across Source instances,
+  which may be authenticated as different users.
+  """
+  def __init__(self, pool_size, timeout=None):
+    super().__init__()
+    self.timeout = timeout
+    self.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=pool_size)
+    self.mount('http://', adapter)
+    self.mount('https://', adapter)
+
+  def request(self, *args, **kwargs):
+    if self.timeout is not None:
+      kwargs['timeout'] = self.timeout
+    return super().request(*args, **kwargs)
+
+
+def enable_http_sessions(pool_size=10, timeout=None):
+  """Enables pooled, keep-alive HTTP sessions for requests-based API calls.
+
+  Once enabled, Source subclasses that make HTTP requests with :mod:`requests`
+  share one :class:`requests.Session` per host, so connections and TLS
+  handshakes are reused across calls and across Source instances. Disabled by
+  default.
+
+  Can be called again to change the settings. Doing so discards any existing
+  sessions.
+
+  Args:
+    pool_size (int): maximum number of connections to keep open per host
+    timeout (float or tuple): optional HTTP timeout, in seconds, for all
+      requests made through these sessions. Overrides per-request timeouts.
+      Defaults to :const:`oauth_dropins.webutil.util.HTTP_TIMEOUT`.
+  """
+  global _http_sessions, _http_pool_size, _http_timeout
+  disable_http_sessions()
+  with _http_sessions_lock:
+    _http_sessions = {}
+    _http_pool_size = pool_size
+    _http_timeout = timeout
+
+
+def disable_http_sessions():
+  """Disables and closes the sessions from :func:`enable_http_sessions`."""
+  global _http_sessions
+  with _http_sessions_lock:
+    if _http_sessions:
+      for session in _http_sessions.values():
+        session.close()
+    _http_sessions = None
+
+
+def http_session(url):
+  """Returns the shared HTTP session for a URL's host.
+
+  Args:
+    url (str)
+
+  Returns:
+    requests.Session: or None if sessions aren't enabled. Pass this to
+    :func:`oauth_dropins.webutil.util.requests_get` etc as the ``session``
+    kwarg.
+  """
+  if _http_sessions is None:
+    return None
+
+  parsed = urllib.parse.urlparse(url)
+  key = f'{parsed.scheme}://{parsed.netloc}'
+  with _http_sessions_lock:
+    if _http_sessions is None:
+      return None
+    session = _http_sessions.get(key)
+    if not session:
+      session = _http_sessions[key] = _PooledSession(
+        _http_pool_size, timeout=_http_timeout)
+    return session
+
+
+class ConversionCache:
+  """In-memory LRU cache of serialized conversion outputs, bounded by size.
+
+  Values are str. The total length of all cached values is kept at or below
+  ``max_size``; least recently used values are evicted first.
+
+  Attributes:
+    max_size (int)
+    backend: optional shared second-level store, eg :class:`FileConversionCache`
+  """
+  def __init__(self, max_size, backend=None):
+    self.max_size = max_size
+    self.backend = backend
+    self.size = 0
+    self._values = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """Returns the cached value for a key, or None."""
+    with self._lock:
+      val = self._values.get(key)
+      if val is not None:
+        self._values.move_to_end(key)
+        return val
+
+    if self.backend:
+      val = self.backend.get(key)
+      if val is not None:
+        self._set(key, val)
+        return val
+
+  def set(self, key, val):
+    """Stores a str value here and in the backend, if any."""
+    self._set(key, val)
+    if self.backend:
+      self.backend.set(key, val)
+
+  def _set(self, key, val):
+    if len(val) > self.max_size:
+      return
+
+    with self._lock:
+      old = self._values.pop(key, None)
+      if old is not None:
+        self.size -= len(old)
+      self._values[key] = val
+      self.size += len(val)
+      while self.size > self.max_size:
+        _, evicted = self._values.popitem(last=False)
+        self.size -= len(evicted)
+
+
+class FileConversionCache:
+  """Stores serialized conversion outputs as files in a local directory.
+
+  Can be shared across processes. Nothing is ever evicted, and cached outputs
+  don't change when granary does, so clear the directory when upgrading.
+
+  Attributes:
+    dir (str): path to the directory. Created if it doesn't exist.
+  """
+  def __init__(self, dir):
+    self.dir = dir
+    os.makedirs(dir, exist_ok=True)
+
+  def _path(self, key):
+    return os.path.join(self.dir, key[:2], key)
+
+  def get(self, key):
+    """Returns the cached value for a key, or None."""
+    try:
+      with open(self._path(key), encoding='utf-8') as f:
+        return f.read()
+    except FileNotFoundError:
+      return None
+
+  def set(self, key, val):
+    """Stores a str value. Writes atomically."""
+    path = self._path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.dir,
+                                     delete=False) as f:
+      f.write(val)
+    os.replace(f.name, path)
+
+
+def enable_conversion_cache(max_size=20 * 1024 * 1024, backend=None):
+  """Enables caching the output of :func:`cached_conversion`.
+
+  Outputs are keyed by a hash of the input object, the converter, and its
+  kwargs, so identical objects in different feeds and requests are only
+  converted once. Disabled by default.
+
+  Can be called again to change the settings. Doing so discards the existing
+  in-memory cache.
+
+  Args:
+    max_size (int): maximum total length of serialized outputs to keep in
+      memory
+    backend: optional shared second-level store with ``get(key)`` and
+      ``set(key, val)`` methods, eg :class:`FileConversionCache`. Consulted on
+      in-memory misses.
+  """
+  global _conversion_cache
+  with _conversion_cache_lock:
+    _conversion_cache = ConversionCache(max_size, backend=backend)
+
+
+def disable_conversion_cache():
+  """Disables the cache from :func:`enable_conversion_cache`."""
+  global _conversion_cache
+  with _conversion_cache_lock:
+    _conversion_cache = None
+
+
+def cached_conversion(fn, obj, **kwargs):
+  """Converts an object, using the conversion cache if it's enabled.
+
+  ``fn`` must be a pure function of its arguments with a JSON-serializable
+  output, eg :func:`granary.as2.from_as1`. Don't use it for converters whose
+  output depends on the current time, eg :func:`granary.bluesky.from_as1`,
+  which turns a missing ``published`` into ``createdAt: now``. Their output
+  would be frozen at its first conversion.
+
+  On a cache hit, the returned value is freshly deserialized, so callers may
+  modify it.
+
+  Args:
+    fn (callable): converter, called as ``fn(obj, **kwargs)``
+    obj (dict): input object
+    kwargs: passed through to ``fn``
+
+  Returns:
+    the output of ``fn(obj, **kwargs)``
+  """
+  cache = _conversion_cache
+  if cache is None:
+    return fn(obj, **kwargs)
+
+  try:
+    input = json_dumps([f'{fn.__module__}.{fn.__qualname__}', obj, kwargs],
+                       sort_keys=True)
+  except (TypeError, ValueError, OverflowError):
+    # not JSON-serializable
+    return fn(obj, **kwargs)
+
+  key = hashlib.sha256(input.encode()).hexdigest()
+  cached = cache.get(key)
+  if cached is not None:
+    return json_loads(cached)
+
+  output = fn(obj, **kwargs)
+  try:
+    cache.set(key, json_dumps(output))
+  except (TypeError, ValueError, OverflowError):
+    logger.info(f"Couldn't serialize {fn.__qualname__} output, not caching")
+  return output
+
+
+class CachedMedia:
+  """A media file fetched via :class:`MediaCache`.
+
+  Readable like an HTTP response, eg :func:`urllib.request.urlopen`'s, so it can
+  be passed straight to silo upload APIs and :meth:`Twitter._check_media`.
+
+  Attributes:
+    url (str)
+    headers (dict): ``Content-Type`` and ``Content-Length``
+    content_type (str): MIME type, or None if unknown
+    length (int): size in bytes
+    sha256 (str): hex SHA-256 hash of the contents
+    width (int): image width in pixels, or None if unknown
+    height (int): image height in pixels, or None if unknown
+  """
+  def __init__(self, url, path, entry, delete=False):
+    self.url = url
+    self.content_type = entry.get('content_type')
+    self.length = entry['length']
+    self.sha256 = entry['sha256']
+    self.width = entry.get('width')
+    self.height = entry.get('height')
+    self.headers = {'Content-Length': str(self.length)}
+    if self.content_type:
+      self.headers['Content-Type'] = self.content_type
+
+    self._file = open(path, 'rb')
+    self._delete = path if delete else None
+
+  def read(self, size=-1):
+    return self._file.read(size)
+
+  def close(self):
+    self._file.close()
+    if self._delete:
+      os.remove(self._delete)
+      self._delete = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+class MediaCache:
+  """On-disk cache of fetched media files, bounded by total size.
+
+  Files are content addressed: stored once per SHA-256 hash of their contents,
+  so the same image at multiple URLs is only stored once. Each URL's entry
+  records that hash along with the file's MIME type, size, image dimensions,
+  and ``ETag``. Entries younger than ``max_age`` are used as is; older entries
+  are revalidated with ``If-None-Match`` if they have an ``ETag``, refetched
+  otherwise.
+
+  When the files' total size exceeds ``max_size``, the least recently used
+  ones are evicted. Files larger than ``max_size`` aren't cached at all.
+
+  Can be shared across threads and processes.
+
+  Attributes:
+    dir (str): path to the directory. Created if it doesn't exist.
+    max_size (int): maximum total size of cached files, in bytes
+    max_age (int): how long to use a cached file without revalidating it, in
+      seconds
+  """
+  def __init__(self, dir, max_size=MEDIA_CACHE_MAX_SIZE,
+               max_age=MEDIA_CACHE_MAX_AGE):
+    self.dir = dir
+    self.max_size = max_size
+    self.max_age = max_age
+    os.makedirs(os.path.join(dir, 'urls'), exist_ok=True)
+    os.makedirs(os.path.join(dir, 'files'), exist_ok=True)
+
+  def _entry_path(self, url):
+    key = hashlib.sha256(url.encode()).hexdigest()
+    return os.path.join(self.dir, 'urls', f'{key}.json')
+
+  def _file_path(self, sha256):
+    return os.path.join(self.dir, 'files', sha256)
+
+  def _open(self, url, entry):
+    """Returns a :class:`CachedMedia`, or None if its file was evicted."""
+    path = self._file_path(entry['sha256'])
+    try:
+      media = CachedMedia(url, path, entry)
+    except FileNotFoundError:
+      return None
+    os.utime(path)  # for LRU eviction
+    return media
+
+  def _write(self, path, data):
+    """Writes a str to a file atomically."""
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.dir,
+                                     delete=False) as f:
+      f.write(data)
+    os.replace(f.name, path)
+
+  def fetch(self, url):
+    """Fetches a media file, from the cache if possible.
+
+    Args:
+      url (str)
+
+    Returns:
+      CachedMedia: caller should close it when done
+
+    Raises:
+      :class:`requests.HTTPError`: if fetching the URL fails
+    """
+    entry_path = self._entry_path(url)
+    try:
+      with open(entry_path, encoding='utf-8') as f:
+        entry = json_loads(f.read())
+    except (FileNotFoundError, ValueError):
+      entry = None
+
+    now = util.now().timestamp()
+    if entry and now - entry['fetched'] < self.max_age:
+      media = self._open(url, entry)
+      if media:
+        return media
+
+    headers = {}
+    if entry and entry.get('etag'):
+      headers['If-None-Match'] = entry['etag']
+
+    with util.requests_get(url, stream=True, headers=headers,
+                           session=http_session(url)) as resp:
+      if resp.status_code == 304 and entry:
+        media = self._open(url, entry)
+        if media:
+          entry['fetched'] = now
+          self._write(entry_path, json_dumps(entry))
+          return media
+        # the file was evicted, so we need to fetch it again without If-None-Match
+        os.remove(entry_path)
+        return self.fetch(url)
+
+      resp.raise_for_status()
+
+      hash = hashlib.sha256()
+      length = 0
+      with tempfile.NamedTemporaryFile(dir=self.dir, delete=False) as f:
+        for chunk in resp.iter_content(MEDIA_CACHE_CHUNK_SIZE):
+          f.write(chunk)
+          hash.update(chunk)
+          length += len(chunk)
+
+      content_type = resp.headers.get('Content-Type')
+      etag = resp.headers.get('ETag')
+
+    if content_type:
+      content_type = content_type.split(';')[0].strip()
+    else:
+      content_type, _ = mimetypes.guess_type(url)
+
+    entry = {
+      'sha256': hash.hexdigest(),
+      'content_type': content_type,
+      'length': length,
+      'etag': etag,
+      'fetched': now,
+    }
+    with open(f.name, 'rb') as file:
+      dimensions = image_dimensions(file)
+    if dimensions:
+      entry['width'], entry['height'] = dimensions
+
+    if length > self.max_size:
+      logger.info(f'Not caching {url}, {length} bytes is over max_size')
+      return CachedMedia(url, f.name, entry, delete=True)
+
+    path = self._file_path(entry['sha256'])
+    os.replace(f.name, path)
+    self._write(entry_path, json_dumps(entry))
+    self._evict()
+    return CachedMedia(url, path, entry)
+
+  def _evict(self):
+    """Deletes least recently used files until they fit in ``max_size``.
+
+    Leaves URL entries in place; they're ignored once their file is gone.
+    """
+    files = []
+    for name in os.listdir(os.path.join(self.dir, 'files')):
+      path = self._file_path(name)
+      try:
+        stat = os.stat(path)
+      except FileNotFoundError:
+        continue  # evicted by another process
+      files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+      if total <= self.max_size:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size
+
+
+def image_dimensions(file):
+  """Reads the width and height of a PNG, GIF, or JPEG image.
+
+  Only reads the headers, not the whole image.
+
+  Args:
+    file: binary file-like object, seekable, positioned at the start
+
+  Returns:
+    (int width, int height) tuple, or None if the file isn't a recognized image
+  """
+  head = file.read(24)
+  if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+    return struct.unpack('>II', head[16:24])
+  elif head[:6] in (b'GIF87a', b'GIF89a'):
+    return struct.unpack('<HH', head[6:10])
+  elif not head.startswith(b'\xff\xd8'):
+    return None
+
+  # JPEG. look for a start of frame (SOFn) segment.
+  # https://en.wikipedia.org/wiki/JPEG#Syntax_and_structure
+  file.seek(2)
+  while True:
+    marker = file.read(4)
+    if len(marker) < 4 or marker[0] != 0xff:
+      return None
+    type = marker[1]
+    length = struct.unpack('>H', marker[2:])[0]
+    if 0xc0 <= type <= 0xcf and type not in (0xc4, 0xc8, 0xcc):
+      frame = file.read(5)
+      if len(frame) < 5:
+        return None
+      height, width = struct.unpack('>HH', frame[1:])
+      return width, height
+    file.seek(length - 2, os.SEEK_CUR)
+
+
+def enable_media_cache(dir, max_size=MEDIA_CACHE_MAX_SIZE,
+                       max_age=MEDIA_CACHE_MAX_AGE):
+  """Enables caching media files that silos fetch to upload in ``create``.
+
+  Cross-posting the same post to multiple silos then only downloads each image
+  or video once. Disabled by default.
+
+  Args:
+    dir (str): directory to store files in. May be shared across processes.
+    max_size (int): maximum total size of cached files, in bytes
+    max_age (int): how long to use a cached file without revalidating it, in
+      seconds
+  """
+  global _media_cache
+  _media_cache = MediaCache(dir, max_size=max_size, max_age=max_age)
+
+
+def disable_media_cache():
+  """Disables the cache from :func:`enable_media_cache`."""
+  global _media_cache
+  _media_cache = None
+
+
+def fetch_media(url):
+  """Fetches a media file via the media cache, if it's enabled.
+
+  Args:
+    url (str)
+
+  Returns:
+    CachedMedia: or None if the media cache isn't enabled
+  """
+  cache = _media_cache
+  if cache:
+    return cache.fetch(url)
+
+
+class RateLimiter:
+  """Tracks API rate limits in token buckets and holds calls that would exceed them.
+
+  Buckets are keyed by ``(silo, endpoint, credential)`` tuples, eg
+  ``('twitter', 'statuses/retweets', 'token')``. Budgets are learned from
+  ``X-RateLimit-Limit``, ``X-RateLimit-Remaining``, and ``X-RateLimit-Reset``
+  response headers (or ``X-Rate-Limit-*`` or ``RateLimit-*``), and from
+  ``Retry-After`` on HTTP 429 and 503 responses. They can also be set up front with :meth:`set_limit`.
+
+  A bucket learned from headers holds the remaining calls in the current
+  window and refills completely when the window resets. A bucket from
+  :meth:`set_limit` refills continuously.
+
+  Attributes:
+    max_wait (float): how long :meth:`acquire` may wait for a bucket to
+      refill, in seconds. If it would need to wait longer, it raises
+      :class:`RateLimited` instead. If None, calls are never held; buckets are
+      only tracked.
+    max_buckets (int): maximum number of buckets to keep. When there are more,
+      the least recently used ones are dropped, and their budgets are learned
+      again from the next response.
+  """
+  def __init__(self, max_wait=None, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+    self.max_wait = max_wait
+    self.max_buckets = max_buckets
+    # maps key tuple to dict with keys limit, tokens, reset (timestamp, or
+    # None), rate (tokens per second, or None), updated (timestamp). in LRU
+    # order, oldest first.
+    self._buckets = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def _now():
+    return util.now().timestamp()
+
+  def _get(self, key):
+    """Returns a bucket and marks it recently used, or None. Call with the lock."""
+    bucket = self._buckets.get(key)
+    if bucket:
+      self._buckets.move_to_end(key)
+    return bucket
+
+  def _put(self, key, bucket):
+    """Stores a bucket and evicts old ones if necessary. Call with the lock."""
+    self._buckets[key] = bucket
+    self._buckets.move_to_end(key)
+    while len(self._buckets) > self.max_buckets:
+      self._buckets.popitem(last=False)
+
+  def set_limit(self, key, limit, period):
+    """Sets a fixed budget for a bucket.
+
+    Args:
+      key (tuple): ``(silo, endpoint, credential)``
+      limit (int): number of calls allowed...
+      period (float): ...per this many seconds
+    """
+    with self._lock:
+      self._put(key, {
+        'limit': limit,
+        'tokens': limit,
+        'reset': None,
+        'rate': limit / period,
+        'updated': self._now(),
+      })
+
+  def _refill(self, bucket, now):
+    if bucket['rate']:
+      bucket['tokens'] = min(bucket['limit'], bucket['tokens'] +
+                             (now - bucket['updated']) * bucket['rate'])
+    elif bucket['reset'] is not None and now >= bucket['reset']:
+      bucket['tokens'] = bucket['limit']
+      bucket['reset'] = None
+    bucket['updated'] = now
+
+  def _wait(self, bucket):
+    """Returns how many seconds until a bucket has a token, or None if unknown."""
+    if bucket['tokens'] is None or bucket['tokens'] >= 1:
+      return 0
+    elif bucket['rate']:
+      return (1 - bucket['tokens']) / bucket['rate']
+    elif bucket['reset'] is not None:
+      return bucket['reset'] - bucket['updated']
+
+  def remaining(self, key):
+    """Returns the number of calls left in a bucket, or None if unknown."""
+    with self._lock:
+      bucket = self._get(key)
+      if bucket:
+        self._refill(bucket, self._now())
+        return bucket['tokens']
+
+  def acquire(self, key):
+    """Takes a token from a bucket, waiting for it to refill if necessary.
+
+    Args:
+      key (tuple): ``(silo, endpoint, credential)``
+
+    Raises:
+      RateLimited: if the bucket won't refill within ``max_wait``
+    """
+    while True:
+      with self._lock:
+        bucket = self._get(key)
+        if not bucket:
+          return
+        self._refill(bucket, self._now())
+        wait = self._wait(bucket)
+        if not wait or self.max_wait is None:
+          if wait:
+            logger.info(f'{key[0]} {key[1]} rate limit exhausted for {wait:.0f}s')
+          if bucket['tokens'] is not None:
+            bucket['tokens'] -= 1
+          return
+
+      if wait > self.max_wait:
+        raise RateLimited(f'{key[0]} {key[1]} is rate limited for {wait:.0f}s')
+      logger.info(f'Waiting {wait:.1f}s for {key[0]} {key[1]} rate limit')
+      sleep_fn(wait)
+
+  def update(self, key, headers, status=None):
+    """Updates a bucket from an API response's headers.
+
+    Args:
+      key (tuple): ``(silo, endpoint, credential)``
+      headers (dict-like): HTTP response headers
+      status (int): HTTP response status code
+    """
+    headers = {k.lower().replace('x-rate-limit-', 'x-ratelimit-'): v
+               for k, v in (headers or {}).items()}
+    for k, v in list(headers.items()):
+      if k.startswith('ratelimit-'):  # eg Bluesky
+        headers.setdefault(f'x-{k}', v)
+    now = self._now()
+
+    def parse_time(val):
+      """Returns a timestamp from a header value, or None."""
+      if not val:
+        return None
+      try:
+        val = float(val)
+        # epoch timestamp or number of seconds
+        return val if val > 1e9 else now + val
+      except ValueError:
+        try:
+          return dateutil.parser.parse(val).timestamp()
+        except (ValueError, OverflowError):
+          return None
+
+    try:
+      limit = int(headers['x-ratelimit-limit'])
+    except (KeyError, ValueError):
+      limit = None
+    try:
+      tokens = int(headers['x-ratelimit-remaining'])
+    except (KeyError, ValueError):
+      tokens = None
+    reset = parse_time(headers.get('x-ratelimit-reset'))
+
+    if status in (429, 503):
+      tokens = 0
+      reset = (parse_time(headers.get('retry-after')) or reset
+               or now + RATE_LIMIT_DEFAULT_BACKOFF)
+    elif tokens is None:
+      return
+
+    with self._lock:
+      bucket = self._get(key)
+      if not bucket:
+        bucket = {
+          'limit': limit,
+          'tokens': None,
+          'reset': None,
+          'rate': None,
+          'updated': now,
+        }
+        self._put(key, bucket)
+      if limit is not None:
+        bucket['limit'] = limit
+      elif bucket['limit'] is None:
+        bucket['limit'] = tokens
+      bucket.update({'tokens': tokens, 'reset': reset, 'rate': None,
+                     'updated': now})
+
+
+def configure_rate_limiter(max_wait=None, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+  """Replaces the shared :class:`RateLimiter` used by :func:`rate_limited_call`.
+
+  Rate limits are always tracked, but by default, calls are never held. Set
+  ``max_wait`` to make calls wait up to that many seconds for their budget to
+  refill, and raise :class:`RateLimited` if it won't refill in time, instead
+  of making calls that would get HTTP 429s.
+
+  Args:
+    max_wait (float): see :class:`RateLimiter`
+    max_buckets (int): see :class:`RateLimiter`
+  """
+  global _rate_limiter
+  _rate_limiter = RateLimiter(max_wait=max_wait, max_buckets=max_buckets)
+
+
+def rate_limited_call(key, fn):
+  """Makes an API call through the shared :class:`RateLimiter`.
+
+  Args:
+    key (tuple): ``(silo, endpoint, credential)``
+    fn (callable): takes no arguments, makes the HTTP request, and returns
+      a :mod:`requests` or :mod:`urllib` response. May also return something
+      else, eg decoded output, in which case the bucket is only updated from
+      HTTP errors.
+
+  Returns:
+    the return value of ``fn``
+
+  Raises:
+    RateLimited: if the call would exceed the rate limit, and the budget won't
+      refill within the limiter's ``max_wait``
+  """
+  limiter = _rate_limiter
+  limiter.acquire(key)
+  try:
+    resp = fn()
+  except urllib.error.HTTPError as e:
+    limiter.update(key, e.headers, status=e.code)
+    raise
+  except requests.HTTPError as e:
+    if e.response is not None:
+      limiter.update(key, e.response.headers, status=e.response.status_code)
+    raise
+
+  limiter.update(key, getattr(resp, 'headers', None),
+                 status=getattr(resp, 'status_code', None)
+                   or getattr(resp, 'status', None))
+  return resp
+
+
+# API rate limit token buckets, shared across all Source instances. see
+# configure_rate_limiter().
+_rate_limiter = RateLimiter()
+
+
 def creation_result(content=None, description=None, abort=False,
                     error_plain=None, error_html=None):
   """Creates a new :class:`CreationResult`."""
@@ -643,7 +1572,7 @@ class Source(object, metaclass=SourceMeta):
     return util.trim_nulls(activity)
 
   @staticmethod
-  def postprocess_object(obj):
+  def postprocess_object(obj, trim=True):
     """Does source-independent post-processing of an object, in place.
 
     * Populates ``location.position`` based on latitude and longitude.
@@ -652,9 +1581,10 @@ class Source(object, metaclass=SourceMeta):
 
     Args:
       obj (dict)
+      trim (bool): whether to remove empty values with :func:`util.trim_nulls`
 
     Returns:
-      dict: ``obj``, modified in place
+      dict: ``obj``, modified in place, or a trimmed copy if ``trim`` is True
     """
     loc = obj.get('location')
     if loc:
@@ -667,7 +1597,9 @@ class Source(object, metaclass=SourceMeta):
     # fediverse @-mentions to mention tags
     # https://github.com/snarfed/bridgy-fed/issues/493
     content = obj.get('content') or ''
-    for a in util.parse_html(content).find_all('a'):
+    links = (cached_parse_html(content).find_all('a')
+             if HTML_LINK_RE.search(content) else [])
+    for a in links:
       href = a.get('href')
       text = a.get_text('').strip()
       if href and FEDIVERSE_HANDLE.match(text):
@@ -677,7 +1609,7 @@ class Source(object, metaclass=SourceMeta):
           'displayName': text,
         })
 
-    return util.trim_nulls(obj)
+    return util.trim_nulls(obj) if trim else obj
 
   @classmethod
   def embed_post(cls, obj):
@@ -821,22 +1753,26 @@ class Source(object, metaclass=SourceMeta):
     #
     # The catch is that it adds a '<html><head></head><body>' header and
     # '</body></html>' footer. ah well. harmless.
-    soup = util.parse_html(content)
-    if strip_first_video_tag:
-      video = soup.video or soup.find(class_='u-video')
+    soup = None
+    if summary or strip_first_video_tag or strip_quotations:
+      soup = cached_parse_html(content)
+
+    video = (strip_first_video_tag and
+             (soup.video or soup.find(class_='u-video')))
+    quotations = strip_quotations and soup.find_all(class_='u-quotation-of')
+    if video or quotations:
+      # the cached soup is shared, so modify a fresh copy
+      soup = util.parse_html(content)
       if video:
+        video = soup.video or soup.find(class_='u-video')
         video.extract()
-        content = str(soup)
-
-    if strip_quotations:
-      quotations = soup.find_all(class_='u-quotation-of')
       if quotations:
-        for q in quotations:
+        for q in soup.find_all(class_='u-quotation-of'):
           q.extract()
-        content = str(soup)
+      content = str(soup)
 
     # compare to content with HTML tags stripped
-    if summary == soup.get_text('').strip():
+    if summary and summary == soup.get_text('').strip():
       # summary and content are the same; prefer content so that we can use its
       # HTML formatting.
       summary = None
@@ -845,7 +1781,8 @@ class Source(object, metaclass=SourceMeta):
     # the default html5lib since html.parser is stricter and expects actual
     # HTML tags.
     # https://www.crummy.com/software/BeautifulSoup/bs4/doc/#differences-between-parsers
-    is_html = (bool(BeautifulSoup(content, 'html.parser').find()) or
+    is_html = (('<' in content and
+                bool(BeautifulSoup(content, 'html.parser').find())) or
                HTML_ENTITY_RE.search(content))
     if is_html and not ignore_formatting:
       content = html_to_text(content, baseurl=(obj.get('url') or ''),
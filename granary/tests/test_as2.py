@@ -3,6 +3,8 @@
 Most of the tests are in testdata/. This is just a few things that are too small
 for full testdata tests.
 """
+import copy
+
 from oauth_dropins.webutil import testutil
 
 from .. import as2
@@ -240,3 +242,44 @@ class ActivityStreams2Test(testutil.TestCase):
       'id': 'tag:example.com,2011:martin',
       'url': 'https://example.com/',
     }))
+
+  def test_from_as1_doesnt_modify_input(self):
+    obj = {
+      'objectType': 'person',
+      'id': 'tag:example.com,2011:martin',
+      'url': 'https://example.com/',
+      'image': [{'url': 'http://pic'}, {'objectType': 'featured', 'url': 'http://banner'}],
+      'inReplyTo': [{'id': 'http://orig', 'author': {'id': 'http://ann'}}],
+      'tags': [{'objectType': 'mention', 'url': 'http://bob'}],
+      'to': [{'objectType': 'group', 'alias': '@public'}],
+    }
+    orig = copy.deepcopy(obj)
+    got = as2.from_as1(obj)
+    self.assertEqual(orig, obj)
+
+    got['inReplyTo']['attributedTo'][0]['name'] = 'changed'
+    got['tag'][0]['name'] = 'changed'
+    self.assertEqual(orig, obj)
+
+  def test_to_as1_doesnt_modify_input(self):
+    obj = {
+      '@context': as2.CONTEXT,
+      'type': 'Create',
+      'actor': {'type': 'Person', 'id': 'http://alice'},
+      'object': {
+        'type': 'Video',
+        'attributedTo': 'http://alice',
+        'author': {'displayName': 'Alice'},
+        'stream': {'size': 123},
+        'url': 'http://vid/v',
+        'image': [{'url': 'http://banner'}],
+      },
+    }
+    orig = copy.deepcopy(obj)
+    got = as2.to_as1(obj)
+    self.assertEqual(orig, obj)
+    self.assertEqual({'size': 123, 'url': 'http://vid/v'}, got['object']['stream'])
+
+    person = {'type': 'Person', 'image': [{'url': 'http://banner'}]}
+    as2.to_as1(person)
+    self.assertEqual({'type': 'Person', 'image': [{'url': 'http://banner'}]}, person)
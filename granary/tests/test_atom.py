@@ -1,11 +1,13 @@
 """Unit tests for atom.py."""
 import copy
+import io
 
 from mox3 import mox
 from oauth_dropins.webutil import testutil
 import requests
 
 from .. import atom
+from .. import microformats2
 from . import test_facebook
 from . import test_instagram
 from . import test_twitter
@@ -101,6 +103,10 @@ INSTAGRAM_ACTIVITY = {
 
 class AtomTest(testutil.TestCase):
 
+  def setUp(self):
+    super().setUp()
+    microformats2.disable_author_cache()
+
   def test_activities_to_atom(self):
     for test_module in test_facebook, test_instagram, test_twitter:
       with self.subTest(test_module):
@@ -259,6 +265,33 @@ class AtomTest(testutil.TestCase):
 </entry>
 """))
 
+  def test_iter_atom_activities(self):
+    expected = atom.atom_to_activities(INSTAGRAM_FEED)
+    data = INSTAGRAM_FEED.encode('utf-8')
+
+    self.assert_equals(expected, list(atom.iter_atom_activities(data)))
+    self.assert_equals(expected, list(atom.iter_atom_activities(INSTAGRAM_FEED)))
+    self.assert_equals(expected, list(atom.iter_atom_activities(
+      io.BytesIO(data), chunk_size=10)))
+    self.assert_equals(expected, list(atom.iter_atom_activities(
+      data[i:i + 7] for i in range(0, len(data), 7))))
+
+  def test_iter_atom_activities_lazy(self):
+    entry = '<entry><id>x</id><title>foo</title></entry>'
+    chunks = iter([
+      b"<feed xmlns='http://www.w3.org/2005/Atom'>",
+      entry.encode(),
+      entry.encode(),
+      b'</feed>',
+    ])
+    activities = atom.iter_atom_activities(chunks)
+    self.assertEqual('foo', next(activities)['object']['title'])
+    self.assertEqual([b'</feed>'], list(chunks)[1:])
+
+  def test_iter_atom_activities_not_feed(self):
+    with self.assertRaises(ValueError):
+      list(atom.iter_atom_activities(b"""<entry xmlns='http://www.w3.org/2005/Atom'><title>x</title></entry>"""))
+
   def test_title(self):
     self.assert_multiline_in(
       '\n<title>my title</title>',
@@ -931,6 +964,51 @@ going to Homebrew Website Club
     # https://console.cloud.google.com/errors/detail/CJjqo87j4IjM8AE;time=P30D?project=bridgy-federated
     str(atom.Defaulter(atom.Defaulter({'x': 'y'})))
 
+  def test_defaulter_view(self):
+    empty = atom.DefaulterView()
+    orig = {
+        'a': 'x',
+        'c': None,
+        'd': {},
+        'f': {'1': 2, '3': {'4': 5}},
+        'g': {'1': '2', '3': ['5', 6, {'7': [{'8': 9}]}]},
+        'h': {'i': 'j'},
+    }
+    snapshot = copy.deepcopy(orig)
+    d = atom.DefaulterView(orig)
+
+    self.assertEqual('x', d['a'])
+    self.assertIsNone(d['c'])
+    self.assertEqual(empty, d['z'])
+    self.assertEqual('', str(d['z']))
+    self.assertEqual(empty, d['d']['z'])
+    self.assertEqual(5, d['f']['3']['4'])
+    self.assertEqual(empty, d['g']['3'][2]['9'])
+    self.assertEqual(empty, d['g']['3'][2]['7'][0]['9'])
+    self.assertEqual(empty, d.get('f').get('3')['9'])
+    self.assertEqual(orig, d)
+
+    # wrapped lazily, and memoized
+    self.assertIs(d['f'], d['f'])
+    self.assertIsInstance(dict.__getitem__(d, 'g'), atom.DefaulterView)
+    self.assertNotIsInstance(dict.__getitem__(d, 'h'), atom.DefaulterView)
+
+    with self.assertRaises(TypeError):
+      d['a'] = 'y'
+
+    self.assertEqual(snapshot, orig)
+    self.assertNotIsInstance(orig['f'], atom.DefaulterView)
+
+  def test_activities_to_atom_stream(self):
+    activities = [copy.deepcopy(test_facebook.ACTIVITY) for _ in range(3)]
+    expected = atom.activities_to_atom(copy.deepcopy(activities),
+                                       test_facebook.ACTOR, title='my title')
+
+    got = atom.activities_to_atom(activities, test_facebook.ACTOR,
+                                  title='my title', stream=True)
+    self.assertNotIsInstance(got, str)
+    self.assert_equals(expected, ''.join(got))
+
   def test_multiple_objects_uses_first(self):
     activity = {
       'objectType': 'activity',
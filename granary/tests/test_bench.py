@@ -0,0 +1,103 @@
+"""Unit tests for bench.py."""
+import os
+import tempfile
+
+from oauth_dropins.webutil import testutil
+from oauth_dropins.webutil.util import json_dumps, json_loads
+
+from .. import bench
+
+
+class BenchTest(testutil.TestCase):
+
+  def test_run(self):
+    results = bench.run(sizes=[3], only='atom')
+    self.assertEqual(['3 atom.activities_to_atom', '3 atom.atom_to_activities'],
+                     list(results.keys()))
+    for result in results.values():
+      self.assertEqual(1, result['calls'])
+      self.assertEqual(0, result['errors'])
+      self.assertGreater(result['items_per_sec'], 0)
+      self.assertEqual(result['p50_ms'], result['p99_ms'])
+      self.assertGreater(result['peak_mem_kb'], 0)
+
+  def test_run_corpus_skips_unsupported_fixtures(self):
+    results = bench.run(sizes=[], depths=[], only='corpus bluesky.from_as1')
+    self.assertEqual(['corpus bluesky.from_as1'], list(results.keys()))
+    result = results['corpus bluesky.from_as1']
+    self.assertGreater(result['calls'], 0)
+    self.assertEqual(0, result['errors'])
+
+  def test_supported_fixtures(self):
+    def fn(obj):
+      if obj.get('bad'):
+        raise ValueError()
+    self.assertEqual([{'a': 1}, {'c': 3}], bench.supported_fixtures(
+      fn, [{'a': 1}, {'bad': True}, {'c': 3}]))
+
+  def test_scaled_activities(self):
+    activities = bench.scaled_activities(200)
+    self.assertEqual(200, len(activities))
+    self.assertEqual(200, len(set(a['id'] for a in activities)))
+    for a in activities:
+      self.assertEqual('activity', a['objectType'])
+
+  def test_nested_object(self):
+    obj = bench.nested_object(3)
+    self.assertEqual('tag:bench.example,2023:2', obj['id'])
+    self.assertEqual('tag:bench.example,2023:1', obj['inReplyTo'][0]['id'])
+    self.assertEqual('tag:bench.example,2023:0',
+                     obj['inReplyTo'][0]['inReplyTo'][0]['id'])
+
+  def test_run_depths(self):
+    results = bench.run(sizes=[], depths=[5], only='depth')
+    self.assertIn('depth 5 as2.from_as1', results)
+    self.assertIn('depth 5 as2.to_as1', results)
+    for result in results.values():
+      self.assertEqual(0, result['errors'])
+
+  def test_peak_mem_kb_per_converter(self):
+    big = bench.peak_mem_kb(lambda _: bytearray(10 * 1024 * 1024), [None])
+    self.assertGreater(big, 10 * 1024)
+    # doesn't include earlier calls' peaks
+    self.assertLess(bench.peak_mem_kb(lambda _: bytearray(1024), [None]), 100)
+
+  def test_compare_peak_mem(self):
+    results = {
+      'a': {'items_per_sec': 100, 'peak_mem_kb': 110},
+      'b': {'items_per_sec': 100, 'peak_mem_kb': 121},
+    }
+    baseline = {
+      'a': {'items_per_sec': 100, 'peak_mem_kb': 100},
+      'b': {'items_per_sec': 100, 'peak_mem_kb': 100},
+    }
+    self.assertEqual(['b'], bench.compare(results, baseline, threshold=.2))
+
+  def test_compare(self):
+    results = {
+      'a': {'items_per_sec': 100},
+      'b': {'items_per_sec': 79},
+      'c': {'items_per_sec': 50},
+    }
+    baseline = {
+      'a': {'items_per_sec': 110},
+      'b': {'items_per_sec': 100},
+    }
+    self.assertEqual(['b'], bench.compare(results, baseline, threshold=.2))
+    self.assertEqual(110, results['a']['baseline_items_per_sec'])
+    self.assertNotIn('baseline_items_per_sec', results['c'])
+
+  def test_main_save_and_baseline(self):
+    with tempfile.TemporaryDirectory() as dir:
+      saved = os.path.join(dir, 'saved.json')
+      self.assertEqual(0, bench.main(['--sizes', '2', '--only', 'rss',
+                                      '--save', saved]))
+      with open(saved) as f:
+        results = json_loads(f.read())
+      self.assertIn('2 rss.to_activities', results)
+
+      baseline = os.path.join(dir, 'baseline.json')
+      with open(baseline, 'w') as f:
+        f.write(json_dumps({'2 rss.to_activities': {'items_per_sec': 1e12}}))
+      self.assertEqual(1, bench.main(['--sizes', '2', '--only', 'rss',
+                                      '--baseline', baseline]))
@@ -3,8 +3,14 @@
 Most tests are via files in testdata/.
 """
 import copy
+from datetime import timedelta
+import io
+import os
+import tempfile
 from unittest.mock import patch
 
+import dag_cbor
+from multiformats import CID, multihash, varint
 from oauth_dropins.webutil import testutil, util
 from oauth_dropins.webutil.testutil import NOW, requests_response
 from oauth_dropins.webutil.util import trim_nulls
@@ -15,12 +21,21 @@ from ..bluesky import (
   at_uri_to_web_url,
   blob_to_url,
   Bluesky,
+  configure_identity_cache,
+  did_to_pds,
+  IdentityCache,
+  MAX_SINCE_PAGES,
+  repo_to_activities,
+  resolve_did,
+  resolve_handle,
+  SqliteIdentityCache,
   did_web_to_url,
   from_as1,
   to_as1,
   url_to_did_web,
   web_url_to_at_uri,
 )
+from .. import source
 from ..source import ALL, FRIENDS, ME, SELF
 
 ACTOR_AS = {
@@ -386,9 +401,52 @@ POST_AUTHOR_PROFILE_WITH_REPOSTS_AS['object']['tags'][0]['author'].update({
   'url': ['https://alice.com/', 'https://bsky.app/profile/alice.com'],
 })
 
+def make_car(records, did='did:plc:foo'):
+  """Builds a repo CAR file with the given records.
+
+  Args:
+    records (dict): maps str key, eg ``app.bsky.feed.post/123``, to record.
+      The first record goes in the MST root's left subtree, the rest in the root.
+
+  Returns:
+    bytes
+  """
+  blocks = []
+
+  def block(val):
+    data = dag_cbor.encode(val)
+    cid = CID('base32', 1, 'dag-cbor', multihash.digest(data, 'sha2-256'))
+    blocks.append((cid, data))
+    return cid
+
+  def node(items, left=None):
+    entries = []
+    prev = b''
+    for key, record in items:
+      key = key.encode()
+      prefix = len(os.path.commonprefix([prev, key]))
+      entries.append({'p': prefix, 'k': key[prefix:], 'v': block(record),
+                      't': None})
+      prev = key
+    return block({'l': left, 'e': entries})
+
+  items = list(records.items())
+  data = node(items[1:], left=node(items[:1]))
+  commit = block({'did': did, 'version': 3, 'data': data, 'rev': 'x',
+                  'prev': None, 'sig': b'sig'})
+
+  header = dag_cbor.encode({'version': 1, 'roots': [commit]})
+  car = varint.encode(len(header)) + header
+  # blocks can be in any order
+  for cid, data in reversed(blocks):
+    car += varint.encode(len(bytes(cid)) + len(data)) + bytes(cid) + data
+  return car
+
+
 class BlueskyTest(testutil.TestCase):
 
   def setUp(self):
+    configure_identity_cache()
     self.bs = Bluesky('handull', access_token='towkin')
     util.now = lambda **kwargs: testutil.NOW
 
@@ -982,6 +1040,89 @@ class BlueskyTest(testutil.TestCase):
     self.assertEqual(OLD_BLOB_URL, blob_to_url(blob=OLD_BLOB,
                                                repo_did='did:plc:foo'))
 
+  def test_repo_to_activities(self):
+    blob_cid = CID('base32', 1, 'raw', multihash.digest(b'img', 'sha2-256'))
+    car = make_car({
+      'app.bsky.actor.profile/self': {
+        '$type': 'app.bsky.actor.profile',
+        'displayName': 'Alice',
+        'avatar': {
+          '$type': 'blob',
+          'ref': blob_cid,
+          'mimeType': 'image/jpeg',
+          'size': 3,
+        },
+      },
+      'app.bsky.feed.like/123': {
+        '$type': 'app.bsky.feed.like',
+        'subject': {'uri': 'at://did:plc:bob/app.bsky.feed.post/456', 'cid': 'x'},
+        'createdAt': '2022-01-02T03:04:05.000Z',
+      },
+      'app.bsky.feed.post/789': {
+        '$type': 'app.bsky.feed.post',
+        'text': 'My original post',
+        'createdAt': '2007-07-07T03:04:05.000Z',
+      },
+      'app.bsky.graph.follow/abc': {
+        '$type': 'app.bsky.graph.follow',
+        'subject': 'did:plc:bob',
+        'createdAt': '2022-01-02T03:04:05.000Z',
+      },
+    })
+
+    expected = [{
+      'objectType': 'person',
+      'id': 'did:plc:foo',
+      'displayName': 'Alice',
+      'username': 'alice.com',
+      'url': ['https://alice.com/', 'https://bsky.app/profile/alice.com'],
+      'image': [{
+        'url': f'https://bsky.social/xrpc/com.atproto.sync.getBlob?did=did:plc:foo&cid={blob_cid.encode("base32")}',
+      }],
+    }, {
+      'objectType': 'activity',
+      'verb': 'like',
+      'id': 'at://did:plc:foo/app.bsky.feed.like/123',
+      'url': 'https://bsky.app/profile/did:plc:bob/post/456#liked_by_did:plc:foo',
+      'object': 'at://did:plc:bob/app.bsky.feed.post/456',
+      'actor': 'did:plc:foo',
+    }, {
+      'objectType': 'note',
+      'id': 'at://did:plc:foo/app.bsky.feed.post/789',
+      'url': 'https://bsky.app/profile/did:plc:foo/post/789',
+      'content': 'My original post',
+      'published': '2007-07-07T03:04:05.000Z',
+      'author': 'did:plc:foo',
+    }]
+
+    self.assert_equals(expected, list(repo_to_activities(
+      car, repo_handle='alice.com')))
+
+    # file object that can't be memory-mapped
+    self.assert_equals(expected, list(repo_to_activities(
+      io.BytesIO(car), repo_handle='alice.com')))
+
+    # path
+    with tempfile.NamedTemporaryFile(suffix='.car', delete=False) as f:
+      f.write(car)
+    try:
+      self.assert_equals(expected, list(repo_to_activities(
+        f.name, repo_handle='alice.com')))
+      with open(f.name, 'rb') as file:
+        self.assert_equals(expected, list(repo_to_activities(
+          file, repo_handle='alice.com')))
+    finally:
+      os.unlink(f.name)
+
+  def test_repo_to_activities_invalid(self):
+    for bad in b'', b'\x05abcde', io.BytesIO(b''):
+      with self.assertRaises(ValueError):
+        list(repo_to_activities(bad))
+
+    header = dag_cbor.encode({'version': 1, 'roots': []})
+    with self.assertRaises(ValueError):
+      list(repo_to_activities(varint.encode(len(header)) + header))
+
   def test_constructor_access_token(self):
     bs = Bluesky('handull', access_token='towkin')
     self.assertEqual({
@@ -1014,6 +1155,239 @@ class BlueskyTest(testutil.TestCase):
         },
     )
 
+  @patch('requests.post')
+  def test_app_password_session_cached(self, mock_post):
+    session = {
+      'handle': 'real.han.dull',
+      'did': 'did:plc:me',
+      'accessJwt': 'towkin',
+      'refreshJwt': 'reephrush',
+    }
+    mock_post.return_value = requests_response(session)
+
+    with tempfile.TemporaryDirectory() as dir:
+      path = os.path.join(dir, 'cache.db')
+      configure_identity_cache(backend=SqliteIdentityCache(path))
+      Bluesky('handull', app_password='pazzwurd').client
+      self.assertEqual(1, mock_post.call_count)
+
+      # new in-memory cache, eg a new process, shares the SQLite backend
+      configure_identity_cache(backend=SqliteIdentityCache(path))
+      bs = Bluesky('handull', app_password='pazzwurd')
+      self.assertEqual(session, bs.client.session)
+      self.assertEqual('real.han.dull', bs.handle)
+      self.assertEqual('did:plc:me', bs.did)
+      self.assertEqual(1, mock_post.call_count)
+
+      # different password logs in again
+      Bluesky('handull', app_password='other').client
+      self.assertEqual(2, mock_post.call_count)
+
+  @patch('requests.post')
+  @patch('requests.get')
+  def test_app_password_dead_session_logs_in_again(self, mock_get, mock_post):
+    dead = {
+      'handle': 'real.han.dull',
+      'did': 'did:plc:me',
+      'accessJwt': 'old',
+      'refreshJwt': 'rotated',
+    }
+    session = {**dead, 'accessJwt': 'new', 'refreshJwt': 'fresh'}
+    Bluesky('handull', app_password='pazzwurd')._client.session_callback(dead)
+
+    mock_get.side_effect = [
+      requests_response({'error': 'ExpiredToken'}, status=400),
+      requests_response({'feed': []}),
+    ]
+    mock_post.side_effect = [
+      # refreshSession
+      requests_response({'error': 'ExpiredToken'}, status=400),
+      # createSession
+      requests_response(session),
+    ]
+
+    bs = Bluesky('handull', app_password='pazzwurd')
+    self.assertEqual([], bs.get_activities())
+    self.assertEqual(session, bs.client.session)
+    self.assertEqual([
+      'https://bsky.social/xrpc/com.atproto.server.refreshSession',
+      'https://bsky.social/xrpc/com.atproto.server.createSession',
+    ], [call.args[0] for call in mock_post.call_args_list])
+
+    # the new session replaced the dead one in the cache
+    self.assertEqual(session,
+                     Bluesky('handull', app_password='pazzwurd').client.session)
+
+  @patch('requests.post')
+  @patch('requests.get')
+  def test_app_password_dead_session_uses_shared_session(self, mock_get,
+                                                         mock_post):
+    dead = {
+      'handle': 'real.han.dull',
+      'did': 'did:plc:me',
+      'accessJwt': 'old',
+      'refreshJwt': 'rotated',
+    }
+    session = {**dead, 'accessJwt': 'new', 'refreshJwt': 'fresh'}
+
+    mock_get.side_effect = [
+      requests_response({'error': 'ExpiredToken'}, status=400),
+      requests_response({'feed': []}),
+    ]
+    mock_post.return_value = requests_response({'error': 'InvalidToken'},
+                                               status=400)
+
+    with tempfile.TemporaryDirectory() as dir:
+      path = os.path.join(dir, 'cache.db')
+      configure_identity_cache(backend=SqliteIdentityCache(path))
+      bs = Bluesky('handull', app_password='pazzwurd')
+      bs._client.session_callback(dead)
+
+      # another process refreshes the session
+      other = IdentityCache(backend=SqliteIdentityCache(path))
+      other.set(bs._session_key, session)
+
+      self.assertEqual([], bs.get_activities())
+      self.assertEqual(session, bs.client.session)
+
+    # refreshSession failed, but we didn't need createSession
+    mock_post.assert_called_once()
+    self.assertEqual('https://bsky.social/xrpc/com.atproto.server.refreshSession',
+                     mock_post.call_args.args[0])
+    self.assertEqual('Bearer new',
+                     mock_get.call_args.kwargs['headers']['Authorization'])
+
+  @patch('requests.get')
+  def test_access_token_dead_session_raises(self, mock_get):
+    bs = Bluesky('handull', access_token='towkin', refresh_token='reephrush')
+    with patch('requests.post') as mock_post:
+      mock_get.return_value = requests_response({'error': 'ExpiredToken'},
+                                                status=400)
+      mock_post.return_value = requests_response({'error': 'ExpiredToken'},
+                                                 status=400)
+      with self.assertRaises(requests.HTTPError):
+        bs.get_activities()
+
+  @patch('requests.post')
+  @patch('requests.get')
+  def test_app_password_logs_in_to_pds(self, mock_get, mock_post):
+    mock_get.side_effect = [
+      requests_response('did:plc:alice'),
+      requests_response({
+        'id': 'did:plc:alice',
+        'service': [{
+          'id': '#atproto_pds',
+          'type': 'AtprotoPersonalDataServer',
+          'serviceEndpoint': 'https://pds.example',
+        }],
+      }),
+    ]
+    mock_post.return_value = requests_response({
+      'handle': 'alice.com',
+      'did': 'did:plc:alice',
+      'accessJwt': 'towkin',
+      'refreshJwt': 'reephrush',
+    })
+
+    bs = Bluesky('alice.com', app_password='pazzwurd')
+    bs.client  # trigger login
+    self.assertEqual('did:plc:alice', bs.did)
+    self.assertEqual([
+      'https://alice.com/.well-known/atproto-did',
+      'https://plc.directory/did:plc:alice',
+    ], [call.args[0] for call in mock_get.call_args_list])
+    self.assertEqual('https://pds.example/xrpc/com.atproto.server.createSession',
+                     mock_post.call_args.args[0])
+
+  def test_identity_cache_memory_ttl(self):
+    with tempfile.TemporaryDirectory() as dir:
+      path = os.path.join(dir, 'cache.db')
+      cache = IdentityCache(backend=SqliteIdentityCache(path), memory_ttl=60)
+      cache.set('x', 'old')
+
+      IdentityCache(backend=SqliteIdentityCache(path)).set('x', 'new')
+      self.assertEqual('old', cache.get('x'))
+
+      # the in-memory copy expires before the value itself
+      util.now = lambda **kwargs: testutil.NOW + timedelta(minutes=2)
+      self.assertEqual('new', cache.get('x'))
+
+  @patch('requests.get')
+  def test_resolve_handle(self, mock_get):
+    mock_get.return_value = requests_response('did:plc:foo\n')
+    self.assertEqual('did:plc:foo', resolve_handle('@Alice.com'))
+    self.assertEqual('did:plc:foo', resolve_handle('alice.com'))
+    mock_get.assert_called_once()
+    self.assertEqual('https://alice.com/.well-known/atproto-did',
+                     mock_get.call_args.args[0])
+
+    with self.assertRaises(ValueError):
+      resolve_handle('not a handle')
+
+  @patch('requests.get')
+  def test_resolve_handle_xrpc_fallback(self, mock_get):
+    mock_get.side_effect = [
+      requests.ConnectionError('nope'),
+      requests_response({'did': 'did:plc:bar'}),
+    ]
+    self.assertEqual('did:plc:bar', resolve_handle('bob.bsky.social'))
+    self.assertEqual([
+      'https://bob.bsky.social/.well-known/atproto-did',
+      'https://bsky.social/xrpc/com.atproto.identity.resolveHandle?handle=bob.bsky.social',
+    ], [call.args[0] for call in mock_get.call_args_list])
+
+  @patch('requests.get')
+  def test_resolve_handle_negative_cache(self, mock_get):
+    mock_get.side_effect = [
+      requests_response('', status=404),
+      requests_response({'error': 'InvalidRequest'}, status=400),
+      requests_response('did:plc:foo'),
+    ]
+    self.assertIsNone(resolve_handle('alice.com'))
+    self.assertIsNone(resolve_handle('alice.com'))
+    self.assertEqual(2, mock_get.call_count)
+
+    # negative result expires
+    util.now = lambda **kwargs: testutil.NOW + timedelta(minutes=6)
+    self.assertEqual('did:plc:foo', resolve_handle('alice.com'))
+
+  @patch('requests.get')
+  def test_resolve_handle_server_error_not_cached(self, mock_get):
+    mock_get.side_effect = [
+      requests_response('', status=404),
+      requests_response('', status=503),
+      requests_response('did:plc:foo'),
+    ]
+    with self.assertRaises(requests.HTTPError):
+      resolve_handle('alice.com')
+    self.assertEqual('did:plc:foo', resolve_handle('alice.com'))
+
+  @patch('requests.get')
+  def test_resolve_did_and_did_to_pds(self, mock_get):
+    doc = {
+      'id': 'did:plc:foo',
+      'service': [{
+        'id': '#atproto_pds',
+        'type': 'AtprotoPersonalDataServer',
+        'serviceEndpoint': 'https://pds.example',
+      }],
+    }
+    mock_get.side_effect = [
+      requests_response(doc),
+      requests_response('', status=404),
+    ]
+    self.assertEqual(doc, resolve_did('did:plc:foo'))
+    self.assertEqual('https://pds.example', did_to_pds('did:plc:foo'))
+    self.assertIsNone(did_to_pds('did:web:alice.com'))
+    self.assertIsNone(resolve_did('did:web:alice.com'))
+    self.assertEqual([
+      'https://plc.directory/did:plc:foo',
+      'https://alice.com/.well-known/did.json',
+    ], [call.args[0] for call in mock_get.call_args_list])
+
+    with self.assertRaises(ValueError):
+      resolve_did('did:foo:bar')
+
   @patch('requests.get')
   def test_get_activities_friends(self, mock_get):
     mock_get.return_value = requests_response({
@@ -1028,6 +1402,100 @@ class BlueskyTest(testutil.TestCase):
 
     self.assert_call(mock_get, 'https://bsky.social/xrpc/app.bsky.feed.getTimeline')
 
+  @patch('requests.get')
+  def test_get_activities_cursor(self, mock_get):
+    mock_get.return_value = requests_response({
+      'cursor': 'next::page',
+      'feed': [POST_FEED_VIEW_BSKY],
+    })
+
+    resp = self.bs.get_activities_response(group_id=SELF, user_id='alice.com',
+                                           count=5, cursor='this::page')
+    self.assert_equals([POST_AUTHOR_PROFILE_AS], resp['items'])
+    self.assertEqual('next::page', resp['cursor'])
+    self.assert_call(mock_get,
+        'https://bsky.social/xrpc/app.bsky.feed.getAuthorFeed?limit=5&cursor=this%3A%3Apage&actor=alice.com')
+
+  @patch('requests.get')
+  def test_get_activities_min_id(self, mock_get):
+    def post(uri):
+      view = copy.deepcopy(POST_FEED_VIEW_BSKY)
+      view['post']['uri'] = uri
+      return view
+
+    # a repost of the min_id post shouldn't stop us
+    repost = copy.deepcopy(REPOST_BSKY_FEED_VIEW_POST)
+    repost['post'] = post('at://did/app.bsky.feed.post/seen')['post']
+
+    mock_get.side_effect = [
+      requests_response({
+        'cursor': 'page::2',
+        'feed': [post('at://did/app.bsky.feed.post/new1'), repost],
+      }),
+      requests_response({
+        'cursor': 'page::3',
+        'feed': [post('at://did/app.bsky.feed.post/new2'),
+                 post('at://did/app.bsky.feed.post/seen'),
+                 post('at://did/app.bsky.feed.post/old')],
+      }),
+    ]
+
+    resp = self.bs.get_activities_response(
+      min_id='at://did/app.bsky.feed.post/seen')
+    self.assertEqual([
+      'at://did/app.bsky.feed.post/new1',
+      'at://did/app.bsky.feed.post/seen',
+      'at://did/app.bsky.feed.post/new2',
+    ], [a['object']['id'] for a in resp['items']])
+    self.assertNotIn('cursor', resp)
+    self.assert_call(mock_get,
+        'https://bsky.social/xrpc/app.bsky.feed.getTimeline?cursor=page%3A%3A2')
+
+  @patch('requests.get')
+  def test_get_activities_min_id_with_count(self, mock_get):
+    def post(uri):
+      view = copy.deepcopy(POST_FEED_VIEW_BSKY)
+      view['post']['uri'] = uri
+      return view
+
+    mock_get.side_effect = [
+      requests_response({
+        'cursor': 'page::2',
+        'feed': [post('at://did/app.bsky.feed.post/new1'),
+                 post('at://did/app.bsky.feed.post/new2')],
+      }),
+      requests_response({
+        'cursor': 'page::3',
+        'feed': [post('at://did/app.bsky.feed.post/new3'),
+                 post('at://did/app.bsky.feed.post/seen')],
+      }),
+    ]
+
+    # count is the page size; we should keep paging until we reach min_id
+    resp = self.bs.get_activities_response(
+      count=2, min_id='at://did/app.bsky.feed.post/seen')
+    self.assertEqual([
+      'at://did/app.bsky.feed.post/new1',
+      'at://did/app.bsky.feed.post/new2',
+      'at://did/app.bsky.feed.post/new3',
+    ], [a['object']['id'] for a in resp['items']])
+    self.assertNotIn('cursor', resp)
+    self.assertEqual(2, mock_get.call_count)
+    self.assert_call(mock_get,
+        'https://bsky.social/xrpc/app.bsky.feed.getTimeline?limit=2&cursor=page%3A%3A2')
+
+  @patch('requests.get')
+  def test_get_activities_min_id_not_found(self, mock_get):
+    mock_get.return_value = requests_response({
+      'cursor': 'more',
+      'feed': [POST_FEED_VIEW_BSKY],
+    })
+
+    resp = self.bs.get_activities_response(min_id='at://did/app.bsky.feed.post/x')
+    self.assertEqual(MAX_SINCE_PAGES, mock_get.call_count)
+    self.assertEqual(MAX_SINCE_PAGES, len(resp['items']))
+    self.assertEqual('more', resp['cursor'])
+
   @patch('requests.get')
   def test_get_activities_activity_id(self, mock_get):
     mock_get.return_value = requests_response({
@@ -1146,6 +1614,94 @@ class BlueskyTest(testutil.TestCase):
         'https://bsky.social/xrpc/app.bsky.feed.getPostThread?uri=at%3A%2F%2Fdid%2Fapp.bsky.feed.post%2Ftid')
     self.assert_equals(1, cache.get('ABR at://did/app.bsky.feed.post/tid'))
 
+  @patch('requests.get')
+  def test_get_activities_extras_threads(self, mock_get):
+    post = copy.deepcopy(POST_FEED_VIEW_BSKY)
+    post['post'].update({'likeCount': 1, 'repostCount': 2, 'replyCount': 3})
+
+    def get(url, **kwargs):
+      method = url.split('/xrpc/')[1].split('?')[0]
+      return requests_response({
+        'app.bsky.feed.getTimeline': {'feed': [post]},
+        'app.bsky.feed.getLikes': {'likes': [GET_LIKES_LIKE_BSKY]},
+        'app.bsky.feed.getRepostedBy': {'repostedBy': [ACTOR_PROFILE_VIEW_BSKY]},
+        'app.bsky.feed.getPostThread': {'thread': THREAD_BSKY},
+      }[method])
+    mock_get.side_effect = get
+
+    bs = Bluesky('handull', access_token='towkin', threads=3)
+    cache = {}
+    got = bs.get_activities(fetch_likes=True, fetch_shares=True,
+                            fetch_replies=True, cache=cache)
+    self.assertEqual(1, len(got))
+    self.assert_equals(
+      POST_AUTHOR_PROFILE_WITH_LIKES_AS['object']['tags'] +
+        POST_AUTHOR_PROFILE_WITH_REPOSTS_AS['object']['tags'],
+      got[0]['object']['tags'])
+    self.assert_equals(THREAD_AS['object']['replies'], got[0]['object']['replies'])
+    self.assertEqual(4, mock_get.call_count)
+
+    id = 'at://did/app.bsky.feed.post/tid'
+    self.assertEqual({f'ABL {id}': 1, f'ABRP {id}': 2, f'ABR {id}': 3}, cache)
+
+  @patch('requests.get')
+  def test_get_activities_extras_max_requests(self, mock_get):
+    post = copy.deepcopy(POST_FEED_VIEW_BSKY)
+    post['post'].update({'likeCount': 1, 'replyCount': 1})
+    mock_get.side_effect = [
+      requests_response({'feed': [post]}),
+      requests_response({'likes': [GET_LIKES_LIKE_BSKY]}),
+    ]
+
+    bs = Bluesky('handull', access_token='towkin', max_requests=1)
+    cache = {}
+    got = bs.get_activities(fetch_likes=True, fetch_replies=True, cache=cache)
+    self.assert_equals(POST_AUTHOR_PROFILE_WITH_LIKES_AS['object']['tags'],
+                       got[0]['object']['tags'])
+    self.assertNotIn('replies', got[0]['object'])
+    self.assertEqual({'ABL at://did/app.bsky.feed.post/tid': 1}, cache)
+
+  @patch('requests.get')
+  def test_get_activities_extras_rate_limited(self, mock_get):
+    source.configure_rate_limiter(max_wait=0)
+    self.addCleanup(source.configure_rate_limiter)
+    key = ('bluesky', 'app.bsky.feed.getLikes', 'handull')
+    source._rate_limiter.set_limit(key, 1, 60)
+    source._rate_limiter.acquire(key)
+
+    post = copy.deepcopy(POST_FEED_VIEW_BSKY)
+    post['post'].update({'likeCount': 1, 'repostCount': 1})
+    mock_get.side_effect = [
+      requests_response({'feed': [post]}),
+      requests_response({'error': 'RateLimitExceeded'}, status=429, headers={
+        'RateLimit-Limit': '3000',
+        'RateLimit-Remaining': '0',
+        'RateLimit-Reset': str(int(NOW.timestamp()) + 300),
+      }),
+    ]
+
+    bs = Bluesky('handull', access_token='towkin')
+    cache = {}
+    got = bs.get_activities(fetch_likes=True, fetch_shares=True, cache=cache)
+    self.assert_equals([], got[0]['object'].get('tags', []))
+    # skipped fetches aren't cached, so they're retried next time
+    self.assertEqual({}, cache)
+    self.assertEqual(0, source._rate_limiter.remaining(
+      ('bluesky', 'app.bsky.feed.getRepostedBy', 'handull')))
+
+  @patch('requests.get')
+  def test_get_activities_replies_max_depth(self, mock_get):
+    mock_get.side_effect = [
+      requests_response({'feed': [POST_FEED_VIEW_WITH_REPLIES_BSKY]}),
+      requests_response({'thread': THREAD_BSKY}),
+    ]
+
+    bs = Bluesky('handull', access_token='towkin', max_reply_depth=1)
+    got = bs.get_activities(fetch_replies=True)
+    self.assert_equals({'items': [THREAD_REPLY_AS]}, got[0]['object']['replies'])
+    self.assert_call(mock_get,
+        'https://bsky.social/xrpc/app.bsky.feed.getPostThread?uri=at%3A%2F%2Fdid%2Fapp.bsky.feed.post%2Ftid&depth=1')
+
   @patch('requests.get')
   def test_get_actor(self, mock_get):
     mock_get.return_value = requests_response({
@@ -2,6 +2,7 @@
 import copy
 from datetime import datetime
 import os
+from unittest.mock import patch
 import urllib.parse
 
 from bs4.element import NavigableString
@@ -35,6 +36,7 @@ from .. import source
 
 API_ME_POSTS = API_SELF_POSTS % ('me', 0)
 API_ME_PHOTOS = API_PHOTOS_UPLOADED % 'me'
+API_ME_ALBUMS = API_ALBUMS % 'me'
 
 # test data
 def tag_uri(name):
@@ -1357,6 +1359,22 @@ class FacebookTest(testutil.TestCase):
     return super(FacebookTest, self).expect_urlopen(
       url, response=json_dumps(response), **kwargs)
 
+  def expect_batch(self, *calls):
+    """Expects a batch API request.
+
+    Args:
+      calls: sequence of (str relative URL, response body) or (str relative
+        URL, response body, int HTTP status code) tuples
+    """
+    requests = []
+    responses = []
+    for url, body, *code in calls:
+      requests.append({'method': 'GET', 'relative_url': url})
+      responses.append({'code': code[0] if code else 200, 'body': json_dumps(body)})
+
+    return self.expect_urlopen(
+      '', data='batch=' + json_dumps(requests, sort_keys=True), response=responses)
+
   def expect_requests_get(self, url, resp='', cookie=None, **kwargs):
     kwargs.setdefault('allow_redirects', False)
     # override user agent for facebook scraping (specific to facebook tests)
@@ -1446,15 +1464,15 @@ class FacebookTest(testutil.TestCase):
     self.assertNotIn('tags', got[0])
 
   def test_get_activities_self_empty(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_batch((API_ME_POSTS, {}), (API_ME_PHOTOS, {}), (API_ME_ALBUMS, {}))
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(group_id=source.SELF))
 
   def test_get_activities_self_photo_and_event(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': [PHOTO_POST]})
-    self.expect_urlopen(API_ME_PHOTOS, {'data': [PHOTO]})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
+    self.expect_batch((API_ME_POSTS, {'data': [PHOTO_POST]}),
+                      (API_ME_PHOTOS, {'data': [PHOTO]}),
+                      (API_ME_ALBUMS, {}),
+                      (API_USER_EVENTS, {'data': [EVENT]}))
 
     self.mox.ReplayAll()
     self.assert_equals(
@@ -1463,7 +1481,7 @@ class FacebookTest(testutil.TestCase):
 
   def test_get_activities_self_merge_photos(self):
     """https://github.com/snarfed/bridgy/issues/562"""
-    self.expect_urlopen(API_ME_POSTS, {'data': [
+    self.expect_batch((API_ME_POSTS, {'data': [
       {'id': '1', 'object_id': '11',   # has photo but no album
        'privacy': {'value': 'EVERYONE'}},
       {'id': '3', 'object_id': '33'},  # has photo but no album
@@ -1472,19 +1490,17 @@ class FacebookTest(testutil.TestCase):
        'privacy': {'value': 'CUSTOM'}},
       {'id': '7', 'object_id': '77',   # ditto, and photo has no album
        'privacy': {'value': 'CUSTOM'}},
-    ]})
-    self.expect_urlopen(API_ME_PHOTOS, {'data': [
+    ]}), (API_ME_PHOTOS, {'data': [
       {'id': '11'},
       {'id': '22', 'album': {'id': '222'}},  # no matching post
       {'id': '33', 'album': {'id': '333'}},  # no matching album
       {'id': '44', 'album': {'id': '444'}},  # no matching post or album
       {'id': '66', 'album': {'id': '666'}},  # consolidated posts...
       {'id': '77'},
-    ]})
-    self.expect_urlopen(API_ALBUMS % 'me', {'data': [
+    ]}), (API_ME_ALBUMS, {'data': [
       {'id': '222', 'privacy': 'friends'},   # no post
       {'id': '666', 'privacy': 'everyone'},  # consolidated post
-    ]})
+    ]}))
 
     self.mox.ReplayAll()
     self.assert_equals([
@@ -1499,43 +1515,39 @@ class FacebookTest(testutil.TestCase):
         for activity in self.fb.get_activities(group_id=source.SELF)])
 
   def test_get_activities_user_id_merge_photos(self):
-    self.expect_urlopen(API_SELF_POSTS % ('567', 0), {'data': []})
-    self.expect_urlopen(API_PHOTOS_UPLOADED % '567', {'data': [
-      {'album': {'id': '222'}},
-    ]})
-    self.expect_urlopen(API_ALBUMS % '567', {'data': []})
+    self.expect_batch((API_SELF_POSTS % ('567', 0), {'data': []}),
+                      (API_PHOTOS_UPLOADED % '567', {'data': [
+                        {'album': {'id': '222'}},
+                      ]}),
+                      (API_ALBUMS % '567', {'data': []}))
 
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(user_id='567', group_id=source.SELF))
 
   def test_get_activities_self_photos_returns_list(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, [])
+    self.expect_batch((API_ME_POSTS, {}), (API_ME_PHOTOS, []), (API_ME_ALBUMS, {}))
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(group_id=source.SELF))
 
   def test_get_activities_self_owned_event_rsvps(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
+    self.expect_batch((API_ME_POSTS, {}), (API_ME_PHOTOS, {}), (API_ME_ALBUMS, {}),
+                      (API_USER_EVENTS, {'data': [EVENT]}))
 
     self.mox.ReplayAll()
     self.assert_equals([EVENT_ACTIVITY], self.fb.get_activities(
       group_id=source.SELF, fetch_events=True, event_owner_id=EVENT['owner']['id']))
 
   def test_get_activities_self_unowned_event_no_rsvps(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
+    self.expect_batch((API_ME_POSTS, {}), (API_ME_PHOTOS, {}), (API_ME_ALBUMS, {}),
+                      (API_USER_EVENTS, {'data': [EVENT]}))
 
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(
       group_id=source.SELF, fetch_events=True, event_owner_id='xyz'))
 
   def test_get_activities_self_events_returns_list(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, [])
+    self.expect_batch((API_ME_POSTS, {}), (API_ME_PHOTOS, {}), (API_ME_ALBUMS, {}),
+                      (API_USER_EVENTS, []))
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(
       group_id=source.SELF, fetch_events=True))
@@ -1646,15 +1658,55 @@ class FacebookTest(testutil.TestCase):
       self.assertNotIn('tags', activity)
       self.assertNotIn('tags', activity['object'])
 
+  def test_get_activities_self_304_not_modified(self):
+    self.expect_urlopen('', data='batch=' + json_dumps([
+      {'headers': [{'name': 'If-None-Match', 'value': '"my etag"'}],
+       'method': 'GET', 'relative_url': API_ME_POSTS},
+      {'method': 'GET', 'relative_url': API_ME_PHOTOS},
+      {'method': 'GET', 'relative_url': API_ME_ALBUMS},
+    ], sort_keys=True), response=[
+      {'code': 304},
+      {'code': 200, 'body': '{}'},
+      {'code': 200, 'body': '{}'},
+    ])
+    self.mox.ReplayAll()
+
+    resp = self.fb.get_activities_response(group_id=source.SELF,
+                                           etag='"my etag"')
+    self.assert_equals([], resp['items'])
+    self.assert_equals('"my etag"', resp['etag'])
+
+  def test_get_activities_self_batch_5xx(self):
+    self.expect_batch((API_ME_POSTS, {}), (API_ME_PHOTOS, {}, 500),
+                      (API_ME_ALBUMS, {}))
+    self.mox.ReplayAll()
+
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.fb.get_activities(group_id=source.SELF)
+    self.assertEqual(500, e.exception.code)
+
+  def test_get_activities_extras_batch_ignores_4xx(self):
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_batch((API_SHARES % '1_2', {}, 400),
+                      (API_COMMENTS_ALL % '1_2',
+                       {'1_2': {'data': [{'id': '777', 'message': 'foo'}]}}))
+    self.mox.ReplayAll()
+
+    got = self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assertNotIn('tags', got[0]['object'])
+    self.assert_equals(['777'], [r['fb_id'] for r in
+                                 got[0]['object']['replies']['items']])
+
   def test_get_activities_too_many_ids(self):
     ids = ['1', '2', '3', '4', '5']
     self.expect_urlopen('me/home?offset=0', {'data': [{'id': id} for id in ids]})
-    self.expect_urlopen(API_SHARES % '1,2', {'1': {'data': [{'id': '222'}]}})
-    self.expect_urlopen(API_SHARES % '3,4', {'2': {'data': [{'id': '444'}]}})
-    self.expect_urlopen(API_SHARES % '5', {})
-    self.expect_urlopen(API_COMMENTS_ALL % '1,2', {'1': {'data': [{'id': '111'}]}})
-    self.expect_urlopen(API_COMMENTS_ALL % '3,4', {'1': {'data': [{'id': '333'}]}})
-    self.expect_urlopen(API_COMMENTS_ALL % '5', {})
+    self.expect_batch(
+      (API_SHARES % '1,2', {'1': {'data': [{'id': '222'}]}}),
+      (API_SHARES % '3,4', {'2': {'data': [{'id': '444'}]}}),
+      (API_SHARES % '5', {}),
+      (API_COMMENTS_ALL % '1,2', {'1': {'data': [{'id': '111'}]}}),
+      (API_COMMENTS_ALL % '3,4', {'1': {'data': [{'id': '333'}]}}),
+      (API_COMMENTS_ALL % '5', {}))
     self.mox.ReplayAll()
 
     try:
@@ -1711,8 +1763,8 @@ class FacebookTest(testutil.TestCase):
     post = {'id': '1', 'status_type': 'shared_story'}
     activity = self.fb.post_to_activity(post)
 
-    self.expect_urlopen(API_ME_POSTS, {'data': [post]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_batch((API_ME_POSTS, {'data': [post]}), (API_ME_PHOTOS, {}),
+                      (API_ME_ALBUMS, {}))
     self.mox.ReplayAll()
     self.assert_equals([activity], self.fb.get_activities(group_id=source.SELF))
 
@@ -1749,24 +1801,22 @@ class FacebookTest(testutil.TestCase):
     self.assert_equals([activity], self.fb.get_activities(fetch_replies=True))
 
   def test_get_activities_skips_extras_if_no_posts(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': []})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_batch((API_ME_POSTS, {'data': []}), (API_ME_PHOTOS, {}),
+                      (API_ME_ALBUMS, {}))
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(
       group_id=source.SELF, fetch_shares=True, fetch_replies=True))
 
   def test_get_activities_extras_skips_notes_includes_links(self):
     # first call returns just notes
-    self.expect_urlopen(API_ME_POSTS,
-                        {'data': [FB_NOTE, FB_CREATED_NOTE]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_batch((API_ME_POSTS, {'data': [FB_NOTE, FB_CREATED_NOTE]}),
+                      (API_ME_PHOTOS, {}), (API_ME_ALBUMS, {}))
 
     # second call returns notes and link
-    self.expect_urlopen(API_ME_POSTS,
-                        {'data': [FB_NOTE, FB_CREATED_NOTE, FB_LINK]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_SHARES % '555', [])
-    self.expect_urlopen(API_COMMENTS_ALL % '555', {})
+    self.expect_batch(
+      (API_ME_POSTS, {'data': [FB_NOTE, FB_CREATED_NOTE, FB_LINK]}),
+      (API_ME_PHOTOS, {}), (API_ME_ALBUMS, {}))
+    self.expect_batch((API_SHARES % '555', []), (API_COMMENTS_ALL % '555', {}))
 
     self.mox.ReplayAll()
 
@@ -1776,13 +1826,14 @@ class FacebookTest(testutil.TestCase):
         group_id=source.SELF, fetch_shares=True, fetch_replies=True))
 
   def test_get_activities_matches_extras_with_correct_activity(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': [POST]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
-    self.expect_urlopen(API_SHARES % '212038_10100176064482163',
-                        {'212038_10100176064482163': {'data': [SHARE]}})
-    self.expect_urlopen(API_COMMENTS_ALL % '212038_10100176064482163',
-                        {'212038_10100176064482163': {'data': COMMENTS}})
+    self.expect_batch((API_ME_POSTS, {'data': [POST]}),
+                      (API_ME_PHOTOS, {}),
+                      (API_ME_ALBUMS, {}),
+                      (API_USER_EVENTS, {'data': [EVENT]}))
+    self.expect_batch((API_SHARES % '212038_10100176064482163',
+                       {'212038_10100176064482163': {'data': [SHARE]}}),
+                      (API_COMMENTS_ALL % '212038_10100176064482163',
+                       {'212038_10100176064482163': {'data': COMMENTS}}))
 
     self.mox.ReplayAll()
     activity = copy.deepcopy(ACTIVITY)
@@ -1791,9 +1842,10 @@ class FacebookTest(testutil.TestCase):
       group_id=source.SELF, fetch_events=True, fetch_shares=True, fetch_replies=True))
 
   def test_get_activities_self_fetch_news(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': [POST]})
-    self.expect_urlopen(API_NEWS_PUBLISHES % 'me', {'data': [FB_NEWS_PUBLISH]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_batch((API_ME_POSTS, {'data': [POST]}),
+                      (API_ME_PHOTOS, {}),
+                      (API_ME_ALBUMS, {}),
+                      (API_NEWS_PUBLISHES % 'me', {'data': [FB_NEWS_PUBLISH]}))
     # should only fetch sharedposts for POST, not FB_NEWS_PUBLISH
     self.expect_urlopen(API_SHARES % '212038_10100176064482163', {})
 
@@ -1803,9 +1855,10 @@ class FacebookTest(testutil.TestCase):
     self.assert_equals([ACTIVITY, FB_NEWS_PUBLISH_ACTIVITY], got)
 
   def test_get_activities_user_id_fetch_news(self):
-    self.expect_urlopen(API_SELF_POSTS % ('567', 0), {'data': []})
-    self.expect_urlopen(API_NEWS_PUBLISHES % '567', {'data': [FB_NEWS_PUBLISH]})
-    self.expect_urlopen(API_PHOTOS_UPLOADED % '567', {})
+    self.expect_batch((API_SELF_POSTS % ('567', 0), {'data': []}),
+                      (API_PHOTOS_UPLOADED % '567', {}),
+                      (API_ALBUMS % '567', {}),
+                      (API_NEWS_PUBLISHES % '567', {'data': [FB_NEWS_PUBLISH]}))
 
     self.mox.ReplayAll()
     got = self.fb.get_activities(group_id=source.SELF, user_id='567', fetch_news=True)
@@ -3237,6 +3290,52 @@ cc Sam G, Michael M<br />""", preview.description)
     self.assert_equals(resps, self.fb.urlopen_batch_full(
       [{'relative_url': 'abc'}, {'relative_url': 'def'}]))
 
+  def test_urlopen_batch_full_timed_out(self):
+    self.expect_urlopen('',
+      data='batch=[{"method":"GET","relative_url":"abc"},'
+                  '{"method":"GET","relative_url":"def"}]',
+      response=[None, {'code': 200, 'body': '{"def": 2}'}])
+    self.mox.ReplayAll()
+
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.fb.urlopen_batch(('abc', 'def'))
+    self.assertEqual(504, e.exception.code)
+    self.assertEqual('abc', e.exception.url)
+
+  def test_get_activities_extras_batch_timed_out(self):
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_urlopen('',
+      data=f'batch=[{{"method":"GET","relative_url":"{API_SHARES % "1_2"}"}},'
+                  f'{{"method":"GET","relative_url":"{API_COMMENTS_ALL % "1_2"}"}}]',
+      response=[None, {'code': 200, 'body': '{}'}])
+    self.mox.ReplayAll()
+
+    # a timed out call fails the whole request instead of looking empty
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assertEqual(504, e.exception.code)
+
+  def test_urlopen_batched_splits_batches_concurrently(self):
+    fb = Facebook(threads=3)
+
+    def urlopen_batch_full(requests):
+      # drop the last response to simulate a short batch
+      return [{'code': 200, 'body': req['relative_url']}
+              for req in requests if req['relative_url'] != 'e']
+
+    with patch.object(facebook, 'MAX_BATCH_SIZE', 2), \
+         patch.object(fb, 'urlopen_batch_full',
+                      side_effect=urlopen_batch_full) as mock:
+      resps = fb._urlopen_batched([{'relative_url': url} for url in 'abcde'])
+
+    self.assertEqual(3, mock.call_count)
+    self.assert_equals(['a', 'b', 'c', 'd', None],
+                       [resp.get('body') for resp in resps])
+    # the missing response is an error, not an empty result
+    self.assertEqual(504, resps[4]['code'])
+    with self.assertRaises(urllib.error.HTTPError):
+      fb._batch_body('e', resps[4])
+
   def test_email_to_object_comment_user_id(self):
     self.assert_equals(EMAIL_COMMENT_OBJ_USER_ID,
                        self.fb.email_to_object(COMMENT_EMAIL_USER_ID))
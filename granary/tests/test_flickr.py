@@ -3,6 +3,7 @@ import copy
 from mox3 import mox
 import socket
 import urllib.parse
+from unittest.mock import patch
 
 from oauth_dropins import flickr_auth
 from oauth_dropins.webutil import testutil
@@ -578,6 +579,11 @@ class FlickrTest(testutil.TestCase):
     flickr_auth.FLICKR_APP_SECRET = 'fake'
     self.flickr = flickr.Flickr('key', 'secret')
 
+    # webutil's fake urlopen responses don't have close() like real ones
+    closer = patch.object(testutil.UrlopenResult, 'close', create=True)
+    self.closed = closer.start()
+    self.addCleanup(closer.stop)
+
   def expect_call_api_method(self, method, params, result):
     full_params = {
       'nojsoncallback': 1,
@@ -941,6 +947,7 @@ class FlickrTest(testutil.TestCase):
         'url': 'http://foo/xyz',
         'content': 'foo',
       }))
+    self.closed.assert_called_once()
 
   def test_preview_create_comment(self):
     preview = self.flickr.preview_create(
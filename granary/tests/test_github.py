@@ -349,6 +349,48 @@ NOTIFICATION_ISSUE_REST = copy.deepcopy(NOTIFICATION_PULL_REST)
 NOTIFICATION_ISSUE_REST.update({
   'subject': {'url': 'https://api.github.com/repos/foo/baz/issues/456'},
 })
+RATE_LIMIT_GRAPHQL = {
+  'cost': 1,
+  'remaining': 4999,
+  'resetAt': '2099-01-01T00:00:00Z',
+}
+ISSUE_BATCH_GRAPHQL = {  # GitHub, batched query in get_activities
+  'id': 'MDU6SXNzdWUyOTI5MDI1NTI=',
+  'number': 333,
+  'url': 'https://github.com/foo/bar/issues/333',
+  'title': 'an issue title',
+  'body': 'foo bar\r\nbaz',
+  'createdAt': '2018-01-30T19:11:03Z',
+  'updatedAt': '2018-02-01T19:11:03Z',
+  'author': USER_GRAPHQL,
+  'labels': {'nodes': [{'name': 'new silo'}]},
+}
+PULL_BATCH_GRAPHQL = {  # GitHub, batched query in get_activities
+  'id': 'MDExOlB1bGxSZXF1ZXN0MTY3OTMwODA0',
+  'number': 444,
+  'url': 'https://github.com/foo/bar/pull/444',
+  'title': 'a PR to merge',
+  'body': 'a PR message',
+  'createdAt': '2018-02-08T10:24:32Z',
+  'updatedAt': '2018-02-09T21:14:43Z',
+  'author': USER_GRAPHQL,
+  'labels': {'nodes': []},
+  'merged': True,
+  'baseRefName': 'master',
+}
+COMMENT_BATCH_GRAPHQL = {  # GitHub, batched query in get_activities
+  'databaseId': 456,
+  'url': 'https://github.com/foo/bar/pull/123#issuecomment-456',
+  'body': 'i have something to say here',
+  'createdAt': '2015-07-23T18:47:58Z',
+  'updatedAt': '2015-07-23T19:47:58Z',
+  'author': USER_GRAPHQL,
+}
+REACTION_BATCH_GRAPHQL = {  # GitHub, batched query in get_activities
+  'content': 'THUMBS_UP',
+  'createdAt': '2018-02-21T19:49:16Z',
+  'user': USER_GRAPHQL,
+}
 EXPECTED_HEADERS = {
   'Authorization': 'token a-towkin',
 }
@@ -398,6 +440,26 @@ class GitHubTest(testutil.TestCase):
       },
     })
 
+  def expect_graphql_batch(self, subjects, response, fields='', errors=None):
+    """subjects is a list of (owner, repo, number) tuples."""
+    query = ('query {\n  rateLimit {cost remaining resetAt}' +
+             ''.join(github.GRAPHQL_BATCH_SUBJECT % {'i': i, 'number': number}
+                     for i, (_, _, number) in enumerate(subjects)) +
+             '\n}\n' + github.GRAPHQL_BATCH_FRAGMENTS % {
+               'fields': github.GRAPHQL_BATCH_ISSUE_FIELDS + fields,
+             })
+    kwargs = {}
+    for i, (owner, repo, _) in enumerate(subjects):
+      kwargs.update({f'owner{i}': owner, f'repo{i}': repo})
+
+    response = {'data': {'rateLimit': RATE_LIMIT_GRAPHQL, **response}}
+    if errors:
+      response['errors'] = errors
+
+    return self.expect_requests_post(GRAPHQL_BASE, headers={
+        'Authorization': 'bearer a-towkin',
+      }, json={'query': query % kwargs}, response=response)
+
   def expect_graphql_add_reaction(self):
     self.expect_graphql(json={
       'query': github.GRAPHQL_ADD_REACTION % {
@@ -603,6 +665,140 @@ class GitHubTest(testutil.TestCase):
     obj_public_repo['to'] = [{'objectType': 'group', 'alias': '@private'}]
     self.assert_equals([obj_public_repo], self.gh.get_activities())
 
+  def test_get_activities_graphql_batch(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=10)
+    self.expect_rest(REST_NOTIFICATIONS,
+                     [NOTIFICATION_PULL_REST, NOTIFICATION_ISSUE_REST])
+
+    pull = copy.deepcopy(PULL_BATCH_GRAPHQL)
+    pull.update({
+      'comments': {'nodes': []},
+      'reactions': {'nodes': []},
+    })
+    issue = copy.deepcopy(ISSUE_BATCH_GRAPHQL)
+    issue.update({
+      'comments': {'nodes': [COMMENT_BATCH_GRAPHQL, COMMENT_BATCH_GRAPHQL]},
+      'reactions': {'nodes': [REACTION_BATCH_GRAPHQL, REACTION_BATCH_GRAPHQL]},
+    })
+    self.expect_graphql_batch(
+      [('foo', 'bar', 123), ('foo', 'baz', 456)], {
+        's0': {'issueOrPullRequest': pull},
+        's1': {'issueOrPullRequest': issue},
+      }, fields=github.GRAPHQL_BATCH_COMMENTS + github.GRAPHQL_BATCH_REACTIONS)
+    self.mox.ReplayAll()
+
+    pull_obj = copy.deepcopy(PULL_OBJ)
+    pull_obj.update({
+      'to': [{'objectType': 'group', 'alias': '@private'}],
+      'replies': {'totalItems': 0},
+    })
+    issue_obj = copy.deepcopy(ISSUE_OBJ_WITH_REPLIES)
+    issue_obj['tags'].extend([REACTION_OBJ, REACTION_OBJ])
+    self.assert_equals([pull_obj, issue_obj], self.gh.get_activities(
+      fetch_replies=True, fetch_likes=True))
+    self.assert_equals(RATE_LIMIT_GRAPHQL, self.gh.graphql_rate_limit)
+
+  def test_get_activities_graphql_batch_size_and_not_found(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=1)
+    self.expect_rest(REST_NOTIFICATIONS,
+                     [NOTIFICATION_PULL_REST, NOTIFICATION_ISSUE_REST])
+    self.expect_graphql_batch([('foo', 'bar', 123)], {'s0': None}, errors=[{
+      'type': 'NOT_FOUND',
+      'path': ['s0'],
+      'message': "Could not resolve to a Repository with the name 'foo/bar'.",
+    }])
+    self.expect_graphql_batch([('foo', 'baz', 456)], {
+      's0': {'issueOrPullRequest': ISSUE_BATCH_GRAPHQL},
+    })
+    self.mox.ReplayAll()
+
+    obj = copy.deepcopy(ISSUE_OBJ)
+    obj['to'] = [{'objectType': 'group', 'alias': '@private'}]
+    self.assert_equals([obj], self.gh.get_activities())
+
+  def test_get_activities_graphql_batch_other_error(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=10)
+    self.expect_rest(REST_NOTIFICATIONS, [NOTIFICATION_ISSUE_REST])
+    self.expect_graphql_batch([('foo', 'baz', 456)], {'s0': None}, errors=[{
+      'type': 'MAX_NODE_LIMIT_EXCEEDED',
+      'message': 'too many nodes',
+    }])
+    self.mox.ReplayAll()
+
+    with self.assertRaises(ValueError):
+      self.gh.get_activities()
+
+  def test_get_activities_graphql_batch_since(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=10)
+    self.expect_rest(REST_NOTIFICATIONS, [NOTIFICATION_ISSUE_REST],
+                     headers={'If-Modified-Since': 'Thu, 25 Oct 2012 15:16:27 GMT'})
+
+    old_comment = copy.deepcopy(COMMENT_BATCH_GRAPHQL)
+    old_comment['updatedAt'] = '2012-10-25T15:16:26Z'
+    issue = copy.deepcopy(ISSUE_BATCH_GRAPHQL)
+    issue['comments'] = {'nodes': [
+      old_comment, COMMENT_BATCH_GRAPHQL, COMMENT_BATCH_GRAPHQL]}
+    self.expect_graphql_batch([('foo', 'baz', 456)], {
+      's0': {'issueOrPullRequest': issue},
+    }, fields=github.GRAPHQL_BATCH_COMMENTS)
+    self.mox.ReplayAll()
+
+    self.assert_equals([ISSUE_OBJ_WITH_REPLIES], self.gh.get_activities(
+      etag='Thu, 25 Oct 2012 15:16:27 GMT', fetch_replies=True))
+
+  def test_get_activities_graphql_batch_out_of_rate_limit(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=10)
+    self.gh.graphql_rate_limit = {**RATE_LIMIT_GRAPHQL, 'remaining': 0}
+
+    self.expect_rest(REST_NOTIFICATIONS, [NOTIFICATION_ISSUE_REST])
+    self.expect_rest(NOTIFICATION_ISSUE_REST['subject']['url'], ISSUE_REST)
+    self.expect_rest(ISSUE_REST['comments_url'], [COMMENT_REST, COMMENT_REST])
+    self.mox.ReplayAll()
+
+    self.assert_equals([ISSUE_OBJ_WITH_REPLIES],
+                       self.gh.get_activities(fetch_replies=True))
+
+  def test_get_activities_graphql_batch_same_comment_ids_as_rest(self):
+    comment_rest = {**COMMENT_REST, 'node_id': 'IC_kwDOBDH7'}
+    comment_graphql = {**COMMENT_BATCH_GRAPHQL, 'id': 'IC_kwDOBDH7'}
+    issue = copy.deepcopy(ISSUE_BATCH_GRAPHQL)
+    issue['comments'] = {'nodes': [comment_graphql]}
+
+    # REST, eg after running out of GraphQL rate limit points
+    self.expect_rest(REST_NOTIFICATIONS, [NOTIFICATION_ISSUE_REST])
+    self.expect_rest(NOTIFICATION_ISSUE_REST['subject']['url'], ISSUE_REST)
+    self.expect_rest(ISSUE_REST['comments_url'], [comment_rest])
+    # GraphQL
+    self.expect_rest(REST_NOTIFICATIONS, [NOTIFICATION_ISSUE_REST])
+    self.expect_graphql_batch([('foo', 'baz', 456)], {
+      's0': {'issueOrPullRequest': issue},
+    }, fields=github.GRAPHQL_BATCH_COMMENTS)
+    self.mox.ReplayAll()
+
+    rest = github.GitHub('a-towkin').get_activities(fetch_replies=True)
+    graphql = github.GitHub('a-towkin', graphql_batch_size=10).get_activities(
+      fetch_replies=True)
+
+    ids = [tag_uri('foo:bar:IC_kwDOBDH7')]
+    self.assertEqual(ids, [c['id'] for c in rest[0]['replies']['items']])
+    self.assertEqual(ids, [c['id'] for c in graphql[0]['replies']['items']])
+
+  def test_get_activities_graphql_batch_activity_id(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=10)
+    self.expect_graphql_batch([('foo', 'bar', 333)], {
+      's0': {'issueOrPullRequest': ISSUE_BATCH_GRAPHQL},
+    })
+    self.mox.ReplayAll()
+    self.assert_equals([ISSUE_OBJ], self.gh.get_activities(activity_id='foo:bar:333'))
+
+  def test_get_activities_graphql_batch_activity_id_not_found(self):
+    self.gh = github.GitHub('a-towkin', graphql_batch_size=10)
+    self.expect_graphql_batch([('a', 'b', 1)], {
+      's0': {'issueOrPullRequest': None},
+    })
+    self.mox.ReplayAll()
+    self.assert_equals([], self.gh.get_activities(activity_id='a:b:1'))
+
   def test_get_activities_search_not_implemented(self):
     with self.assertRaises(NotImplementedError):
       self.gh.get_activities(search_query='foo')
@@ -2,6 +2,7 @@
 import copy
 import datetime
 import logging
+from unittest.mock import patch
 import urllib.parse
 
 from mox3 import mox
@@ -1300,6 +1301,9 @@ class InstagramTest(testutil.TestCase):
     super(InstagramTest, self).setUp()
     self.instagram = Instagram()
     instagram._last_rate_limited = instagram._last_rate_limited_exc = None
+    instagram._next_extras_fetch.clear()
+    self.sleeps = []
+    self.mox.stubs.Set(instagram, 'sleep_fn', self.sleeps.append)
 
   def expect_requests_get(self, url, resp='', cookie=None, **kwargs):
     kwargs.setdefault('allow_redirects', False)
@@ -1433,6 +1437,74 @@ class InstagramTest(testutil.TestCase):
       user_id='x', group_id=source.SELF, fetch_likes=True, fetch_replies=True,
       scrape=True, cookie='kuky'))
 
+    # serial fetches aren't paced
+    self.assertEqual([], self.sleeps)
+
+  def test_get_activities_scrape_fetch_extras_threads(self):
+    pages = {
+      HTML_BASE_URL + 'x/': HTML_PROFILE_COMPLETE,
+      HTML_BASE_URL + 'p/ABC123/': HTML_PHOTO_COMPLETE,
+      HTML_BASE_URL + 'p/XYZ789/': HTML_VIDEO_COMPLETE,
+      instagram.HTML_LIKES_URL % 'ABC123': HTML_PHOTO_LIKES_RESPONSE,
+      instagram.HTML_LIKES_URL % 'XYZ789': {},
+    }
+
+    # mox isn't thread safe, so mock the HTTP calls instead
+    with patch.object(util, 'requests_get', side_effect=lambda url, **_:
+                      testutil.requests_response(pages[url], url=url)) as get:
+      ig = Instagram(threads=2)
+      self.assert_equals(HTML_ACTIVITIES_FULL_LIKES, ig.get_activities(
+        user_id='x', group_id=source.SELF, fetch_likes=True, fetch_replies=True,
+        scrape=True, cookie='kuky'))
+
+    self.assertCountEqual(pages.keys(), [call.args[0] for call in get.call_args_list])
+
+    # concurrent fetches are paced
+    self.assertEqual(1, len(self.sleeps))
+    self.assertGreater(self.sleeps[0], 0)
+    self.assertLessEqual(self.sleeps[0], instagram.SCRAPE_EXTRAS_INTERVAL)
+    # raw cookies aren't kept
+    self.assertNotIn('kuky', str(instagram._next_extras_fetch))
+
+  def test_scrape_extras_page_pacing_bounded(self):
+    self.mox.stubs.Set(instagram, '_NEXT_EXTRAS_FETCH_MAX_SIZE', 2)
+    with patch.object(util, 'requests_get',
+                      return_value=testutil.requests_response('x')):
+      for cookie in 'a', 'b', 'c':
+        Instagram._scrape_extras_page('http://x', cookie, {}, pace=True)
+
+    self.assertEqual(2, len(instagram._next_extras_fetch))
+
+  def test_get_activities_scrape_fetch_extras_rate_limited(self):
+    self.expect_requests_get('x/', HTML_PROFILE_COMPLETE, cookie='kuky')
+    self.expect_requests_get('p/ABC123/', status_code=429, cookie='kuky')
+    self.mox.ReplayAll()
+
+    with self.assertRaises(requests.HTTPError) as cm:
+      self.instagram.get_activities(
+        user_id='x', group_id=source.SELF, fetch_likes=True, scrape=True,
+        cookie='kuky')
+    self.assertEqual(429, cm.exception.response.status_code)
+    self.assertIsNotNone(instagram._last_rate_limited)
+
+    # other extras fetches see the remembered rate limit and short circuit
+    with self.assertRaises(requests.HTTPError):
+      Instagram._scrape_extras_page(HTML_BASE_URL + 'p/XYZ789/', 'kuky', {})
+
+  def test_scraped_media_to_activities(self):
+    for html in HTML_PHOTO_COMPLETE, HTML_VIDEO_COMPLETE, HTML_FEED_COMPLETE_V2:
+      with self.subTest(html=html[-50:]):
+        full, _ = self.instagram.scraped_to_activities(html, fetch_extras=True)
+        self.assert_equals(full, self.instagram._scraped_media_to_activities(html))
+
+  def test_scraped_media_to_activities_skips_unrelated_items(self):
+    html = ('<script type="application/json">{"suggested": {"items": [{"user": {"pk": "123", "username": "friend"}}]}, "nav": {"items": [{"label": "Home", "href": "/"}]}}</script>'
+            + HTML_FEED_COMPLETE_V2)
+    full, _ = self.instagram.scraped_to_activities(HTML_FEED_COMPLETE_V2,
+                                                   fetch_extras=True)
+    self.assertTrue(full)
+    self.assert_equals(full, self.instagram._scraped_media_to_activities(html))
+
   def test_get_activities_scrape_fetch_extras_cache(self):
     # first time, cache is cold
     self.expect_requests_get('x/', HTML_PROFILE_COMPLETE, cookie='kuky')
@@ -1,6 +1,8 @@
 """Unit tests for mastodon.py."""
 import copy
+from unittest.mock import patch
 
+from mox3 import mox
 from oauth_dropins.webutil import testutil, util
 from oauth_dropins.webutil.util import json_dumps, json_loads
 from requests import HTTPError
@@ -521,6 +523,41 @@ class MastodonTest(testutil.TestCase):
       self.mastodon.get_activities(fetch_replies=True, fetch_shares=True,
                                    fetch_likes=True, cache=cache)
 
+  def test_get_activities_fetch_extras_threads(self):
+    self.mastodon = mastodon.Mastodon(INSTANCE, user_id=ACCOUNT['id'],
+                                      access_token='towkin', threads=3)
+    self.expect_get(API_TIMELINE, params={}, response=[STATUS_WITH_COUNTS])
+    self.expect_get(API_CONTEXT % STATUS['id'], {
+      'ancestors': [],
+      'descendants': [REPLY_STATUS],
+    }).InAnyOrder()
+    self.expect_get(API_FAVORITED_BY % STATUS['id'], [ACCOUNT]).InAnyOrder()
+    self.expect_get(API_REBLOGGED_BY % STATUS['id'], [ACCOUNT_REMOTE]).InAnyOrder()
+    self.mox.ReplayAll()
+
+    expected = copy.deepcopy(ACTIVITY)
+    expected['object']['replies'] = {'items': [REPLY_ACTIVITY]}
+    expected['object']['tags'].extend([LIKE, SHARE_BY_REMOTE])
+
+    cache = {}
+    self.assert_equals([expected], self.mastodon.get_activities(
+      fetch_replies=True, fetch_likes=True, fetch_shares=True, cache=cache),
+      in_order=True)
+    self.assert_equals({'AMRE 123': 1, 'AMF 123': 2, 'AMRB 123': 3}, cache)
+
+  def test_get_activities_http_session(self):
+    source.enable_http_sessions()
+    self.addCleanup(source.disable_http_sessions)
+
+    session = source.http_session(INSTANCE)
+    self.mox.StubOutWithMock(session, 'get')
+    session.get(INSTANCE + API_TIMELINE, params={}, timeout=util.HTTP_TIMEOUT,
+                stream=True, headers=mox.IgnoreArg()).AndReturn(
+      testutil.requests_response([STATUS], content_type='application/json'))
+    self.mox.ReplayAll()
+
+    self.assert_equals([ACTIVITY], self.mastodon.get_activities())
+
   def test_get_activities_returns_non_json(self):
     self.expect_get(API_TIMELINE, params={}, response='<html>',
                     content_type='text/html')
@@ -920,6 +957,18 @@ class MastodonTest(testutil.TestCase):
     result = self.mastodon.create(obj)
     self.assert_equals(STATUS, result.content, result)
 
+  def test_upload_media_threads(self):
+    m = mastodon.Mastodon(INSTANCE, user_id=ACCOUNT['id'], access_token='towkin',
+                          threads=3)
+    media = [{'url': f'http://my/{i}.png'} for i in range(3)]
+
+    # mox isn't thread safe, so mock the HTTP calls instead
+    with patch.object(util, 'requests_get',
+                      side_effect=lambda url, **_: testutil.requests_response(url[-5])), \
+         patch.object(mastodon.Mastodon, '_post',
+                      side_effect=lambda _, files, data: {'id': files['file'].read().decode()}):
+      self.assertEqual(['0', '1', '2'], m.upload_media(media + media))
+
   def test_delete(self):
     self.expect_delete(API_STATUS % '456')
     self.mox.ReplayAll()
@@ -12,8 +12,19 @@ import mf2py
 from .. import microformats2
 
 
+AUTHOR_PAGE = """
+<div class="h-card">
+<a class="p-name u-url u-uid" href="http://my/author">Ms. Baz</a>
+</div>
+"""
+
+
 class Microformats2Test(testutil.TestCase):
 
+  def setUp(self):
+    super().setUp()
+    microformats2.disable_author_cache()
+
   def test_post_type_discovery(self):
     for prop, verb in ('like-of', 'like'), ('repost-of', 'share'):
       obj = microformats2.json_to_object(
@@ -850,6 +861,72 @@ Shared <a href="#">a post</a> by foo
       },
     }))
 
+  def test_json_to_activities_fetch_mf2_one_fetch_per_author(self):
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE)
+    self.mox.ReplayAll()
+
+    activities = microformats2.json_to_activities({
+      'items': [{
+        'type': ['h-entry'],
+        'properties': {
+          'content': [f'post {i}'],
+          'author': ['http://my/author'],
+        },
+      } for i in range(3)],
+    }, fetch_mf2=True)
+
+    self.assertEqual(3, len(activities))
+    for activity in activities:
+      self.assertEqual('Ms. Baz', activity['object']['author']['displayName'])
+
+  def test_fetch_author_mf2_not_cached_by_default(self):
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE)
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE)
+    self.mox.ReplayAll()
+
+    first = microformats2.fetch_author_mf2('http://my/author')
+    self.assertIsNot(first, microformats2.fetch_author_mf2('http://my/author'))
+
+  def test_fetch_author_mf2_cached(self):
+    microformats2.configure_author_cache()
+    self.addCleanup(microformats2.disable_author_cache)
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE)
+    self.mox.ReplayAll()
+
+    first = microformats2.fetch_author_mf2('http://my/author')
+    self.assertEqual('http://my/author', first['url'])
+    self.assertIs(first, microformats2.fetch_author_mf2('http://my/author'))
+
+  def test_fetch_author_mf2_revalidates(self):
+    microformats2.configure_author_cache(ttl=0)
+    self.addCleanup(microformats2.disable_author_cache)
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE, response_headers={
+      'ETag': '"abc"',
+      'Last-Modified': 'Tue, 15 Nov 1994 12:45:26 GMT',
+    })
+    self.expect_requests_get('http://my/author', '', status_code=304, headers={
+      'If-None-Match': '"abc"',
+      'If-Modified-Since': 'Tue, 15 Nov 1994 12:45:26 GMT',
+    })
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE, headers={
+      'If-None-Match': '"abc"',
+    }, response_headers={'ETag': '"def"'})
+    self.mox.ReplayAll()
+
+    first = microformats2.fetch_author_mf2('http://my/author')
+    self.assertIs(first, microformats2.fetch_author_mf2('http://my/author'))
+    self.assertEqual(first, microformats2.fetch_author_mf2('http://my/author'))
+
+  def test_fetch_author_mf2_memo(self):
+    self.expect_requests_get('http://my/author', AUTHOR_PAGE)
+    self.mox.ReplayAll()
+
+    memo = {}
+    first = microformats2.fetch_author_mf2('http://my/author', memo=memo)
+    self.assertIs(first, memo['http://my/author'])
+    self.assertIs(first, microformats2.fetch_author_mf2('http://my/author',
+                                                        memo=memo))
+
   def test_json_to_object_authorship_fetch_mf2_func(self):
     self.expect_requests_get('http://example.com', """
 <div class="h-card">
@@ -1084,6 +1161,32 @@ Shared <a href="#">a post</a> by   <span class="h-card">
   'actor': {'url': 'http://localhost:3000/users/ryan'},
 }]), ignore_blanks=True)
 
+  def test_activities_to_html_stream(self):
+    activities = [{
+      'objectType': 'note',
+      'id': f'tag:a.b,2013:{i}',
+      'content': f'post {i}',
+    } for i in range(3)]
+
+    chunks = microformats2.activities_to_html(activities, extra='<p>hi</p>',
+                                              body_class='h-feed', stream=True)
+    self.assertNotIsInstance(chunks, str)
+    chunks = list(chunks)
+    self.assertGreater(len(chunks), 3)
+    self.assertEqual(microformats2.activities_to_html(
+      activities, extra='<p>hi</p>', body_class='h-feed'), ''.join(chunks))
+
+  def test_object_to_html_multiple_mentions_wide_unicode(self):
+    self.assert_multiline_in(
+      '💯 <a href="http://a">@a</a> and <a href="http://b">@b</a> 💯',
+      microformats2.object_to_html({
+        'content': '💯 @a and @b 💯',
+        'tags': [
+          {'url': 'http://b', 'startIndex': 9, 'length': 2},
+          {'url': 'http://a', 'startIndex': 2, 'length': 2},
+        ],
+      }))
+
   def test_html_to_activities_brs_to_newlines(self):
     """Mostly tests that mf2py converts <br>s to \ns.
 
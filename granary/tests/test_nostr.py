@@ -1,14 +1,23 @@
 """Unit tests for nostr.py."""
-from contextlib import contextmanager
 from datetime import timedelta
 import secrets
+import threading
 
 from oauth_dropins.webutil.util import HTTP_TIMEOUT, json_dumps, json_loads
 from oauth_dropins.webutil import testutil
 from websockets.exceptions import ConnectionClosed
 
 from .. import nostr
-from ..nostr import from_as1, id_for, id_to_uri, is_bech32, to_as1, uri_to_id
+from ..nostr import (
+  from_as1,
+  id_for,
+  id_to_uri,
+  ids_for,
+  is_bech32,
+  to_as1,
+  uri_to_id,
+  verify_events,
+)
 
 NOW_TS = int(testutil.NOW.timestamp())
 NOW_ISO = testutil.NOW.replace(tzinfo=None).isoformat()
@@ -25,6 +34,16 @@ NOTE_NOSTR = {
   'content': 'Something to say',
   'tags': [],
 }
+# signed with private key 1111...
+SIGNED_NOSTR = {
+  'id': '18be215ab1b671fc1ab0ce707c8259d0730f50f6fdcb3aa8e2c022713ae32340',
+  'pubkey': '4f355bdcb7cc0af728ef3cceb9615d90684bb5b2ca5f859ab0f0b704075871aa',
+  'created_at': 1700000000,
+  'kind': 1,
+  'tags': [],
+  'content': 'Something to say',
+  'sig': 'dbed9811a7b97b6bec55caee5a061b0f95bb881ec6b436b20f2a99fc8a0c4fe04c044381a9753af5580e3a90e8e2e0cc7f57d274c366e794f628bbee88ee984c',
+}
 NOTE_AS1 = {
   'objectType': 'note',
   'id': 'nostr:note1z24swknlsf',
@@ -35,31 +54,42 @@ NOTE_AS1 = {
 
 class FakeConnection:
   """Fake of :class:`websockets.sync.client.ClientConnection`."""
-  relay = None
-  sent = []
-  to_receive = []
-
-  @classmethod
-  def send(cls, msg):
-    cls.sent.append(json_loads(msg))
+  # maps str relay URI to FakeConnection
+  relays = {}
+
+  def __init__(self, relay):
+    self.relay = relay
+    self.connected = False
+    self.sent = []
+    self.to_receive = []
+    FakeConnection.relays[relay] = self
+
+  def send(self, msg):
+    if not self.connected:
+      raise ConnectionClosed(None, None)
+    self.sent.append(json_loads(msg))
 
-  @classmethod
-  def recv(cls, timeout=None):
+  def recv(self, timeout=None):
+    assert self.connected
     assert timeout == HTTP_TIMEOUT
 
-    if not cls.to_receive:
+    if not self.to_receive:
+      self.connected = False
       raise ConnectionClosed(None, None)
 
-    return json_dumps(cls.to_receive.pop(0))
+    return json_dumps(self.to_receive.pop(0))
+
+  def close(self):
+    self.connected = False
 
 
-@contextmanager
 def fake_connect(uri, open_timeout=None, close_timeout=None):
   """Fake of :func:`websockets.sync.client.connect`."""
   assert open_timeout == HTTP_TIMEOUT
   assert close_timeout == HTTP_TIMEOUT
-  FakeConnection.relay = uri
-  yield FakeConnection
+  conn = FakeConnection.relays[uri]
+  conn.connected = True
+  return conn
 
 
 class NostrTest(testutil.TestCase):
@@ -74,6 +104,60 @@ class NostrTest(testutil.TestCase):
         'content': 'My plain text',
     }))
 
+  def test_ids_for(self):
+    event = {
+      'pubkey': 'fed987',
+      'created_at': NOW_TS,
+      'kind': 1,
+      'content': 'My plain text',
+    }
+    self.assertEqual([
+      '9adfa2330b391539f46548ff2e088ea964a2f7374898c7335a86e914cbf2e769',
+      SIGNED_NOSTR['id'],
+    ], ids_for([event, SIGNED_NOSTR]))
+    self.assertNotIn('tags', event)
+
+  def test_verify_events(self):
+    self.assertEqual([True, False, False, False, False], verify_events([
+      SIGNED_NOSTR,
+      {**SIGNED_NOSTR, 'content': 'changed'},
+      {**SIGNED_NOSTR, 'sig': SIGNED_NOSTR['sig'].replace('d', 'e', 1)},
+      {**SIGNED_NOSTR, 'sig': 'abc'},
+      {**SIGNED_NOSTR, 'sig': None},
+    ]))
+
+  def test_verify_events_pure_python(self):
+    self.mox.stubs.Set(nostr, 'coincurve', None)
+    self.test_verify_events()
+
+  def test_verify_sig(self):
+    id = bytes.fromhex(SIGNED_NOSTR['id'])
+    pubkey = SIGNED_NOSTR['pubkey']
+    sig = SIGNED_NOSTR['sig']
+
+    for coincurve in nostr.coincurve, None:
+      with self.subTest(coincurve=coincurve):
+        self.mox.stubs.Set(nostr, 'coincurve', coincurve)
+        self.assertTrue(nostr.verify_sig(id, pubkey, sig))
+        self.assertFalse(nostr.verify_sig(b'x' * 32, pubkey, sig))
+        self.assertFalse(nostr.verify_sig(id, pubkey, sig.replace('d', 'e', 1)))
+        self.assertFalse(nostr.verify_sig(id, 'ff' * 32, sig))
+        self.assertFalse(nostr.verify_sig(id, pubkey[:10], sig))
+
+  def test_verify_events_without_sigs(self):
+    self.assertEqual([True, True, False], verify_events([
+      SIGNED_NOSTR,
+      {**SIGNED_NOSTR, 'sig': None},
+      {**SIGNED_NOSTR, 'id': '12ab'},
+    ], check_sigs=False))
+
+  def test_verify_events_processes(self):
+    self.mox.stubs.Set(nostr, 'VERIFY_CHUNK_SIZE', 2)
+    bad = {**SIGNED_NOSTR, 'content': 'changed'}
+    self.assertEqual([True, False, True, True, False],
+                     verify_events([SIGNED_NOSTR, bad, SIGNED_NOSTR,
+                                    SIGNED_NOSTR, bad], processes=2))
+
   def test_id_to_uri(self):
     self.assertEqual(URI, id_to_uri('npub', ID))
 
@@ -445,20 +529,20 @@ class GetActivitiesTest(testutil.TestCase):
     self.last_token = 0
     self.mox.stubs.Set(secrets, 'token_urlsafe', self.token)
 
-    FakeConnection.relay = None
-    FakeConnection.sent = []
-    FakeConnection.to_receive = []
+    FakeConnection.relays = {}
+    self.relay = FakeConnection('ws://relay')
 
     nostr.connect = fake_connect
 
-    self.nostr = nostr.Nostr(['ws://relay'])
+    self.pool = nostr.RelayPool()
+    self.nostr = nostr.Nostr(['ws://relay'], pool=self.pool)
 
   def token(self, length):
     self.last_token += 1
     return f'towkin {self.last_token}'
 
   def test_activity_id(self):
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['EVENT', 'towkin 1', NOTE_NOSTR],
       ['EOSE', 'towkin 1'],
       ['not', 'reached']
@@ -467,12 +551,11 @@ class GetActivitiesTest(testutil.TestCase):
     self.assert_equals([NOTE_AS1],
                        self.nostr.get_activities(activity_id='ab12'))
 
-    self.assertEqual('ws://relay', FakeConnection.relay)
     self.assertEqual([
       ['REQ', 'towkin 1', {'ids': ['ab12'], 'limit': 20}],
       ['CLOSE', 'towkin 1'],
-    ], FakeConnection.sent)
-    self.assertEqual([['not', 'reached']], FakeConnection.to_receive)
+    ], self.relay.sent)
+    self.assertEqual([['not', 'reached']], self.relay.to_receive)
 
   def test_user_id(self):
     events = [{
@@ -486,24 +569,27 @@ class GetActivitiesTest(testutil.TestCase):
       'content': f"It's {i}",
     } for i in range(3)]
 
-    FakeConnection.to_receive = [['EVENT', 'towkin 1', e] for e in events]
+    self.relay.to_receive = [['EVENT', 'towkin 1', e] for e in events]
 
     self.assert_equals(notes, self.nostr.get_activities(user_id='ab12', count=3))
     self.assertEqual([
       ['REQ', 'towkin 1', {'authors': ['ab12'], 'limit': 3}],
       ['CLOSE', 'towkin 1'],
-    ], FakeConnection.sent)
-    self.assertEqual([], FakeConnection.to_receive)
+    ], self.relay.sent)
+    self.assertEqual([], self.relay.to_receive)
 
   def test_search(self):
-    FakeConnection.to_receive = [['EVENT', 'towkin 1', NOTE_NOSTR]]
+    self.relay.to_receive = [
+      ['EVENT', 'towkin 1', NOTE_NOSTR],
+      ['EOSE', 'towkin 1'],
+    ]
 
     self.assert_equals([NOTE_AS1],
                        self.nostr.get_activities(search_query='surch'))
     self.assertEqual([
       ['REQ', 'towkin 1', {'search': 'surch', 'limit': 20}],
       ['CLOSE', 'towkin 1'],
-    ], FakeConnection.sent)
+    ], self.relay.sent)
 
   def test_fetch_replies(self):
     reply_nostr = {
@@ -520,27 +606,29 @@ class GetActivitiesTest(testutil.TestCase):
       'content': 'I hereby reply',
       'inReplyTo': 'nostr:nevent1z24spd6d40',
     }
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['EVENT', 'towkin 1', NOTE_NOSTR],
       ['EVENT', 'towkin 1', {**NOTE_NOSTR, 'id': '98fe'}],
       ['EOSE', 'towkin 1'],
       ['EVENT', 'towkin 2', reply_nostr],
-      ['EVENT', 'towkin 2', reply_nostr],
+      ['EVENT', 'towkin 2', {**reply_nostr, 'id': '56ef'}],
       ['EOSE', 'towkin 2'],
     ]
 
     self.assert_equals([
-      {**NOTE_AS1, 'replies': {'totalItems': 2, 'items': [reply_as1] * 2}},
+      {**NOTE_AS1, 'replies': {'totalItems': 2, 'items': [
+        reply_as1,
+        {**reply_as1, 'id': id_to_uri('note', '56ef')},
+      ]}},
       {**NOTE_AS1, 'id': 'nostr:note1nrlq0mz6g2'},
     ], self.nostr.get_activities(user_id='98fe', fetch_replies=True))
 
-    self.assertEqual('ws://relay', FakeConnection.relay)
     self.assertEqual([
       ['REQ', 'towkin 1', {'authors': ['98fe'], 'limit': 20}],
       ['CLOSE', 'towkin 1'],
       ['REQ', 'towkin 2', {'#e': ['12ab', '98fe'], 'limit': 20}],
       ['CLOSE', 'towkin 2'],
-    ], FakeConnection.sent)
+    ], self.relay.sent)
 
   def test_fetch_shares(self):
     repost_nostr = {
@@ -557,46 +645,185 @@ class GetActivitiesTest(testutil.TestCase):
       'object': 'nostr:note1z24swknlsf',
     }
 
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['EVENT', 'towkin 1', NOTE_NOSTR],
       ['EOSE', 'towkin 1'],
       ['EVENT', 'towkin 2', repost_nostr],
-      ['EVENT', 'towkin 2', repost_nostr],
+      ['EVENT', 'towkin 2', {**repost_nostr, 'id': '56ef'}],
       ['EOSE', 'towkin 2'],
     ]
 
     self.assert_equals([
-      {**NOTE_AS1, 'tags': [repost_as1, repost_as1]},
+      {**NOTE_AS1, 'tags': [
+        repost_as1,
+        {**repost_as1, 'id': id_to_uri('nevent', '56ef')},
+      ]},
     ], self.nostr.get_activities(user_id='98fe', fetch_shares=True))
 
-    self.assertEqual('ws://relay', FakeConnection.relay)
     self.assertEqual([
       ['REQ', 'towkin 1', {'authors': ['98fe'], 'limit': 20}],
       ['CLOSE', 'towkin 1'],
       ['REQ', 'towkin 2', {'#e': ['12ab'], 'limit': 20}],
       ['CLOSE', 'towkin 2'],
-    ], FakeConnection.sent)
+    ], self.relay.sent)
+
+  def test_connection_reused_across_calls(self):
+    self.relay.to_receive = [
+      ['EVENT', 'towkin 1', NOTE_NOSTR],
+      ['EOSE', 'towkin 1'],
+      ['EVENT', 'towkin 2', NOTE_NOSTR],
+      ['EOSE', 'towkin 2'],
+    ]
+
+    connects = []
+    def connect(*args, **kwargs):
+      connects.append(args)
+      return fake_connect(*args, **kwargs)
+    nostr.connect = connect
+
+    other = nostr.Nostr(['ws://relay'], pool=self.pool)
+    self.assert_equals([NOTE_AS1], self.nostr.get_activities(activity_id='12ab'))
+    self.assert_equals([NOTE_AS1], other.get_activities(activity_id='12ab'))
+    self.assertEqual([('ws://relay',)], connects)
+
+  def test_multiplex_subscriptions(self):
+    relay = self.pool.relay('ws://relay')
+    relay.subscribe('a')
+    relay.subscribe('b')
+    self.assertTrue(relay.send(['REQ', 'a', {}]))
+
+    self.relay.to_receive = [
+      ['EVENT', 'b', NOTE_NOSTR],
+      ['NOTICE', 'hi'],
+      ['EVENT', 'x', NOTE_NOSTR],
+      ['EOSE', 'a'],
+      ['EOSE', 'b'],
+    ]
+    self.assertEqual(['EOSE', 'a'], relay.recv('a'))
+    self.assertEqual(['EVENT', 'b', NOTE_NOSTR], relay.recv('b'))
+    self.assertEqual(['EOSE', 'b'], relay.recv('b'))
+    self.assertIsNone(relay.recv('a'))
+
+  def test_reconnect_after_idle_close(self):
+    self.relay.to_receive = [
+      ['EVENT', 'towkin 1', NOTE_NOSTR],
+      ['EOSE', 'towkin 1'],
+    ]
+    self.assert_equals([NOTE_AS1], self.nostr.get_activities(activity_id='12ab'))
+
+    # relay drops the idle connection
+    self.relay.connected = False
+    self.relay.to_receive = [
+      ['EVENT', 'towkin 2', NOTE_NOSTR],
+      ['EOSE', 'towkin 2'],
+    ]
+    self.assert_equals([NOTE_AS1], self.nostr.get_activities(activity_id='12ab'))
+    self.assertEqual(['REQ', 'towkin 2', {'ids': ['12ab'], 'limit': 20}],
+                     self.relay.sent[2])
+
+  def test_recv_doesnt_block_other_subscriptions(self):
+    relay = self.pool.relay('ws://relay')
+    relay.subscribe('a')
+    relay.subscribe('b')
+    self.assertTrue(relay.send(['REQ', 'a', {}]))
+
+    # the first read gets b's event, the second blocks until we release it
+    reading = threading.Event()
+    release = threading.Event()
+    to_receive = [['EVENT', 'b', NOTE_NOSTR], ['EOSE', 'a']]
+    def recv(timeout=None):
+      if len(to_receive) == 1:
+        reading.set()
+        assert release.wait(5)
+      return json_dumps(to_receive.pop(0))
+    self.relay.recv = recv
+
+    got_a = []
+    thread = threading.Thread(target=lambda: got_a.append(relay.recv('a')))
+    thread.start()
+    self.assertTrue(reading.wait(5))
+
+    # a's thread is blocked on the socket, but b can still get its message
+    self.assertEqual(['EVENT', 'b', NOTE_NOSTR], relay.recv('b'))
+    release.set()
+    thread.join(5)
+    self.assertEqual([['EOSE', 'a']], got_a)
+
+  def test_query_multiple_relays_one_unreachable(self):
+    FakeConnection('ws://other')
+    self.nostr = nostr.Nostr(['ws://other', 'ws://relay'], pool=self.pool)
+
+    def connect(uri, **kwargs):
+      if uri == 'ws://other':
+        raise ConnectionRefusedError('nope')
+      return fake_connect(uri, **kwargs)
+    nostr.connect = connect
+
+    self.relay.to_receive = [
+      ['EVENT', 'towkin 1', NOTE_NOSTR],
+      ['EOSE', 'towkin 1'],
+      ['OK', NOTE_NOSTR['id'], True],
+    ]
+    self.assert_equals([NOTE_AS1], self.nostr.get_activities(user_id='98fe'))
+    self.assertEqual([['OK', NOTE_NOSTR['id'], True]],
+                     self.pool.publish(['ws://other', 'ws://relay'], NOTE_NOSTR))
+
+  def test_multiple_relays_merge_and_dedupe(self):
+    other = FakeConnection('ws://other')
+    self.nostr = nostr.Nostr(['ws://relay', 'ws://other'], pool=self.pool)
+
+    note_2 = {**NOTE_NOSTR, 'id': '34cd'}
+    self.relay.to_receive = [
+      ['EVENT', 'towkin 1', NOTE_NOSTR],
+      ['EOSE', 'towkin 1'],
+    ]
+    other.to_receive = [
+      ['EVENT', 'towkin 1', note_2],
+      ['EVENT', 'towkin 1', NOTE_NOSTR],
+      ['EOSE', 'towkin 1'],
+    ]
+
+    self.assert_equals([NOTE_AS1, {**NOTE_AS1, 'id': id_to_uri('note', '34cd')}],
+                       self.nostr.get_activities(user_id='98fe'), in_order=True)
+
+    for conn in self.relay, other:
+      self.assertEqual([
+        ['REQ', 'towkin 1', {'authors': ['98fe'], 'limit': 20}],
+        ['CLOSE', 'towkin 1'],
+      ], conn.sent)
+
+  def test_create_note_multiple_relays_one_fails(self):
+    other = FakeConnection('ws://other')
+    self.nostr = nostr.Nostr(['ws://relay', 'ws://other'], pool=self.pool)
+
+    self.relay.to_receive = [['OK', NOTE_NOSTR['id'], False, 'nope']]
+    other.to_receive = [['OK', NOTE_NOSTR['id'], True]]
+
+    result = self.nostr.create(NOTE_AS1)
+    self.assert_equals(NOTE_NOSTR, result.content)
+    self.assertEqual([['EVENT', NOTE_NOSTR]], self.relay.sent)
+    self.assertEqual([['EVENT', NOTE_NOSTR]], other.sent)
 
   def test_ok_false_closes_query(self):
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['OK', 'towkin 1', False],
       ['EVENT', 'towkin 1', NOTE_NOSTR],
     ]
 
     self.assert_equals([], self.nostr.get_activities())
-    self.assertEqual([['EVENT', 'towkin 1', NOTE_NOSTR]], FakeConnection.to_receive)
+    self.assertEqual([['EVENT', 'towkin 1', NOTE_NOSTR]], self.relay.to_receive)
 
   def test_create_note(self):
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['OK', NOTE_NOSTR['id'], True],
     ]
 
     result = self.nostr.create(NOTE_AS1)
     self.assert_equals(NOTE_NOSTR, result.content)
-    self.assertEqual([['EVENT', NOTE_NOSTR]], FakeConnection.sent)
+    self.assertEqual([['EVENT', NOTE_NOSTR]], self.relay.sent)
 
   def test_create_note_ok_false(self):
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['OK', NOTE_NOSTR['id'], False, 'foo bar'],
     ]
 
@@ -620,7 +847,7 @@ class GetActivitiesTest(testutil.TestCase):
       'displayName': 'Alice',
       'username': 'alice.com',
     }
-    FakeConnection.to_receive = [
+    self.relay.to_receive = [
       ['EVENT', 'towkin 1', profile],
       ['EOSE', 'towkin 1'],
     ]
@@ -629,4 +856,4 @@ class GetActivitiesTest(testutil.TestCase):
     self.assertEqual([
       ['REQ', 'towkin 1', {'authors': ['12ab'], 'kinds': [0], 'limit': 20}],
       ['CLOSE', 'towkin 1'],
-    ], FakeConnection.sent)
+    ], self.relay.sent)
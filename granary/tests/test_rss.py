@@ -1,4 +1,9 @@
 """Unit tests for rss.py."""
+import io
+from unittest.mock import patch
+from xml.etree import ElementTree
+
+import feedparser
 from oauth_dropins.webutil import testutil
 
 from .. import rss
@@ -167,3 +172,80 @@ The original post]]></description>
       {'content': 'second'},
     ], feed_url='http://this')
     self.assertLess(got.find('<title>first</title>'), got.find('<title>second</title>'))
+
+  def test_iter_activities(self):
+    feed = rss.from_activities([
+      {'content': 'first', 'author': {'displayName': 'Ms Alice'}},
+      {'content': 'second'},
+      {'content': 'third'},
+    ], actor={'displayName': 'Mr Bob'}, title='Stuff', feed_url='http://this')
+    expected = rss.to_activities(feed)
+    self.assertEqual(3, len(expected))
+
+    self.assert_equals(expected, list(rss.iter_activities(feed)))
+    self.assert_equals(expected, list(rss.iter_activities(io.BytesIO(
+      feed.encode()), chunk_size=10)))
+    self.assert_equals(expected[:2], list(rss.iter_activities(feed, count=2)))
+    self.assert_equals([], list(rss.iter_activities(feed, count=0)))
+
+  def test_iter_activities_count(self):
+    chunks = iter([
+      b'<rss version="2.0"><channel><title>Stuff</title>',
+      b'<item><description>first</description></item>',
+      b'<item><description>second</description></item>',
+      b'</channel></rss>',
+    ])
+    with patch.object(feedparser, 'parse', wraps=feedparser.parse) as parse:
+      self.assert_equals([{
+        'objectType': 'activity',
+        'verb': 'post',
+        'actor': {'displayName': 'Stuff'},
+        'object': {
+          'objectType': 'article',
+          'content': 'first',
+          'author': {'displayName': 'Stuff'},
+        },
+      }], list(rss.iter_activities(chunks, count=1)))
+    self.assertEqual(1, parse.call_count)
+
+    # stopped reading after the first item
+    self.assertEqual(b'<item><description>second</description></item>',
+                     next(chunks))
+
+  def test_iter_activities_converts_items_as_they_arrive(self):
+    def chunks():
+      yield b'<rss version="2.0"><channel><title>Stuff</title>'
+      yield b'<item><description>first</description></item>'
+      raise AssertionError('read past the first item')
+
+    self.assert_equals('first', next(rss.iter_activities(chunks()))['object']['content'])
+
+  def test_iter_activities_channel_elements_after_items(self):
+    """Channel-level elements after the first item are ignored."""
+    feed = b"""\
+<rss version="2.0"><channel>
+<title>Stuff</title>
+<item><description>first</description></item>
+<link>http://this</link>
+<item><description>second</description></item>
+</channel></rss>"""
+    got = list(rss.iter_activities(io.BytesIO(feed), chunk_size=10))
+    self.assert_equals(['first', 'second'],
+                       [a['object']['content'] for a in got])
+    for activity in got:
+      self.assert_equals({'displayName': 'Stuff'}, activity['actor'])
+
+  def test_iter_activities_not_well_formed(self):
+    """Falls back to feedparser, which tolerates eg undeclared entities."""
+    self.assert_equals([{
+      'objectType': 'activity',
+      'verb': 'post',
+      'object': {'objectType': 'article', 'content': 'a\xa0b'},
+    }], list(rss.iter_activities(
+      b'<rss><channel><item><description>a&nbsp;b</description></item></channel></rss>')))
+
+  def test_iter_activities_not_well_formed_streamed(self):
+    """Streamed feeds aren't kept in memory, so they can't fall back."""
+    feed = b'<rss><channel><item><description>a&nbsp;b</description></item></channel></rss>'
+    with self.assertRaises(ElementTree.ParseError):
+      list(rss.iter_activities(io.BytesIO(feed), chunk_size=10))
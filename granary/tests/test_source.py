@@ -1,9 +1,19 @@
 """Unit tests for source.py."""
 import copy
+from datetime import timedelta
+import hashlib
+import io
+import os
 import re
+import struct
+import tempfile
+import threading
+from unittest.mock import patch
+import urllib.error
 
 from oauth_dropins.webutil import testutil
 from oauth_dropins.webutil import util
+import requests
 
 from .. import facebook
 from .. import instagram
@@ -367,7 +377,345 @@ Watching  \t waves
       'content': 'hi <a href="http://foo">@foo@bar</a>',
     }))
 
+  def test_postprocess_object_parses_content_once(self):
+    source._parsed_html.__dict__.clear()
+    content = 'hi <a href="http://foo">@foo@bar</a>'
+    with patch.object(util, 'parse_html', wraps=util.parse_html) as parse:
+      for _ in range(3):
+        Source.postprocess_object({'content': content})
+      # no links, no need to parse
+      Source.postprocess_object({'content': 'hi @foo@bar'})
+
+    parse.assert_called_once_with(content)
+
+  def test_cached_parse_html_skips_long_html(self):
+    source._parsed_html.__dict__.clear()
+    short = '<p>hi</p>'
+    long = '<p>' + 'x' * source.HTML_CACHE_MAX_LENGTH + '</p>'
+    self.assertIs(source.cached_parse_html(short),
+                  source.cached_parse_html(short))
+    self.assertIsNot(source.cached_parse_html(long),
+                     source.cached_parse_html(long))
+    self.assertEqual([short], list(source._parsed_html.cache))
+
+  def test_cached_parse_html_per_thread(self):
+    source._parsed_html.__dict__.clear()
+    html = '<p>hi</p>'
+    soups = [source.cached_parse_html(html)]
+    thread = threading.Thread(
+      target=lambda: soups.append(source.cached_parse_html(html)))
+    thread.start()
+    thread.join()
+    self.assertIsNot(soups[0], soups[1])
+
+  def test_content_for_create_doesnt_modify_cached_soup(self):
+    source._parsed_html.__dict__.clear()
+    content = '<video class="u-video"><a href="xyz">a video</a></video>Waves.'
+    self.assertEqual('Waves.', self.source._content_for_create(
+      {'content': content}, strip_first_video_tag=True))
+    self.assertIsNotNone(source.cached_parse_html(content).video)
+    self.assertEqual('Waves.', self.source._content_for_create(
+      {'content': content}, strip_first_video_tag=True))
 
   def test_html_to_text_empty(self):
     self.assertEqual('', html_to_text(None))
     self.assertEqual('', html_to_text(''))
+
+  def test_html_to_text_skips_cache_for_long_html(self):
+    source._html_to_text.cache_clear()
+    short = '<p>hi</p>'
+    long = '<p>' + 'x' * source.HTML_CACHE_MAX_LENGTH + '</p>'
+    self.assertEqual('hi', html_to_text(short))
+    self.assertEqual('x' * source.HTML_CACHE_MAX_LENGTH, html_to_text(long))
+    self.assertEqual(1, source._html_to_text.cache_info().currsize)
+
+  def test_run_concurrently(self):
+    calls = [lambda i=i: i * 2 for i in range(5)]
+    self.assertEqual([0, 2, 4, 6, 8], source.run_concurrently(calls))
+    self.assertEqual([0, 2, 4, 6, 8], source.run_concurrently(calls, threads=3))
+    self.assertEqual([], source.run_concurrently([], threads=3))
+
+  def test_run_concurrently_raises(self):
+    def fail():
+      raise ValueError('foo')
+
+    for threads in None, 2:
+      with self.assertRaises(ValueError):
+        source.run_concurrently([lambda: 1, fail, lambda: 3], threads=threads)
+
+  def test_run_chunked(self):
+    def fn(i, chunk):
+      return i, chunk.read()
+
+    for threads in None, 2:
+      self.assertEqual([(0, b'abc'), (1, b'def'), (2, b'g')], source.run_chunked(
+        io.BytesIO(b'abcdefg'), 3, fn, threads=threads))
+      self.assertEqual([(0, b'abc'), (1, b'def')], source.run_chunked(
+        io.BytesIO(b'abcdef'), 3, fn, threads=threads))
+      self.assertEqual([(0, b'')], source.run_chunked(
+        io.BytesIO(b''), 3, fn, threads=threads))
+
+  def test_http_sessions(self):
+    self.assertIsNone(source.http_session('https://foo.com/bar'))
+
+    source.enable_http_sessions(pool_size=3, timeout=7)
+    self.addCleanup(source.disable_http_sessions)
+
+    foo = source.http_session('https://foo.com/bar')
+    self.assertIs(foo, source.http_session('https://foo.com/baz?x=y'))
+    self.assertIsNot(foo, source.http_session('http://foo.com/bar'))
+    self.assertIsNot(foo, source.http_session('https://bar.com/'))
+    self.assertEqual(7, foo.timeout)
+    self.assertEqual(3, foo.get_adapter('https://foo.com/')._pool_maxsize)
+
+    source.disable_http_sessions()
+    self.assertIsNone(source.http_session('https://foo.com/bar'))
+
+  def test_cached_conversion(self):
+    calls = []
+    def convert(obj, suffix=''):
+      calls.append(obj)
+      return {'x': obj['a'] + suffix}
+
+    # disabled
+    self.assertEqual({'x': 'b'}, source.cached_conversion(convert, {'a': 'b'}))
+    self.assertEqual({'x': 'b'}, source.cached_conversion(convert, {'a': 'b'}))
+    self.assertEqual(2, len(calls))
+
+    source.enable_conversion_cache()
+    self.addCleanup(source.disable_conversion_cache)
+    calls.clear()
+
+    got = source.cached_conversion(convert, {'a': 'b', 'c': 'd'})
+    self.assertEqual({'x': 'b'}, got)
+    got['x'] = 'modified'
+    self.assertEqual({'x': 'b'}, source.cached_conversion(
+      convert, {'c': 'd', 'a': 'b'}))
+    self.assertEqual(1, len(calls))
+
+    # different kwargs
+    self.assertEqual({'x': 'b!'}, source.cached_conversion(
+      convert, {'a': 'b', 'c': 'd'}, suffix='!'))
+    self.assertEqual(2, len(calls))
+
+  def test_conversion_cache_evicts_lru_by_size(self):
+    cache = source.ConversionCache(max_size=10)
+    cache.set('a', '1234')
+    cache.set('b', '5678')
+    self.assertEqual('1234', cache.get('a'))
+    cache.set('c', '90')
+    self.assertEqual(10, cache.size)
+    cache.set('d', 'xy')
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual('1234', cache.get('a'))
+    self.assertEqual('xy', cache.get('d'))
+
+    cache.set('e', 'too long to cache')
+    self.assertIsNone(cache.get('e'))
+
+  def test_file_conversion_cache(self):
+    with tempfile.TemporaryDirectory() as dir:
+      files = source.FileConversionCache(dir)
+      source.enable_conversion_cache(backend=files)
+      self.addCleanup(source.disable_conversion_cache)
+
+      calls = []
+      def convert(obj):
+        calls.append(obj)
+        return {'x': obj['a']}
+
+      self.assertEqual({'x': 'b'}, source.cached_conversion(convert, {'a': 'b'}))
+
+      # new in-memory cache, same backend
+      source.enable_conversion_cache(backend=files)
+      self.assertEqual({'x': 'b'}, source.cached_conversion(convert, {'a': 'b'}))
+      self.assertEqual(1, len(calls))
+
+  def test_image_dimensions(self):
+    png = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + struct.pack('>II', 3, 2)
+    self.assertEqual((3, 2), source.image_dimensions(io.BytesIO(png)))
+
+    gif = b'GIF89a' + struct.pack('<HH', 4, 5) + b'\x00' * 20
+    self.assertEqual((4, 5), source.image_dimensions(io.BytesIO(gif)))
+
+    jpeg = (b'\xff\xd8\xff\xe0\x00\x04xx'  # APP0
+            b'\xff\xc0\x00\x11\x08' + struct.pack('>HH', 7, 6) + b'\x00' * 20)
+    self.assertEqual((6, 7), source.image_dimensions(io.BytesIO(jpeg)))
+
+    self.assertIsNone(source.image_dimensions(io.BytesIO(b'not an image')))
+    self.assertIsNone(source.image_dimensions(io.BytesIO(b'\xff\xd8\xff')))
+
+  def test_media_cache(self):
+    png = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + struct.pack('>II', 3, 2)
+    self.expect_requests_get('http://pic/a', png, content_type='image/png',
+                             response_headers={'ETag': '"abc"'})
+    self.expect_requests_get('http://pic/b', png, content_type='None')
+    # revalidate after max_age
+    self.expect_requests_get('http://pic/a', '', status_code=304,
+                             headers={'If-None-Match': '"abc"'})
+    self.mox.ReplayAll()
+
+    with tempfile.TemporaryDirectory() as dir:
+      source.enable_media_cache(dir, max_age=60)
+      self.addCleanup(source.disable_media_cache)
+
+      for _ in range(2):
+        with source.fetch_media('http://pic/a') as media:
+          self.assertEqual(png, media.read())
+          self.assertEqual({'Content-Type': 'image/png',
+                            'Content-Length': str(len(png))}, media.headers)
+          self.assertEqual((3, 2), (media.width, media.height))
+
+      # same contents, different URL, no Content-Type or file extension
+      with source.fetch_media('http://pic/b') as media:
+        self.assertEqual(png, media.read())
+        self.assertIsNone(media.content_type)
+      self.assertEqual(1, len(os.listdir(os.path.join(dir, 'files'))))
+
+      util.now = lambda **kwargs: testutil.NOW + timedelta(seconds=61)
+      with source.fetch_media('http://pic/a') as media:
+        self.assertEqual(png, media.read())
+
+  def test_media_cache_evicts_lru_by_size(self):
+    for url in 'http://a', 'http://b', 'http://c', 'http://a':
+      self.expect_requests_get(url, url[-1] * 4)
+    self.mox.ReplayAll()
+
+    with tempfile.TemporaryDirectory() as dir:
+      cache = source.MediaCache(dir, max_size=10)
+      for url in 'http://a', 'http://b':
+        cache.fetch(url).close()
+
+      # make a least recently used
+      os.utime(cache._file_path(hashlib.sha256(b'aaaa').hexdigest()), (0, 0))
+      cache.fetch('http://c').close()
+      # a was evicted, so it's fetched again
+      with cache.fetch('http://a') as media:
+        self.assertEqual(b'aaaa', media.read())
+
+  def test_media_cache_too_big(self):
+    self.expect_requests_get('http://a', 'x' * 20)
+    self.mox.ReplayAll()
+
+    with tempfile.TemporaryDirectory() as dir:
+      cache = source.MediaCache(dir, max_size=10)
+      with cache.fetch('http://a') as media:
+        self.assertEqual(b'x' * 20, media.read())
+        self.assertEqual(20, media.length)
+      self.assertEqual([], os.listdir(os.path.join(dir, 'files')))
+      self.assertEqual(['files', 'urls'], sorted(os.listdir(dir)))
+
+  def test_rate_limiter_learns_from_headers(self):
+    limiter = source.RateLimiter(max_wait=120)
+    key = ('silo', 'endpoint', 'token')
+    limiter.acquire(key)  # unknown bucket, no-op
+    self.assertIsNone(limiter.remaining(key))
+
+    reset = testutil.NOW.timestamp() + 60
+    limiter.update(key, {
+      'X-Rate-Limit-Limit': '15',
+      'X-Rate-Limit-Remaining': '1',
+      'X-Rate-Limit-Reset': str(int(reset)),
+    })
+    self.assertEqual(1, limiter.remaining(key))
+    limiter.acquire(key)
+    self.assertEqual(0, limiter.remaining(key))
+
+    # next call waits for the window to reset, then the bucket refills
+    sleeps = []
+    def sleep(secs):
+      sleeps.append(secs)
+      util.now = lambda **kwargs: testutil.NOW + timedelta(seconds=61)
+    self.mox.stubs.Set(source, 'sleep_fn', sleep)
+
+    limiter.acquire(key)
+    self.assertEqual([60], sleeps)
+    self.assertEqual(14, limiter.remaining(key))
+
+  def test_rate_limiter_raises_rate_limited(self):
+    limiter = source.RateLimiter(max_wait=10)
+    key = ('silo', 'endpoint', 'token')
+    # Mastodon style ISO 8601 reset
+    limiter.update(key, {
+      'X-RateLimit-Limit': '300',
+      'X-RateLimit-Remaining': '0',
+      'X-RateLimit-Reset': (testutil.NOW + timedelta(minutes=5)).isoformat(),
+    })
+    with self.assertRaises(source.RateLimited):
+      limiter.acquire(key)
+
+    # without max_wait, calls aren't held
+    limiter.max_wait = None
+    limiter.acquire(key)
+
+  def test_rate_limiter_429_retry_after(self):
+    limiter = source.RateLimiter(max_wait=0)
+    key = ('silo', 'endpoint', 'token')
+    limiter.update(key, {'Retry-After': '30'}, status=429)
+    with self.assertRaises(source.RateLimited):
+      limiter.acquire(key)
+
+    util.now = lambda **kwargs: testutil.NOW + timedelta(seconds=31)
+    limiter.acquire(key)
+
+  def test_rate_limiter_set_limit(self):
+    limiter = source.RateLimiter(max_wait=0)
+    key = ('silo', 'endpoint', 'token')
+    limiter.set_limit(key, 2, 60)
+    limiter.acquire(key)
+    limiter.acquire(key)
+    with self.assertRaises(source.RateLimited):
+      limiter.acquire(key)
+
+    # refills continuously
+    util.now = lambda **kwargs: testutil.NOW + timedelta(seconds=30)
+    limiter.acquire(key)
+    with self.assertRaises(source.RateLimited):
+      limiter.acquire(key)
+
+  def test_rate_limiter_evicts_least_recently_used(self):
+    limiter = source.RateLimiter(max_wait=0, max_buckets=2)
+    a, b, c = [('silo', 'endpoint', token) for token in ('a', 'b', 'c')]
+    for key in a, b:
+      limiter.set_limit(key, 1, 60)
+    limiter.acquire(a)  # marks a recently used
+
+    limiter.set_limit(c, 1, 60)
+    self.assertEqual([a, c], list(limiter._buckets))
+    self.assertIsNone(limiter.remaining(b))
+    self.assertEqual(0, limiter.remaining(a))
+
+  def test_rate_limited_call(self):
+    source.configure_rate_limiter(max_wait=0)
+    self.addCleanup(source.configure_rate_limiter)
+    key = ('silo', 'endpoint', 'token')
+
+    self.assertEqual('ok', source.rate_limited_call(key, lambda: 'ok'))
+
+    def raise_429():
+      raise urllib.error.HTTPError('http://x', 429, 'slow down',
+                                   {'Retry-After': '30'}, None)
+    with self.assertRaises(urllib.error.HTTPError):
+      source.rate_limited_call(key, raise_429)
+
+    with self.assertRaises(source.RateLimited):
+      source.rate_limited_call(key, lambda: self.fail('should not be called'))
+
+  def test_rate_limited_call_requests_http_error(self):
+    source.configure_rate_limiter(max_wait=0)
+    self.addCleanup(source.configure_rate_limiter)
+    key = ('silo', 'endpoint', 'token')
+
+    def raise_429():
+      # Bluesky style, no X- prefix
+      testutil.requests_response('', status=429, headers={
+        'RateLimit-Limit': '3000',
+        'RateLimit-Remaining': '0',
+        'RateLimit-Reset': str(int(testutil.NOW.timestamp()) + 300),
+      }).raise_for_status()
+    with self.assertRaises(requests.HTTPError):
+      source.rate_limited_call(key, raise_429)
+
+    self.assertEqual(0, source._rate_limiter.remaining(key))
+    with self.assertRaises(source.RateLimited):
+      source.rate_limited_call(key, lambda: self.fail('should not be called'))
@@ -2,8 +2,11 @@
 from collections import OrderedDict
 import copy
 import http.client
+import os
 import socket
+import tempfile
 import urllib.parse
+from unittest.mock import patch
 
 from mox3 import mox
 from oauth_dropins import twitter_auth
@@ -690,6 +693,12 @@ class TwitterTest(testutil.TestCase):
     twitter_auth.TWITTER_APP_KEY = 'fake'
     twitter_auth.TWITTER_APP_SECRET = 'fake'
     self.twitter = twitter.Twitter('key', 'secret')
+    twitter._mention_memos.clear()
+
+    # webutil's fake urlopen responses don't have close() like real ones
+    closer = patch.object(testutil.UrlopenResult, 'close', create=True)
+    self.closed = closer.start()
+    self.addCleanup(closer.stop)
 
   def expect_urlopen(self, url, response=None, params=None, **kwargs):
     if not url.startswith('http'):
@@ -848,13 +857,126 @@ class TwitterTest(testutil.TestCase):
     search = API_SEARCH + '&since_id=567'
     self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 100},
                         REPLIES_TO_SNARFED)
-    self.expect_urlopen(search % {'q': '%40alice', 'count': 100}, REPLIES_TO_ALICE)
-    self.expect_urlopen(search % {'q': '%40bob', 'count': 100}, REPLIES_TO_BOB)
+    # alice and bob are found in the same round, so they're searched together
+    self.expect_urlopen(search % {'q': '%40alice+OR+%40bob', 'count': 100},
+                        REPLIES_TO_ALICE)
     self.mox.ReplayAll()
 
     self.assert_equals([ACTIVITY_WITH_REPLIES],
                           self.twitter.get_activities(fetch_replies=True, min_id='567'))
 
+  def test_get_activities_fetch_replies_memo(self):
+    search = API_SEARCH + '&since_id=%(since_id)s'
+    self.expect_urlopen(TIMELINE, [TWEET])
+    self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 100,
+                                  'since_id': 50}, REPLIES_TO_SNARFED)
+    self.expect_urlopen(search % {'q': '%40alice+OR+%40bob', 'count': 100,
+                                  'since_id': 50}, REPLIES_TO_ALICE)
+
+    # second poll only searches for tweets newer than the ones we've seen
+    self.expect_urlopen(TIMELINE, [TWEET])
+    self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 100,
+                                  'since_id': 500}, {'statuses': []})
+    self.expect_urlopen(search % {'q': '%40alice+OR+%40bob', 'count': 100,
+                                  'since_id': 400}, {'statuses': []})
+    self.mox.ReplayAll()
+
+    for _ in range(2):
+      self.assert_equals([ACTIVITY_WITH_REPLIES], self.twitter.get_activities(
+        fetch_replies=True, min_id='50'))
+
+    self.assertEqual('500',
+                     twitter._mention_memos['key', 'snarfed_org', '50']['since_id'])
+    self.assertEqual('400',
+                     twitter._mention_memos['key', 'alice', '50']['since_id'])
+
+  def test_get_activities_fetch_replies_memo_bounded(self):
+    self.mox.StubOutWithMock(twitter, '_mention_memos')
+    twitter._mention_memos = twitter.LRUCache(maxsize=1)
+
+    search = API_SEARCH + '&since_id=50'
+    self.expect_urlopen(TIMELINE, [TWEET])
+    self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 100},
+                        REPLIES_TO_SNARFED)
+    self.expect_urlopen(search % {'q': '%40alice+OR+%40bob', 'count': 100},
+                        REPLIES_TO_ALICE)
+    self.mox.ReplayAll()
+
+    self.twitter.get_activities(fetch_replies=True, min_id='50')
+    self.assertEqual(1, len(twitter._mention_memos))
+
+  def test_get_activities_fetch_replies_paginates(self):
+    self.mox.StubOutWithMock(twitter, 'REPLY_SEARCH_PAGE_SIZE')
+    twitter.REPLY_SEARCH_PAGE_SIZE = 2
+
+    statuses = REPLIES_TO_SNARFED['statuses']
+    search = API_SEARCH + '&since_id=50'
+    self.expect_urlopen(TIMELINE, [TWEET])
+    # first page is full, so we keep going back until we reach since_id
+    self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 2},
+                        {'statuses': [statuses[2], statuses[1]]})
+    self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 2} + '&max_id=299',
+                        {'statuses': [statuses[0]]})
+    self.expect_urlopen(search % {'q': '%40bob+OR+%40alice', 'count': 2},
+                        REPLIES_TO_ALICE)
+    self.mox.ReplayAll()
+
+    got = self.twitter.get_activities(fetch_replies=True, min_id='50')
+    self.assertCountEqual([tag_uri(id) for id in ('200', '300', '400', '500')],
+                          [r['id'] for r in got[0]['object']['replies']['items']])
+    self.assertEqual('500',
+                     twitter._mention_memos['key', 'snarfed_org', '50']['since_id'])
+
+  def test_get_activities_fetch_replies_paginate_hits_limit(self):
+    self.mox.StubOutWithMock(twitter, 'REPLY_SEARCH_PAGE_SIZE')
+    twitter.REPLY_SEARCH_PAGE_SIZE = 2
+    self.mox.StubOutWithMock(twitter, 'REPLY_SEARCH_LIMIT')
+    twitter.REPLY_SEARCH_LIMIT = 1
+
+    statuses = REPLIES_TO_SNARFED['statuses']
+    self.expect_urlopen(TIMELINE, [TWEET])
+    self.expect_urlopen(API_SEARCH % {'q': '%40snarfed_org', 'count': 2}
+                        + '&since_id=50', {'statuses': [statuses[2], statuses[1]]})
+    self.mox.ReplayAll()
+
+    self.twitter.get_activities(fetch_replies=True, min_id='50')
+    # we didn't reach since_id, so the next call has to search from it again
+    self.assertEqual('50',
+                     twitter._mention_memos['key', 'snarfed_org', '50']['since_id'])
+
+  def test_get_activities_fetch_replies_concurrent(self):
+    self.mox.StubOutWithMock(twitter, 'REPLY_SEARCH_BATCH_SIZE')
+    twitter.REPLY_SEARCH_BATCH_SIZE = 1
+    self.twitter = twitter.Twitter('key', 'secret', threads=2)
+
+    search = API_SEARCH + '&since_id=567'
+    responses = {
+      search % {'q': '%40snarfed_org', 'count': 100}: REPLIES_TO_SNARFED,
+      search % {'q': '%40alice', 'count': 100}: REPLIES_TO_ALICE,
+      search % {'q': '%40bob', 'count': 100}: REPLIES_TO_BOB,
+    }
+
+    # mox isn't thread safe, so mock urlopen instead of the HTTP call
+    with patch.object(twitter.Twitter, 'urlopen',
+                      side_effect=lambda url, **_: responses.pop(url)) as urlopen:
+      self.assert_equals([ACTIVITY_WITH_REPLIES], self.twitter.fetch_replies(
+        [copy.deepcopy(ACTIVITY)], min_id='567'))
+
+    self.assertEqual(3, urlopen.call_count)
+    self.assertEqual({}, responses)
+
+  def test_get_activities_fetch_replies_search_limit(self):
+    self.mox.StubOutWithMock(twitter, 'REPLY_SEARCH_LIMIT')
+    twitter.REPLY_SEARCH_LIMIT = 1
+
+    self.expect_urlopen(TIMELINE, [TWEET])
+    self.expect_urlopen(API_SEARCH % {'q': '%40snarfed_org', 'count': 100},
+                        REPLIES_TO_SNARFED)
+    self.mox.ReplayAll()
+
+    got = self.twitter.get_activities(fetch_replies=True)
+    self.assert_equals(REPLY_OBJS[:2], got[0]['object']['replies']['items'])
+
   def test_get_activities_fetch_mentions(self):
     self.expect_urlopen(TIMELINE, [])
     self.expect_urlopen('account/verify_credentials.json',
@@ -957,6 +1079,30 @@ class TwitterTest(testutil.TestCase):
     self.assert_equals([ACTIVITY_WITH_SHARES],
                           self.twitter.get_activities(fetch_shares=True, min_id='567'))
 
+  def test_get_activities_fetch_shares_rate_limited(self):
+    source.configure_rate_limiter(max_wait=0)
+    self.addCleanup(source.configure_rate_limiter)
+
+    tweets = [copy.deepcopy(TWEET), copy.deepcopy(TWEET)]
+    tweets[0]['id_str'] += '_a'
+    tweets[1]['id_str'] += '_b'
+    for t in tweets:
+      t['retweet_count'] = 1
+
+    self.expect_urlopen(TIMELINE, tweets)
+    # learn from headers that our budget is spent, don't make the second call
+    self.expect_urlopen(API_RETWEETS % '100_a', [], response_headers={
+      'x-rate-limit-limit': '75',
+      'x-rate-limit-remaining': '0',
+      'x-rate-limit-reset': str(int(testutil.NOW.timestamp()) + 900),
+    })
+    self.mox.ReplayAll()
+
+    cache = {}
+    got = self.twitter.get_activities(fetch_shares=True, cache=cache)
+    self.assertEqual(2, len(got))
+    self.assertEqual({'ATR 100_a': 1}, cache)
+
   def test_get_activities_fetch_shares_404s(self):
     tweet = copy.deepcopy(TWEET)
     tweet['retweet_count'] = 1
@@ -2620,6 +2766,92 @@ the caption. extra long so we can check that it accounts for the pic-twitter-com
     self.assert_equals({'url': 'http://posted/picture', 'type': 'post'},
                        self.twitter.create(obj).content)
 
+  def test_upload_images_threads(self):
+    tw = twitter.Twitter('key', 'secret', threads=3)
+    images = [{'url': f'http://my/{i}.png', 'displayName': f'alt {i}'}
+              for i in range(3)]
+
+    def urlopen(url):
+      return testutil.UrlopenResult(200, url[-5], headers={'Content-Length': 1})
+
+    def requests_post(url, files=None, **kwargs):
+      if url == twitter.API_UPLOAD_MEDIA:
+        return testutil.requests_response({'media_id_string': files['media'].read()})
+      return testutil.requests_response('')
+
+    # mox isn't thread safe, so mock the HTTP calls instead
+    with patch.object(util, 'urlopen', side_effect=urlopen), \
+         patch.object(util, 'requests_post', side_effect=requests_post) as post:
+      self.assertEqual(['0', '1', '2'], tw.upload_images(images))
+
+    alts = [call.kwargs['json'] for call in post.call_args_list
+            if call.args[0] == twitter.API_MEDIA_METADATA]
+    self.assertCountEqual([{'media_id': str(i), 'alt_text': {'text': f'alt {i}'}}
+                           for i in range(3)], alts)
+
+  def test_upload_images_bad_image_uploads_nothing(self):
+    # stops fetching at the bad image, and doesn't upload the good one
+    self.expect_urlopen('http://my/0.png', 'picture response',
+                        response_headers={'Content-Length': 3})
+    self.expect_urlopen('http://my/1.tiff', '',
+                        response_headers={'Content-Length': 3})
+    self.mox.ReplayAll()
+
+    got = self.twitter.upload_images([{'url': 'http://my/0.png'},
+                                      {'url': 'http://my/1.tiff'},
+                                      {'url': 'http://my/2.png'}])
+    self.assertTrue(got.abort)
+    self.assertIn('looks like image/tiff', got.error_plain)
+    self.assertEqual(2, self.closed.call_count)
+
+  def test_upload_images_threads_bad_image_uploads_nothing(self):
+    tw = twitter.Twitter('key', 'secret', threads=3)
+
+    def urlopen(url):
+      return testutil.UrlopenResult(200, 'x', headers={'Content-Length': 1})
+
+    with patch.object(util, 'urlopen', side_effect=urlopen) as fetch, \
+         patch.object(util, 'requests_post') as post:
+      got = tw.upload_images([{'url': 'http://my/0.png'},
+                              {'url': 'http://my/1.tiff'}])
+
+    self.assertTrue(got.abort)
+    self.assertEqual(2, fetch.call_count)
+    post.assert_not_called()
+
+  def test_upload_images_media_cache(self):
+    self.expect_requests_get('http://my/picture.png', 'picture response',
+                             content_type='image/png')
+    for id in '1', '2':
+      self.expect_requests_post(twitter.API_UPLOAD_MEDIA,
+                                json_dumps({'media_id_string': id}),
+                                files={'media': b'picture response'},
+                                headers=mox.IgnoreArg())
+    self.mox.ReplayAll()
+
+    with tempfile.TemporaryDirectory() as dir:
+      source.enable_media_cache(dir)
+      self.addCleanup(source.disable_media_cache)
+      for id in '1', '2':
+        self.assertEqual([id], self.twitter.upload_images(
+          [{'url': 'http://my/picture.png'}]))
+
+  def test_upload_images_media_cache_too_big_deletes_temp_file(self):
+    self.mox.StubOutWithMock(twitter, 'MAX_IMAGE_SIZE')
+    twitter.MAX_IMAGE_SIZE = 5
+    self.expect_requests_get('http://my/picture.png', 'x' * 20,
+                             content_type='image/png')
+    self.mox.ReplayAll()
+
+    with tempfile.TemporaryDirectory() as dir:
+      source.enable_media_cache(dir, max_size=10)
+      self.addCleanup(source.disable_media_cache)
+      got = self.twitter.upload_images([{'url': 'http://my/picture.png'}])
+      self.assertTrue(got.abort)
+      # the uncached temp file was closed and deleted
+      self.assertEqual(['files', 'urls'], sorted(os.listdir(dir)))
+      self.assertEqual([], os.listdir(os.path.join(dir, 'files')))
+
   def test_create_with_photo_too_big(self):
     self.expect_urlopen(
       'http://my/picture.png', '',
@@ -2753,7 +2985,7 @@ the caption. extra long so we can check that it accounts for the pic-twitter-com
                         })
 
     twitter.UPLOAD_CHUNK_SIZE = 5
-    for i, chunk in (0, 'video'), (1, ' resp'), (2, 'onse'):
+    for i, chunk in (0, b'video'), (1, b' resp'), (2, b'onse'):
       self.expect_requests_post(
         twitter.API_UPLOAD_MEDIA, '',
         data={'command': 'APPEND', 'media_id': '9', 'segment_index': i},
@@ -2830,7 +3062,7 @@ the caption. extra long so we can check that it accounts for the pic-twitter-com
                         })
 
     twitter.UPLOAD_CHUNK_SIZE = 5
-    for i, chunk in (0, 'video'), (1, ' resp'), (2, 'onse'):
+    for i, chunk in (0, b'video'), (1, b' resp'), (2, b'onse'):
       self.expect_requests_post(
         twitter.API_UPLOAD_MEDIA, '',
         data={'command': 'APPEND', 'media_id': '9', 'segment_index': i},
@@ -2886,6 +3118,8 @@ the caption. extra long so we can check that it accounts for the pic-twitter-com
       for msg in ret.error_plain, ret.error_html:
         self.assertIn('Twitter only supports MP4 videos', msg)
 
+    self.assertEqual(2, self.closed.call_count)
+
   def test_tweet_to_object_archive_date_format(self):
     """Twitter archive created_at values are in a form of ISO 8601."""
     tweet = copy.deepcopy(TWEET)
@@ -9,15 +9,18 @@ https://dev.twitter.com/docs/platform-objects/users
 """
 import collections
 import datetime
+import functools
 import http.client
 import itertools
 import logging
 import mimetypes
 import re
 import socket
+import threading
 import time
 import urllib.parse, urllib.request
 
+from cachetools import LRUCache
 from oauth_dropins import twitter_auth
 from oauth_dropins.webutil import util
 from oauth_dropins.webutil.util import json_dumps, json_loads
@@ -69,6 +72,30 @@ RETWEET_LIMIT = 15
 # Number of IDs to search for at a time
 QUOTE_SEARCH_BATCH_SIZE = 20
 
+# Number of usernames to search for @-mentions of at a time in fetch_replies
+REPLY_SEARCH_BATCH_SIZE = 10
+
+# Don't make more than this many search requests per fetch_replies() call.
+# Search's rate limit is 180 per 15 minute window.
+# https://developer.twitter.com/en/docs/twitter-api/v1/rate-limits
+REPLY_SEARCH_LIMIT = 30
+
+# Max search results to remember per username in fetch_replies's memo
+REPLY_SEARCH_MEMO_SIZE = 100
+
+# Max number of usernames to remember search results for in fetch_replies's
+# memo, across all Twitter instances
+REPLY_SEARCH_MEMO_USERS = 1000
+
+# Search results per page. fetch_replies pages back through full pages until
+# it reaches min_id.
+REPLY_SEARCH_PAGE_SIZE = 100
+
+# fetch_replies's memo of mention searches. maps (access token key, username,
+# min_id) to dict with since_id and statuses.
+_mention_memos = LRUCache(maxsize=REPLY_SEARCH_MEMO_USERS)
+_mention_memos_lock = threading.Lock()
+
 # For read requests only.
 RETRIES = 3
 
@@ -168,7 +195,7 @@ class Twitter(source.Source):
   # TRUNCATE_URL_LENGTH = None
 
   def __init__(self, access_token_key, access_token_secret, username=None,
-               scrape_headers=None):
+               scrape_headers=None, threads=None):
     """Constructor.
 
     Twitter now requires authentication in v1.1 of their API. You can get an
@@ -180,11 +207,16 @@ class Twitter(source.Source):
       username (str): optional, the current user. Used in e.g. preview/create.
       scrape_headers (dict): optional, with string HTTP header keys and values to
         use when scraping likes
+      threads (int): optional, maximum number of concurrent searches to make
+        in :meth:`fetch_replies`, and media uploads and upload chunks to send
+        in :meth:`upload_images` and :meth:`upload_video`. Defaults to making
+        them serially.
     """
     self.access_token_key = access_token_key
     self.access_token_secret = access_token_secret
     self.username = username
     self.scrape_headers = scrape_headers
+    self.threads = threads
 
   def get_actor(self, screen_name=None):
     """Returns a user as a JSON ActivityStreams actor dict.
@@ -377,6 +409,9 @@ class Twitter(source.Source):
 
           try:
             tweet['retweets'] = self.urlopen(url)
+          except source.RateLimited as e:
+            logger.warning(f'{e} with more retweets to fetch! Results will be incomplete!')
+            break
           except urllib.error.URLError as e:
             code, body = util.interpret_http_exception(e)
             try:
@@ -412,8 +447,9 @@ class Twitter(source.Source):
         count = tweet.get('favorite_count')
         if as1.is_public(activity) and count and count != cache.get('ATF ' + id):
           try:
-            resp = util.requests_get(SCRAPE_LIKES_URL % id,
-                                     headers=self.scrape_headers)
+            url = SCRAPE_LIKES_URL % id
+            resp = util.requests_get(url, headers=self.scrape_headers,
+                                     session=source.http_session(url))
             resp.raise_for_status()
           except RequestException as e:
             util.interpret_http_exception(e)  # just log it
@@ -434,63 +470,206 @@ class Twitter(source.Source):
 
     Includes indirect replies ie reply chains, not just direct replies. Searches
     for @-mentions, matches them to the original tweets with
-    ``in_reply_to_status_id_str``, and recurses until it's walked the entire
-    tree.
+    ``in_reply_to_status_id_str``, and repeats for the authors of the replies
+    it finds until it's walked the entire tree.
+
+    Walks all activities' trees together, breadth first. Each round searches
+    for mentions of all new authors at once, :const:`REPLY_SEARCH_BATCH_SIZE`
+    usernames per request, concurrently if ``threads`` was passed to the
+    constructor. Stops after :const:`REPLY_SEARCH_LIMIT` searches.
+
+    Search results are remembered in memory, for up to
+    :const:`REPLY_SEARCH_MEMO_USERS` usernames, so that later calls with the same
+    ``min_id`` only search for new mentions.
 
     Args:
       activities (list of dict)
+      min_id (str): only look for replies with ids greater than this
 
     Returns:
       list of dict: same activities
     """
+    # maps tweet id to list of search result tweets that reply to it
+    children = collections.defaultdict(list)
+    pooled = set()
 
-    # cache searches for @-mentions for individual users. maps username to dict
-    # mapping tweet id to ActivityStreams reply object dict.
-    mentions = {}
-
-    # find replies
+    # for each activity, list of (tweet id, reply activity) and set of seen
+    # tweet ids. seed with the original tweet; we'll filter it out later.
+    trees = []
     for activity in activities:
-      # list of ActivityStreams reply object dict and set of seen activity ids
-      # (tag URIs). seed with the original tweet; we'll filter it out later.
-      replies = [activity]
       _, id = util.parse_tag_uri(activity['id'])
-      seen_ids = set([id])
-
-      for reply in replies:
-        # get mentions of this tweet's author so we can search them for replies to
-        # this tweet. can't use statuses/mentions_timeline because i'd need to
-        # auth as the user being mentioned.
-        # https://dev.twitter.com/docs/api/1.1/get/statuses/mentions_timeline
-        #
-        # note that these HTTP requests are synchronous. you can make async
-        # requests by using urlfetch.fetch() directly, but not with urllib2.
-        # https://developers.google.com/appengine/docs/python/urlfetch/asynchronousrequests
-        author = reply['actor']['username']
-        if author not in mentions:
-          url = API_SEARCH % {
-            'q': urllib.parse.quote_plus('@' + author),
-            'count': 100,
-          }
-          if min_id is not None:
-            url = util.add_query_params(url, {'since_id': min_id})
-          mentions[author] = self.urlopen(url)['statuses']
-
-        # look for replies. add any we find to the end of replies. this makes us
-        # recursively follow reply chains to their end. (python supports
-        # appending to a sequence while you're iterating over it.)
-        for mention in mentions[author]:
-          id = mention['id_str']
-          if (mention.get('in_reply_to_status_id_str') in seen_ids and
-              id not in seen_ids):
-            replies.append(self.tweet_to_activity(mention))
-            seen_ids.add(id)
-
-      items = [r['object'] for r in replies[1:]]  # filter out seed activity
+      trees.append(([(id, activity)], {id}))
+
+    searched = set()
+    budget = REPLY_SEARCH_LIMIT
+    # dict instead of set to keep authors in order
+    frontier = {a['actor']['username']: None for a in activities}
+
+    while frontier and budget > 0:
+      # get mentions of these authors so we can search them for replies to
+      # their tweets. can't use statuses/mentions_timeline because i'd need to
+      # auth as the user being mentioned.
+      # https://dev.twitter.com/docs/api/1.1/get/statuses/mentions_timeline
+      searched.update(frontier)
+      try:
+        mentions, searches = self._search_mentions(list(frontier), min_id,
+                                                   budget)
+      except source.RateLimited as e:
+        logger.warning(f'{e} with more replies to find! Results will be incomplete!')
+        break
+      budget -= searches
+      for mention in mentions:
+        id = mention['id_str']
+        if id not in pooled:
+          pooled.add(id)
+          children[mention.get('in_reply_to_status_id_str')].append(mention)
+
+      # look for replies. add any we find to the end of replies. this makes us
+      # recursively follow reply chains to their end. (python supports
+      # appending to a sequence while you're iterating over it.)
+      frontier = {}
+      for replies, seen_ids in trees:
+        for reply_id, _ in replies:
+          for tweet in children[reply_id]:
+            id = tweet['id_str']
+            if id not in seen_ids:
+              seen_ids.add(id)
+              reply = self.tweet_to_activity(tweet)
+              replies.append((id, reply))
+              author = reply['actor']['username']
+              if author not in searched:
+                frontier[author] = None
+
+    if frontier:
+      logger.warning(f'Stopped early, not searching for replies to '
+                     f'{len(frontier)} more users')
+
+    for activity, (replies, _) in zip(activities, trees):
+      items = [r['object'] for _, r in replies[1:]]  # filter out seed activity
       activity['object']['replies'] = {
         'items': items,
         'totalItems': len(items),
       }
 
+    return activities
+
+  def _search_mentions(self, usernames, min_id, limit):
+    """Searches for @-mentions of users, in batches, using a memo.
+
+    Each username's search results are remembered in a bounded in-memory memo
+    keyed by access token, username, and ``min_id``, along with the newest tweet
+    id seen, so later calls only fetch tweets newer than that.
+
+    If a search fills a whole page, follows it back with ``max_id`` until it
+    reaches the since id, as long as there's ``limit`` left.
+
+    Args:
+      usernames (sequence of str)
+      min_id (str): only return tweets with ids greater than this
+      limit (int): maximum number of search requests to make
+
+    Returns:
+      tuple: (list of dict Twitter API tweets, int number of searches made)
+    """
+    # group usernames by since_id so each batch's results are new to all of them
+    memos = {}
+    by_since = collections.defaultdict(list)
+    with _mention_memos_lock:
+      for username in usernames:
+        memo = memos[username] = _mention_memos.get(
+          (self.access_token_key, username, min_id)) or {
+            'since_id': min_id,
+            'statuses': [],
+          }
+        by_since[memo['since_id']].append(username)
+
+    batches = []
+    for since_id, group in by_since.items():
+      for i in range(0, len(group), REPLY_SEARCH_BATCH_SIZE):
+        batches.append((since_id, group[i:i + REPLY_SEARCH_BATCH_SIZE]))
+    if len(batches) > limit:
+      logger.warning(f'Hit search limit, skipping {len(batches) - limit} of '
+                     f'{len(batches)} searches')
+      batches = batches[:limit]
+
+    # budget for pages after each batch's first
+    extra_pages = limit - len(batches)
+    lock = threading.Lock()
+
+    def search(since_id, batch):
+      """Returns (list of statuses, bool whether we reached since_id, int searches)."""
+      nonlocal extra_pages
+      url = API_SEARCH % {
+        'q': urllib.parse.quote_plus(' OR '.join('@' + u for u in batch)),
+        'count': REPLY_SEARCH_PAGE_SIZE,
+      }
+      if since_id is not None:
+        url = util.add_query_params(url, {'since_id': since_id})
+
+      statuses = []
+      page_url = url
+      searches = 0
+      while True:
+        page = self.urlopen(page_url)['statuses']
+        searches += 1
+        statuses.extend(page)
+        ids = [int(s['id_str']) for s in page if s.get('id_str', '').isdigit()]
+        if since_id is None or len(page) < REPLY_SEARCH_PAGE_SIZE or not ids:
+          return statuses, True, searches
+        with lock:
+          if extra_pages <= 0:
+            logger.warning(f'Hit search limit with more mentions of {batch} to find')
+            return statuses, False, searches
+          extra_pages -= 1
+        page_url = util.add_query_params(url, {'max_id': min(ids) - 1})
+
+    results = source.run_concurrently(
+      [functools.partial(search, since_id, batch) for since_id, batch in batches],
+      threads=self.threads)
+
+    mentions = []
+    total_searches = 0
+    for (since_id, batch), (statuses, complete, searches) in zip(batches, results):
+      total_searches += searches
+      # attribute results to the usernames they mention. if we can't tell,
+      # attribute them to all of the batch's usernames.
+      by_user = {u: [] for u in batch}
+      for status in statuses:
+        matched = [u for u in batch if self._is_mention_of(status, u)] or batch
+        for username in matched:
+          by_user[username].append(status)
+
+      for username, new in by_user.items():
+        memo = memos[username]
+        new_ids = {s.get('id_str') for s in new}
+        statuses = new + [s for s in memo['statuses']
+                          if s.get('id_str') not in new_ids]
+        memo = {
+          'since_id': memo['since_id'],
+          'statuses': statuses[:REPLY_SEARCH_MEMO_SIZE],
+        }
+        ids = [int(s['id_str']) for s in new if s.get('id_str', '').isdigit()]
+        # only move since_id forward if we got everything since the old one.
+        # otherwise we'd skip the tweets between them next time.
+        if ids and complete:
+          memo['since_id'] = str(max(ids + [int(since_id or 0)]))
+        with _mention_memos_lock:
+          _mention_memos[(self.access_token_key, username, min_id)] = memo
+        mentions.extend(memo['statuses'])
+
+    return mentions, total_searches
+
+  @staticmethod
+  def _is_mention_of(tweet, username):
+    """Returns True if a tweet replies to or @-mentions a username."""
+    username = username.lower()
+    mentioned = [m.get('screen_name', '').lower() for m in
+                 tweet.get('entities', {}).get('user_mentions', [])]
+    text = (tweet.get('full_text') or tweet.get('text') or '').lower()
+    return (username in mentioned
+            or (tweet.get('in_reply_to_screen_name') or '').lower() == username
+            or username in [m[1].lower() for m in MENTION_RE.findall(text)])
+
   def fetch_mentions(self, username, tweets, min_id=None):
     """Fetches a user's @-mentions and returns them as ActivityStreams.
 
@@ -635,6 +814,8 @@ class Twitter(source.Source):
     while cursor and cursor != '0':
       try:
         resp = self.urlopen(api_endpoint % cursor)
+      except source.RateLimited as e:
+        raise source.RateLimited(str(e), partial=values)
       except urllib.error.HTTPError as e:
         if e.code in HTTP_RATE_LIMIT_CODES:
           raise source.RateLimited(str(e), partial=values)
@@ -891,6 +1072,12 @@ class Twitter(source.Source):
     included in OAuth signatures.
     https://developer.twitter.com/en/docs/media/upload-media/uploading-media/media-best-practices
 
+    Fetches and checks all of the images first, and only uploads them if they
+    all pass, so that one bad image doesn't leave the others orphaned on
+    Twitter. Fetches and uploads concurrently if ``threads`` was passed to the
+    constructor; otherwise stops fetching at the first bad image. Each image is
+    streamed from its source URL straight into the upload.
+
     Args:
       images (sequence of dict): AS image objects, eg::
 
@@ -899,41 +1086,75 @@ class Twitter(source.Source):
     Returns:
       list of str, or CreationResult on error: media ids
     """
-    ids = []
-    for image in images:
-      url = image.get('url')
-      if not url:
-        continue
-
-      image_resp = util.urlopen(url)
-      error = self._check_media(url, image_resp, IMAGE_MIME_TYPES,
+    images = [image for image in images if image.get('url')]
+    # every fetched response, so we can close them all at the end, even if a
+    # fetch or upload raises
+    opened = []
+
+    def fetch(url):
+      resp = source.fetch_media(url) or util.urlopen(url)
+      opened.append(resp)
+      error = self._check_media(url, resp, IMAGE_MIME_TYPES,
                                 'JPG, PNG, GIF, and WEBP images', MAX_IMAGE_SIZE)
-      if error:
-        return error
+      return error, resp
+
+    try:
+      if self.threads:
+        fetched = source.run_concurrently(
+          [functools.partial(fetch, image['url']) for image in images],
+          threads=self.threads)
+      else:
+        fetched = []
+        for image in images:
+          fetched.append(fetch(image['url']))
+          if fetched[-1][0]:
+            break
+
+      for error, _ in fetched:
+        if error:
+          return error
+
+      return source.run_concurrently(
+        [functools.partial(self._upload_image, image, resp)
+         for image, (_, resp) in zip(images, fetched)],
+        threads=self.threads)
+    finally:
+      for resp in opened:
+        resp.close()
+
+  def _upload_image(self, image, image_resp):
+    """Uploads a single fetched image, along with its alt text.
 
+    Args:
+      image (dict): AS image object
+      image_resp: file-like image contents, eg from :func:`source.fetch_media`
+
+    Returns:
+      str: media id
+    """
+    headers = twitter_auth.auth_header(
+      API_UPLOAD_MEDIA, self.access_token_key, self.access_token_secret, 'POST')
+    resp = util.requests_post(API_UPLOAD_MEDIA,
+                              files={'media': image_resp},
+                              headers=headers,
+                              session=source.http_session(API_UPLOAD_MEDIA))
+    resp.raise_for_status()
+    logger.info(f'Got: {resp.text}')
+    media_id = source.load_json(resp.text, API_UPLOAD_MEDIA)['media_id_string']
+
+    alt = image.get('displayName')
+    if alt:
+      alt = util.ellipsize(alt, words=1000, chars=MAX_ALT_LENGTH)
       headers = twitter_auth.auth_header(
-        API_UPLOAD_MEDIA, self.access_token_key, self.access_token_secret, 'POST')
-      resp = util.requests_post(API_UPLOAD_MEDIA,
-                                files={'media': image_resp},
-                                headers=headers)
+        API_MEDIA_METADATA, self.access_token_key, self.access_token_secret, 'POST')
+      resp = util.requests_post(
+        API_MEDIA_METADATA,
+        json={'media_id': media_id, 'alt_text': {'text': alt}},
+        headers=headers, session=source.http_session(API_MEDIA_METADATA))
       resp.raise_for_status()
       logger.info(f'Got: {resp.text}')
-      media_id = source.load_json(resp.text, API_UPLOAD_MEDIA)['media_id_string']
-      ids.append(media_id)
-
-      alt = image.get('displayName')
-      if alt:
-        alt = util.ellipsize(alt, words=1000, chars=MAX_ALT_LENGTH)
-        headers = twitter_auth.auth_header(
-          API_MEDIA_METADATA, self.access_token_key, self.access_token_secret, 'POST')
-        resp = util.requests_post(
-          API_MEDIA_METADATA,
-          json={'media_id': media_id, 'alt_text': {'text': alt}},
-          headers=headers)
-        resp.raise_for_status()
-        logger.info(f'Got: {resp.text}')
 
-    return ids
+    return media_id
 
   def upload_video(self, url):
     """Uploads a video from a web URL using the chunked upload process.
@@ -947,47 +1168,51 @@ class Twitter(source.Source):
 
     https://developer.twitter.com/en/docs/media/upload-media/uploading-media/chunked-media-upload
 
+    The ``APPEND`` calls are sent concurrently, up to ``threads`` at a time, if
+    ``threads`` was passed to the constructor. Twitter allows that as long as
+    they all finish before ``FINALIZE``.
+
     Args:
       url (str): URL of video
 
     Returns:
       str, or CreationResult on error: media id
     """
-    video_resp = util.urlopen(url)
-    error = self._check_media(url, video_resp, VIDEO_MIME_TYPES, 'MP4 videos',
-                              MAX_VIDEO_SIZE)
-    if error:
-      return error
-
-    # INIT
-    media_id = self.urlopen(API_UPLOAD_MEDIA, data=urllib.parse.urlencode({
-      'command': 'INIT',
-      'media_type': 'video/mp4',
-      # https://twittercommunity.com/t/large-file-can-not-be-finalized-synchronously/82929/3
-      'media_category': 'tweet_video',
-      # _check_media checked that Content-Length is set
-      'total_bytes': video_resp.headers['Content-Length'],
-    }))['media_id_string']
-
-    # APPEND
-    headers = twitter_auth.auth_header(
-      API_UPLOAD_MEDIA, self.access_token_key, self.access_token_secret, 'POST')
+    video_resp = source.fetch_media(url) or util.urlopen(url)
+    try:
+      error = self._check_media(url, video_resp, VIDEO_MIME_TYPES, 'MP4 videos',
+                                MAX_VIDEO_SIZE)
+      if error:
+        return error
 
-    i = 0
-    while True:
-      chunk = util.FileLimiter(video_resp, UPLOAD_CHUNK_SIZE)
-      data = {
-        'command': 'APPEND',
-        'media_id': media_id,
-        'segment_index': i,
-      }
-      resp = util.requests_post(API_UPLOAD_MEDIA, data=data,
-                                files={'media': chunk}, headers=headers)
-      resp.raise_for_status()
+      # INIT
+      media_id = self.urlopen(API_UPLOAD_MEDIA, data=urllib.parse.urlencode({
+        'command': 'INIT',
+        'media_type': 'video/mp4',
+        # https://twittercommunity.com/t/large-file-can-not-be-finalized-synchronously/82929/3
+        'media_category': 'tweet_video',
+        # _check_media checked that Content-Length is set
+        'total_bytes': video_resp.headers['Content-Length'],
+      }))['media_id_string']
+
+      # APPEND
+      headers = twitter_auth.auth_header(
+        API_UPLOAD_MEDIA, self.access_token_key, self.access_token_secret, 'POST')
 
-      if chunk.ateof:
-        break
-      i += 1
+      def append(i, chunk):
+        data = {
+          'command': 'APPEND',
+          'media_id': media_id,
+          'segment_index': i,
+        }
+        resp = util.requests_post(API_UPLOAD_MEDIA, data=data,
+                                  files={'media': chunk}, headers=headers,
+                                  session=source.http_session(API_UPLOAD_MEDIA))
+        resp.raise_for_status()
+
+      source.run_chunked(video_resp, UPLOAD_CHUNK_SIZE, append, threads=self.threads)
+    finally:
+      video_resp.close()
 
     # FINALIZE
     resp = self.urlopen(API_UPLOAD_MEDIA, data=urllib.parse.urlencode({
@@ -1085,9 +1310,13 @@ class Twitter(source.Source):
     if not url.startswith('http'):
       url = API_BASE + url
 
+    endpoint = re.sub(r'/\d+', '/:id', urllib.parse.urlparse(url).path)
+    rate_limit_key = ('twitter', endpoint, self.access_token_key)
+
     def request():
-      resp = twitter_auth.signed_urlopen(
-        url, self.access_token_key, self.access_token_secret, **kwargs)
+      resp = source.rate_limited_call(rate_limit_key, lambda: (
+        twitter_auth.signed_urlopen(url, self.access_token_key,
+                                    self.access_token_secret, **kwargs)))
       return source.load_json(resp.read(), url) if parse_response else resp
 
     if ('data' not in kwargs and not
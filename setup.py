@@ -39,6 +39,7 @@ setup(name='granary',
           'beautifulsoup4>=4.8',
           'bech32',
           'brevity>=0.2.17',
+          'dag-cbor',
           'feedgen>=0.9',
           'feedparser',
           'html2text>=2019.8.11',
@@ -46,6 +47,7 @@ setup(name='granary',
           'jinja2>=2.10',
           'lexrpc>=0.2',
           'mf2util>=0.5.0',
+          'multiformats',
           'oauth-dropins>=6.1',
           'praw>=7.3.0',
           'python-dateutil>=2.8',
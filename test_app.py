@@ -1,17 +1,21 @@
 """Unit tests for app.py."""
 import copy
+import datetime
 from io import BytesIO
 import os.path
 import socket
+import threading
+from unittest.mock import patch
 from urllib.parse import quote
 
-from granary import as2
+from granary import as2, microformats2, source
 from granary.tests import test_bluesky, test_instagram, test_nostr
 from mox3 import mox
 from oauth_dropins.webutil import testutil, util
 from oauth_dropins.webutil.util import json_dumps, json_loads
 import requests
 
+import app as app_module
 from app import app, cache
 
 client = app.test_client()
@@ -190,6 +194,8 @@ class AppTest(testutil.TestCase):
   def setUp(self):
     super(AppTest, self).setUp()
     cache.clear()
+    microformats2.configure_author_cache()
+    self.addCleanup(microformats2.disable_author_cache)
 
   def expect_requests_get(self, *args, **kwargs):
     return super(AppTest, self).expect_requests_get(*args, stream=True, **kwargs)
@@ -298,6 +304,49 @@ class AppTest(testutil.TestCase):
 
     resp = client.get('/url?url=http://my/posts.json&input=json-mf2&output=html')
     self.assert_equals(200, resp.status_code)
+    # streamed responses don't have Content-Length
+    self.assertNotIn('Content-Length', resp.headers)
+    self.assert_equals('text/html; charset=utf-8', resp.headers['Content-Type'])
+    self.assert_multiline_equals(HTML % {
+      'body_class': '',
+      'extra': '',
+    }, resp.get_data(as_text=True), ignore_blanks=True)
+
+  def test_url_html_output_streamed_error_in_first_chunk(self):
+    self.expect_requests_get('http://my/posts.json', MF2)
+    self.mox.ReplayAll()
+
+    with patch.object(microformats2, 'object_to_html',
+                      side_effect=ValueError('foo')):
+      resp = client.get('/url?url=http://my/posts.json&input=json-mf2&output=html')
+    self.assert_equals(400, resp.status_code)
+    self.assertIn('Could not convert to html: foo', resp.get_data(as_text=True))
+
+  def test_url_html_output_streamed_error_after_first_chunk(self):
+    self.expect_requests_get('http://my/posts.json', MF2)
+    self.mox.ReplayAll()
+
+    with patch.object(app_module, 'STREAM_FIRST_CHUNK_SIZE', 1), \
+         patch.object(microformats2, 'object_to_html',
+                      side_effect=ValueError('foo')), \
+         patch.object(app_module.logger, 'warning') as warning:
+      resp = client.get('/url?url=http://my/posts.json&input=json-mf2&output=html')
+      self.assert_equals(200, resp.status_code)
+      body = resp.get_data(as_text=True)
+
+    self.assertTrue(body.startswith('<!DOCTYPE html>'), body)
+    self.assertNotIn('</html>', body)
+    warning.assert_called_once()
+
+  def test_url_html_output_cacheable_not_streamed(self):
+    self.expect_requests_get('http://my/posts.json', MF2)
+    self.mox.ReplayAll()
+
+    with patch.object(app_module, 'skip_response_cache', return_value=False):
+      resp = client.get('/url?url=http://my/posts.json&input=json-mf2&output=html')
+
+    self.assert_equals(200, resp.status_code)
+    self.assertIn('Content-Length', resp.headers)
     self.assert_multiline_equals(HTML % {
       'body_class': '',
       'extra': '',
@@ -351,6 +400,10 @@ class AppTest(testutil.TestCase):
 
     resp = client.get('/url?url=http://my/posts.html&input=html&output=atom')
     self.assert_equals(200, resp.status_code)
+    # streamed responses don't have Content-Length
+    self.assertNotIn('Content-Length', resp.headers)
+    self.assert_equals('application/atom+xml; charset=utf-8',
+                       resp.headers['Content-Type'])
     self.assert_multiline_in(ATOM_CONTENT, resp.get_data(as_text=True),
                              ignore_blanks=True)
 
@@ -591,6 +644,19 @@ not atom!
     self.assert_equals('application/stream+json', resp.headers['Content-Type'])
     self.assert_equals(RSS_ACTIVITIES, [a['object'] for a in resp.json['items']])
 
+  def test_url_rss_to_as1_count(self):
+    self.expect_requests_get('http://feed', RSS_CONTENT.replace(
+      '</channel>', '<item><description>more</description></item></channel>'))
+    self.mox.ReplayAll()
+
+    resp = client.get('/url?url=http://feed&input=rss&output=as1&count=1')
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals(RSS_ACTIVITIES, [a['object'] for a in resp.json['items']])
+
+  def test_url_bad_count(self):
+    resp = client.get('/url?url=http://feed&input=rss&output=as1&count=x')
+    self.assert_equals(400, resp.status_code)
+
   def test_url_rss_to_as1_parse_error(self):
     """feedparser.parse returns empty on bad input RSS."""
     self.expect_requests_get('http://feed', 'not valid xml')
@@ -613,6 +679,84 @@ not RSS!
     self.assert_equals(200, resp.status_code)
     self.assert_equals([], resp.json['items'])
 
+  def test_urls_merge_and_sort(self):
+    self.expect_requests_get('http://my/posts.as', [AS1[1]]).InAnyOrder()
+    self.expect_requests_get('http://other/feed', RSS_CONTENT).InAnyOrder()
+    self.expect_requests_get('http://my/more.as', [AS1[0]]).InAnyOrder()
+    self.mox.ReplayAll()
+
+    resp = client.get('/urls?url=http://my/posts.as&input=as1&url=http://other/feed&input=rss&url=http://my/more.as&input=as1&output=as1')
+    self.assert_equals(200, resp.status_code, resp.get_data(as_text=True))
+    self.assert_equals([RSS_ACTIVITIES[0]['content'], 'foo ☕ bar', 'baz baj'],
+                       [a['object']['content'] for a in resp.json['items']])
+    self.assertTrue(resp.json['sorted'])
+    self.assertNotIn('failures', resp.json)
+
+  def test_urls_single_input_partial_failure(self):
+    self.expect_requests_get('http://my/posts.as', AS1).InAnyOrder()
+    self.expect_requests_get('http://bad/posts.as', status_code=404).InAnyOrder()
+    self.expect_requests_get('http://not/json', 'foo').InAnyOrder()
+    self.mox.ReplayAll()
+
+    resp = client.get('/urls?url=http://my/posts.as&url=http://bad/posts.as&url=http://not/json&input=as1&output=as1')
+    self.assert_equals(200, resp.status_code, resp.get_data(as_text=True))
+    self.assert_equals(AS1, resp.json['items'])
+    self.assert_equals(['http://bad/posts.as', 'http://not/json'],
+                       [f['url'] for f in resp.json['failures']])
+    self.assertIn('Could not decode', resp.json['failures'][1]['error'])
+    self.assert_equals('http://bad/posts.as,http://not/json',
+                       resp.headers['Granary-Failed-Urls'])
+
+  def test_urls_atom_partial_failure_header(self):
+    self.expect_requests_get('http://my/posts.as', AS1).InAnyOrder()
+    self.expect_requests_get('http://bad/pösts,as', status_code=404).InAnyOrder()
+    self.mox.ReplayAll()
+
+    resp = client.get('/urls?url=http://my/posts.as&url=http://bad/pösts,as&input=as1&output=atom')
+    self.assert_equals(200, resp.status_code, resp.get_data(as_text=True))
+    self.assertIn('<feed', resp.get_data(as_text=True))
+    self.assert_equals('http://bad/p%C3%B6sts%2Cas',
+                       resp.headers['Granary-Failed-Urls'])
+
+  def test_urls_no_failures_no_header(self):
+    self.expect_requests_get('http://my/posts.as', AS1)
+    self.mox.ReplayAll()
+
+    resp = client.get('/urls?url=http://my/posts.as&input=as1&output=atom')
+    self.assert_equals(200, resp.status_code, resp.get_data(as_text=True))
+    self.assertNotIn('Granary-Failed-Urls', resp.headers)
+
+  def test_urls_deadline(self):
+    self.expect_requests_get('http://my/posts.as', AS1)
+    self.mox.ReplayAll()
+
+    done = threading.Event()
+    self.addCleanup(done.set)
+    orig_convert = app_module.convert
+    def slow_convert(*args, **kwargs):
+      done.wait()
+      return orig_convert(*args, **kwargs)
+
+    with patch.object(app_module, 'convert', slow_convert), \
+         patch.object(app_module, 'URLS_DEADLINE', datetime.timedelta(seconds=.1)):
+      resp = client.get('/urls?url=http://my/posts.as&input=as1&output=as1')
+
+    self.assert_equals(200, resp.status_code, resp.get_data(as_text=True))
+    self.assert_equals([], resp.json['items'])
+    self.assert_equals([{'url': 'http://my/posts.as', 'error': 'Timed out'}],
+                       resp.json['failures'])
+    self.assert_equals('http://my/posts.as', resp.headers['Granary-Failed-Urls'])
+
+  def test_urls_bad_params(self):
+    for query in ('input=as1',
+                  'url=http://a&url=http://b&input=as1&input=as1&input=as1',
+                  'url=http://a&input=nope',
+                  '&'.join(['input=as1'] + [f'url=http://{i}' for i in range(app_module.URLS_MAX + 1)]),
+                  ):
+      with self.subTest(query=query):
+        resp = client.get(f'/urls?{query}&output=as1')
+        self.assert_equals(400, resp.status_code)
+
   def test_url_as1_to_atom_reader_false(self):
     """reader=false should omit location in Atom output.
 
@@ -666,6 +810,24 @@ not RSS!
       ],
     }, resp.json)
 
+  def test_url_as1_to_bluesky_not_cached(self):
+    """bluesky.from_as1 output depends on the current time."""
+    source.enable_conversion_cache()
+    self.addCleanup(source.disable_conversion_cache)
+
+    note = {'objectType': 'note', 'content': 'foo'}
+    self.expect_requests_get('http://my/posts', [note]).MultipleTimes()
+    self.mox.ReplayAll()
+
+    created = []
+    for now in testutil.NOW, testutil.NOW + datetime.timedelta(days=1):
+      self.mox.stubs.Set(util, 'now', lambda tz=None, now=now: now)
+      resp = client.get('/url?url=http://my/posts&input=as1&output=bluesky&cache=false')
+      self.assert_equals(200, resp.status_code, resp.get_data(as_text=True))
+      created.append(resp.json['feed'][0]['createdAt'])
+
+    self.assertNotEqual(created[0], created[1])
+
   def test_url_as1_to_nostr(self):
     self.expect_requests_get('http://my/posts', [test_nostr.NOTE_AS1])
     self.mox.ReplayAll()